@@ -1,56 +1,207 @@
 from flask import Flask, jsonify
-from flask_cors import CORS
-from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
 import os
-from flask_migrate import Migrate
-from models import db, User, RefreshToken, Subscription, Campaign, Targeting, Creative, Payment
+from models import db
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Flask application
-app = Flask(__name__)
-
-# Flask configuration
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///instance/optimad.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'dev-jwt-secret')
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 3600))  # 1 hour
-app.config['JWT_REFRESH_TOKEN_EXPIRES'] = int(os.getenv('JWT_REFRESH_TOKEN_EXPIRES', 2592000))  # 30 days
-app.config['JWT_COOKIE_SECURE'] = os.getenv('JWT_COOKIE_SECURE', 'False').lower() == 'true'
-app.config['JWT_COOKIE_CSRF_PROTECT'] = os.getenv('JWT_COOKIE_CSRF_PROTECT', 'True').lower() == 'true'
-app.config['JWT_TOKEN_LOCATION'] = ['cookies']
-app.config['JWT_COOKIE_SAMESITE'] = 'Lax'
-
-# Initialize Flask extensions
-CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}}, supports_credentials=True)  # Frontend URL
-jwt = JWTManager(app)
-db.init_app(app)
-migrate = Migrate(app, db)
-
-# Register blueprints for routing
-from routes.auth import auth_bp
-from routes.campaigns import campaign_bp
-from routes.subscriptions import subscription_bp
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(campaign_bp, url_prefix='/campaigns')
-app.register_blueprint(subscription_bp, url_prefix='/subscriptions')
-
-# Setup error handlers
-from middleware.error_handler import register_error_handlers
-register_error_handlers(app)
-
-# Setup role-based access control
-from middleware.rbac import setup_rbac
-setup_rbac(jwt)
-
-@app.route('/')
-def index():
-    """Health check endpoint for the API."""
-    return jsonify({'status': 'API is running'}), 200
+# What each kind of process sets up; see create_app
+ROLES = ('api', 'worker', 'cli')
+
+def create_app(config=None, role='api'):
+    """Build the Flask application for one kind of process.
+
+    'api' serves HTTP: everything below. 'worker' runs background jobs
+    (webhook processing) with the database and provider clients but no
+    routes. 'cli' is for scripts and migrations: the database only.
+    Modules are imported per role, so processes do not pay for what they
+    never use; config overrides the environment-derived settings.
+    """
+    if role not in ROLES:
+        raise ValueError(f"Unknown role '{role}', expected one of {', '.join(ROLES)}")
+
+    # Initialize Flask application
+    app = Flask(__name__)
+
+    # Flask configuration
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///instance/optimad.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DB_ENGINE_PROFILE'] = os.getenv('DB_ENGINE_PROFILE', 'auto')  # 'dev', 'sqlite-wal' or 'postgres-prod'; 'auto' picks by DATABASE_URL
+    if os.getenv('DATABASE_REPLICA_URL'):
+        app.config['DATABASE_REPLICA_URL'] = os.getenv('DATABASE_REPLICA_URL')  # Read-only endpoints read from here
+    app.config['REPLICA_MAX_LAG'] = float(os.getenv('REPLICA_MAX_LAG', 5))  # Seconds behind the primary before reads fall back to it
+    app.config['REPLICA_LAG_CHECK_INTERVAL'] = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 1))
+    app.config['REPLICA_PIN_SECONDS'] = int(os.getenv('REPLICA_PIN_SECONDS', 10))  # Clients read from the primary this long after writing; keep above REPLICA_MAX_LAG
+    for setting in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT', 'DB_POOL_RECYCLE', 'DB_STATEMENT_CACHE_SIZE', 'SQLITE_BUSY_TIMEOUT'):
+        if os.getenv(setting):  # Overrides the profile
+            app.config[setting] = os.getenv(setting)
+    app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'dev-jwt-secret')
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 3600))  # 1 hour
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] = int(os.getenv('JWT_REFRESH_TOKEN_EXPIRES', 2592000))  # 30 days
+    app.config['JWT_COOKIE_SECURE'] = os.getenv('JWT_COOKIE_SECURE', 'False').lower() == 'true'
+    app.config['JWT_COOKIE_CSRF_PROTECT'] = os.getenv('JWT_COOKIE_CSRF_PROTECT', 'True').lower() == 'true'
+    app.config['JWT_TOKEN_LOCATION'] = ['cookies']
+    app.config['JWT_COOKIE_SAMESITE'] = 'Lax'
+    app.config['CLAIMS_VERSION_TTL'] = float(os.getenv('CLAIMS_VERSION_TTL', 30))  # Seconds a role-change check is cached
+    app.config['PASSWORD_HASH_ROUNDS'] = int(os.getenv('PASSWORD_HASH_ROUNDS', 29000))  # pbkdf2-sha256 iterations; older hashes are upgraded on login
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))  # 0 hashes in the request thread
+    app.config['PASSWORD_HASH_QUEUE_DEPTH'] = int(os.getenv('PASSWORD_HASH_QUEUE_DEPTH', 8))
+    app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+    app.config['REFRESH_TOKEN_SYNC_INTERVAL'] = float(os.getenv('REFRESH_TOKEN_SYNC_INTERVAL', 5))  # 0 checks refresh tokens against the database
+    app.config['REFRESH_TOKEN_SWEEP_INTERVAL'] = float(os.getenv('REFRESH_TOKEN_SWEEP_INTERVAL', 300))
+    app.config['REFRESH_TOKEN_SWEEP_BATCH'] = int(os.getenv('REFRESH_TOKEN_SWEEP_BATCH', 1000))
+    app.config['HTTP_CONNECT_TIMEOUT'] = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))  # Outbound provider calls
+    app.config['HTTP_READ_TIMEOUT'] = float(os.getenv('HTTP_READ_TIMEOUT', 10))
+    app.config['HTTP_RETRIES'] = int(os.getenv('HTTP_RETRIES', 2))
+    app.config['HTTP_POOL_MAXSIZE'] = int(os.getenv('HTTP_POOL_MAXSIZE', 10))
+    app.config['HTTP_BREAKER_THRESHOLD'] = int(os.getenv('HTTP_BREAKER_THRESHOLD', 5))
+    app.config['HTTP_BREAKER_RESET'] = float(os.getenv('HTTP_BREAKER_RESET', 30))
+    app.config['GOOGLE_CLIENT_ID'] = os.getenv('GOOGLE_CLIENT_ID')  # Comma-separated; checked against ID token aud
+    app.config['GOOGLE_JWKS_URL'] = os.getenv('GOOGLE_JWKS_URL', 'https://www.googleapis.com/oauth2/v3/certs')
+    app.config['GOOGLE_TOKENINFO_URL'] = os.getenv('GOOGLE_TOKENINFO_URL', 'https://www.googleapis.com/oauth2/v3/tokeninfo')
+    app.config['CREDENTIAL_REFRESH_MARGIN'] = float(os.getenv('CREDENTIAL_REFRESH_MARGIN', 60))  # Refresh cached provider tokens this long before expiry
+    if os.getenv('CREDENTIAL_CACHE_PATH'):
+        app.config['CREDENTIAL_CACHE_PATH'] = os.getenv('CREDENTIAL_CACHE_PATH')
+    app.config['PLAN_CATALOG_TTL'] = float(os.getenv('PLAN_CATALOG_TTL', 60))  # Seconds before plan changes made elsewhere reach this worker's cache
+    app.config['PLAN_CATALOG_MAX_AGE'] = int(os.getenv('PLAN_CATALOG_MAX_AGE', 300))  # Cache-Control max-age of GET /subscriptions/
+    app.config['SUBSCRIPTION_EXPIRY_BATCH'] = int(os.getenv('SUBSCRIPTION_EXPIRY_BATCH', 5000))  # Users expired per transaction by scripts/expire_subscriptions.py
+    app.config['CHECKOUT_WORKERS'] = int(os.getenv('CHECKOUT_WORKERS', 8))  # 0 calls the payment provider in the subscribe request
+    app.config['CHECKOUT_QUEUE_DEPTH'] = int(os.getenv('CHECKOUT_QUEUE_DEPTH', 64))
+    app.config['CHECKOUT_JOB_TIMEOUT'] = float(os.getenv('CHECKOUT_JOB_TIMEOUT', 120))  # Unfinished jobs older than this are reported failed
+    app.config['CHECKOUT_LONG_POLL_MAX'] = float(os.getenv('CHECKOUT_LONG_POLL_MAX', 20))  # Longest ?wait= on checkout status
+    app.config['WEBHOOK_WORKERS'] = int(os.getenv('WEBHOOK_WORKERS', 2))  # 0 processes each webhook in the request that received it
+    app.config['WEBHOOK_POLL_INTERVAL'] = float(os.getenv('WEBHOOK_POLL_INTERVAL', 5))
+    app.config['WEBHOOK_MAX_ATTEMPTS'] = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 8))  # Then the event is parked as 'dead'
+    app.config['JSON_ENCODER'] = os.getenv('JSON_ENCODER', 'auto')  # 'auto', 'orjson' or 'stdlib'
+    app.config['COUNTER_BUFFER_FLUSH_INTERVAL'] = float(os.getenv('COUNTER_BUFFER_FLUSH_INTERVAL', 1.0))  # 0 writes events synchronously
+    app.config['COUNTER_BUFFER_MAX_PENDING'] = int(os.getenv('COUNTER_BUFFER_MAX_PENDING', 50000))
+    app.config['COUNTER_BUFFER_FSYNC'] = os.getenv('COUNTER_BUFFER_FSYNC', 'False').lower() == 'true'
+    if os.getenv('COUNTER_BUFFER_JOURNAL_DIR'):
+        app.config['COUNTER_BUFFER_JOURNAL_DIR'] = os.getenv('COUNTER_BUFFER_JOURNAL_DIR')
+    app.config.update(config or {})
+    app.config['APP_ROLE'] = role
+
+    # Setup the database engine for the configured profile
+    from services.database import setup_database
+    setup_database(app)
+
+    # Every role writes campaigns somewhere, so register the listeners that keep
+    # users.campaign_count, the campaign summaries and the metric rollups in step
+    import services.campaign_quota
+    import services.summary_service
+    import services.rollup_service
+
+    # Flask-Migrate is only needed by `flask db ...` (the flask command sets FLASK_RUN_FROM_CLI)
+    if role == 'cli' or os.getenv('FLASK_RUN_FROM_CLI'):
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    if role in ('api', 'worker'):
+        # Setup pooled HTTP clients for outbound provider calls
+        from services.http_client import setup_http_clients
+        setup_http_clients(app)
+
+        # Setup the shared cache of provider access tokens
+        from services.credential_cache import setup_credential_cache
+        setup_credential_cache(app)
+
+        # Setup the webhook processing workers
+        from services.webhook_service import setup_webhook_workers
+        setup_webhook_workers(app)
+
+    if role == 'api':
+        setup_api(app)
+
+    return app
+
+def setup_api(app):
+    """Extensions, services, routes and middleware of the HTTP API."""
+    from flask_cors import CORS
+    from flask_jwt_extended import JWTManager
+
+    # Initialize Flask extensions
+    CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}}, supports_credentials=True)  # Frontend URL
+    jwt = JWTManager(app)
+
+    # Setup the password hashing pool
+    from services.password_hasher import setup_password_hasher
+    setup_password_hasher(app)
+
+    # Setup local Google ID token verification
+    from services.google_auth import setup_google_auth
+    setup_google_auth(app)
+
+    # Setup the cached subscription plan catalog
+    from services.plan_catalog import setup_plan_catalog
+    setup_plan_catalog(app)
+
+    # Setup the background checkout queue
+    from services.checkout_service import setup_checkout_queue
+    setup_checkout_queue(app)
+
+    # Setup the in-memory refresh token index and expired token sweeper
+    from services.refresh_token_index import setup_refresh_token_index
+    setup_refresh_token_index(app)
+
+    # Setup the write-behind buffer for campaign counters
+    from services.counter_buffer import setup_counter_buffer
+    setup_counter_buffer(app)
+
+    # Register blueprints for routing
+    from routes.auth import auth_bp
+    from routes.campaigns import campaign_bp
+    from routes.subscriptions import subscription_bp
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(campaign_bp, url_prefix='/campaigns')
+    app.register_blueprint(subscription_bp, url_prefix='/subscriptions')
+
+    # Setup error handlers
+    from middleware.error_handler import register_error_handlers
+    register_error_handlers(app)
+
+    # Setup the JSON response encoder
+    from middleware.json_encoder import setup_json_encoder
+    setup_json_encoder(app)
+
+    # Setup per-request SQL query counting
+    from middleware.query_counter import setup_query_counter
+    setup_query_counter(app)
+
+    # Setup read-replica routing for read-only endpoints
+    from middleware.read_replica import setup_read_replica
+    setup_read_replica(app)
+
+    # Setup role-based access control
+    from middleware.rbac import setup_rbac, require_role
+    setup_rbac(jwt)
+
+    @app.route('/')
+    def index():
+        """Health check endpoint for the API."""
+        return jsonify({'status': 'API is running'}), 200
+
+    @app.route('/providers/stats')
+    @require_role('admin')
+    def provider_stats():
+        """Latency, error and circuit breaker state of outbound provider calls from this worker."""
+        return jsonify(app.extensions['http_clients'].stats()), 200
+
+    @app.route('/db/stats')
+    @require_role('admin')
+    def database_stats():
+        """Engine profile, pool usage and connection checkout waits of this worker."""
+        return jsonify(app.extensions['database'].stats()), 200
+
+def __getattr__(name):
+    # `gunicorn app:app`, `flask --app app` and `from app import app` build the
+    # app on first access, in the role given by APP_ROLE; importing create_app does not
+    if name == 'app':
+        globals()['app'] = create_app(role=os.getenv('APP_ROLE', 'api'))
+        return globals()['app']
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,91 @@
+import gc
+import os
+import multiprocessing
+from dotenv import load_dotenv
+
+# Production server settings: `gunicorn` in this directory picks this file up
+# (or pass `-c gunicorn.conf.py`). Settings come from the environment, like app.py.
+load_dotenv()
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+wsgi_app = 'app:app'
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 5000)}")
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')  # 'sync', 'gthread' or 'gevent'
+if worker_class not in WORKER_CLASSES:
+    raise ValueError(f"Unknown GUNICORN_WORKER_CLASS '{worker_class}', expected one of {', '.join(WORKER_CLASSES)}")
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))  # Per worker, gthread only; keep within the DB pool size
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))  # Per worker, gevent only
+
+# Recycle each worker after this many requests to cap slow leaks; the jitter
+# spreads the restarts so the workers do not all restart at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))  # 0 never recycles
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))  # In-flight requests and buffered counters finish on restart
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))  # Seconds; above the load balancer's idle timeout is not needed
+
+# Heartbeat files on tmpfs, so a slow disk cannot get workers killed as hung
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Build the app once in the master and fork it, so the workers share its
+# memory copy-on-write and start without importing anything
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# Keep the collector from touching the master's objects in the workers:
+# reference counts are written in place, so a collection copies every page it
+# visits. Nothing is collected while the app loads, everything allocated by
+# then is frozen before each fork, and collection resumes in the worker.
+gc_freeze = preload_app and os.getenv('GUNICORN_GC_FREEZE', 'True').lower() == 'true'
+if gc_freeze:
+    gc.disable()
+
+# gevent has to patch the standard library before the app creates any lock or
+# socket, which with preload_app is before the master imports the app
+if worker_class == 'gevent' and preload_app:
+    from gevent import monkey
+    monkey.patch_all()
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG')  # '-' for stdout
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+def when_ready(server):
+    if not preload_app:
+        return
+    app = server.app.wsgi()
+    settings = app.extensions['database'].settings
+    pool_limit = settings.get('pool_size', 0) + settings.get('max_overflow', 0)
+    if worker_class == 'gthread' and pool_limit and threads > pool_limit:
+        server.log.warning(f"{threads} threads per worker share {pool_limit} database connections; "
+                           f"requests will queue for a connection")
+
+def pre_fork(server, worker):
+    if gc_freeze:
+        gc.freeze()
+
+def post_fork(server, worker):
+    if gc_freeze:
+        gc.enable()
+    if preload_app:
+        # Connections (if any) opened while the master built the app belong to the master
+        from services.database import dispose_inherited_connections
+        dispose_inherited_connections(server.app.wsgi())
+
+def post_worker_init(worker):
+    # Start the counter buffer now rather than on the first ingested event, so
+    # journals left by a crashed worker are replayed even if no event arrives
+    buffer = worker.wsgi.extensions.get('counter_buffer')
+    if buffer is not None:
+        buffer.start()
+
+def worker_exit(server, worker):
+    # Flush the buffered counters while the worker is still inside
+    # graceful_timeout, rather than leaving them to atexit at interpreter exit
+    buffer = server.app.wsgi().extensions.get('counter_buffer')
+    if buffer is not None:
+        buffer.close()
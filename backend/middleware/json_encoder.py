@@ -0,0 +1,51 @@
+from flask.json.provider import DefaultJSONProvider
+import serializers
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes responses with orjson when it is available.
+    
+    Unlike Flask's default provider, datetimes are rendered as ISO 8601 strings
+    (matching what the models used to produce by hand) and keys are not sorted.
+    Responses are built straight from the encoded bytes.
+    """
+    sort_keys = False
+    
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', serializers.json_default)
+            return super().dumps(obj, **kwargs)
+        return serializers.json_dumps_bytes(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return serializers.json_loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            serializers.json_dumps_bytes(obj, indent=indent) + b'\n',
+            mimetype=self.mimetype
+        )
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """Flask's default provider, with ISO 8601 datetimes to match FastJSONProvider."""
+    default = staticmethod(serializers.json_default)
+
+def setup_json_encoder(app):
+    """Install the response encoder selected by the JSON_ENCODER setting.
+    
+    'auto' (the default) uses orjson when it is installed, 'orjson' requires
+    it, and 'stdlib' always uses the json module.
+    """
+    encoder = app.config.get('JSON_ENCODER', 'auto')
+    if encoder not in ('auto', 'orjson', 'stdlib'):
+        raise ValueError(f'Unknown JSON_ENCODER: {encoder}')
+    if encoder == 'orjson' and serializers.orjson is None:
+        raise RuntimeError('JSON_ENCODER is set to orjson but orjson is not installed')
+    
+    if encoder == 'stdlib' or serializers.orjson is None:
+        app.json = StdlibJSONProvider(app)
+    else:
+        app.json = FastJSONProvider(app)
@@ -0,0 +1,57 @@
+from functools import wraps
+from flask import current_app, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+class QueryBudgetExceeded(Exception):
+    """Raised when an endpoint issues more SQL statements than its budget allows."""
+
+# Registered once per process: a listener added per app would count every
+# statement once for each app built (tests and scripts build several)
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+def setup_query_counter(app):
+    """Count the SQL statements issued while handling each request.
+    
+    The count is kept on flask.g and, in debug or testing mode, returned in
+    the X-Query-Count response header so tests can assert on it.
+    """
+    @app.before_request
+    def reset_query_count():
+        # g outlives the request when a test keeps an app context pushed
+        g.query_count = 0
+    
+    @app.after_request
+    def add_query_count_header(response):
+        if app.debug or app.testing:
+            response.headers['X-Query-Count'] = str(get_query_count())
+        return response
+
+def get_query_count():
+    """Return the number of SQL statements issued so far in this request."""
+    return g.get('query_count', 0)
+
+def query_budget(max_queries):
+    """Decorator that flags endpoints issuing more than max_queries statements.
+    
+    Budget overruns raise QueryBudgetExceeded when QUERY_BUDGET_STRICT is set
+    (the default under app.testing) and are logged as warnings otherwise.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            response = f(*args, **kwargs)
+            
+            query_count = get_query_count()
+            if query_count > max_queries:
+                message = f'{f.__name__} issued {query_count} queries (budget {max_queries})'
+                if current_app.config.get('QUERY_BUDGET_STRICT', current_app.testing):
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+            
+            return response
+        return wrapper
+    return decorator
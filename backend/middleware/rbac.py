@@ -1,30 +1,86 @@
+import time
+import threading
 from functools import wraps
-from flask import jsonify, request
-from flask_jwt_extended import JWTManager
+from flask import jsonify, request, current_app
+from flask_jwt_extended import JWTManager, get_jwt, get_jwt_identity, verify_jwt_in_request
+
+# user_id -> (claims_version, checked_at) for users seen recently by this process
+_claims_versions = {}
+_claims_versions_lock = threading.Lock()
 
 def setup_rbac(jwt: JWTManager):
     """Setup JWT claims to include user role."""
-    
+
     @jwt.additional_claims_loader
     def add_claims_to_access_token(identity):
-        from models import User
-        user = User.query.get(identity)
+        from models import db, User
+        # Login and refresh already loaded the user, so this is normally an identity-map hit
+        user = db.session.get(User, int(identity))
         if user:
-            return {'role': user.role}
+            return {'role': user.role, 'ver': user.claims_version or 0}
         return {'role': 'guest'}
 
+def load_current_user():
+    """Return the User for the request's JWT, loading it at most once per request."""
+    if not hasattr(request, 'user'):
+        from models import db, User
+        user_id = get_jwt_identity()
+        request.user = db.session.get(User, int(user_id)) if user_id else None
+    return request.user
+
+def get_claims_version(user_id):
+    """Current users.claims_version for user_id, re-read at most every CLAIMS_VERSION_TTL seconds."""
+    ttl = current_app.config.get('CLAIMS_VERSION_TTL', 30)
+    now = time.monotonic()
+    cached = _claims_versions.get(user_id)
+    if cached and now - cached[1] < ttl:
+        return cached[0]
+
+    from models import db, User
+    version = db.session.query(User.claims_version).filter(User.id == user_id).scalar()
+    with _claims_versions_lock:
+        _claims_versions[user_id] = (version, now)
+    return version
+
+def invalidate_claims(user_id):
+    """Bump a user's claims version so tokens minted with the old role are no longer trusted.
+
+    Other processes notice within CLAIMS_VERSION_TTL seconds; the caller commits.
+    """
+    from models import User
+    User.query.filter_by(id=user_id).update(
+        {User.claims_version: User.claims_version + 1}, synchronize_session=False
+    )
+    with _claims_versions_lock:
+        _claims_versions.pop(int(user_id), None)
+
+def get_current_role():
+    """Role for the request: from the token claims when they are current, otherwise from the database."""
+    verify_jwt_in_request(optional=True)
+    user_id = get_jwt_identity()
+    if not user_id:
+        return None
+
+    claims = get_jwt()
+    if 'ver' in claims and claims['ver'] == get_claims_version(int(user_id)):
+        return claims.get('role')
+
+    # Token predates the last role change (or carries no version), so trust the row instead
+    user = load_current_user()
+    return user.role if user else None
+
 def require_role(role):
     """Decorator to enforce role-based access control."""
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            # Get the current user from the request (assumes authentication middleware has run)
-            user = getattr(request, 'user', None)
-            if not user:
+            # Get the current user's role from the token
+            current_role = get_current_role()
+            if not current_role:
                 return jsonify({'error': 'Unauthorized'}), 401
 
             # Check if the user has the required role
-            if user.role != role:
+            if current_role != role:
                 return jsonify({'error': 'Forbidden', 'message': f'Role {role} required'}), 403
 
             # User has the required role, proceed with the function
@@ -37,16 +93,18 @@ def require_permission(permission):
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            # Get the current user from the request
-            user = getattr(request, 'user', None)
-            if not user:
+            from models import User
+
+            # Get the current user's role from the token
+            current_role = get_current_role()
+            if not current_role:
                 return jsonify({'error': 'Unauthorized'}), 401
 
-            # Check if the user has the required permission
-            if not user.has_permission(permission):
+            # Check if the role has the required permission
+            if not User.role_has_permission(current_role, permission):
                 return jsonify({'error': 'Forbidden', 'message': f'Permission {permission} required'}), 403
 
             # User has the required permission, proceed with the function
             return f(*args, **kwargs)
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,208 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, request, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+
+# Cookie that keeps a client on the primary for a while after it wrote
+PIN_COOKIE = 'db_primary_until'
+
+# Seconds the replica is behind the primary, or NULL when that is unknown
+LAG_QUERIES = {
+    # Caught up when everything received has been replayed; otherwise the age of the last replayed commit
+    'postgresql': """
+        SELECT CASE
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+    """,
+    # Age of the copy, stamped by scripts/sqlite_replica.py
+    'sqlite': "SELECT strftime('%s', 'now') - copied_at FROM replica_heartbeat WHERE id = 1"
+}
+
+def is_write(clause):
+    """Whether a statement must run on the primary: DML and SELECT ... FOR UPDATE."""
+    return clause is not None and (
+        getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None
+    )
+
+class RoutingSession(Session):
+    """db.session that sends the reads of read-only requests to the replica.
+
+    Everything else goes to the primary: requests not marked @read_only,
+    work outside a request, flushes and DML, and any query after the
+    request has written.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not is_write(clause) and replica_selected():
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def replica_selected():
+    return has_request_context() and g.get('db_use_replica', False) and not g.get('db_wrote', False)
+
+def _mark_write():
+    if has_request_context():
+        g.db_wrote = True
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    _mark_write()
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _after_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_write()
+
+class ReplicaMonitor:
+    """Tracks how far the replica is behind and whether reads may use it.
+
+    The lag is re-checked at most every check_interval seconds, by whichever
+    request gets there first; the rest use the last result. A replica more
+    than max_lag seconds behind, or one that cannot be reached or cannot
+    report its lag, is skipped until a later check finds it caught up.
+    """
+
+    def __init__(self, engine, max_lag=5.0, check_interval=1.0):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self.healthy = False
+        self.last_error = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'replica': 0, 'pinned': 0, 'lagging': 0}
+
+    def available(self):
+        now = time.monotonic()
+        if (self._checked_at is None or now - self._checked_at >= self.check_interval) \
+                and self._lock.acquire(blocking=False):
+            try:
+                self._check()
+                self._checked_at = now
+            finally:
+                self._lock.release()
+        return self.healthy
+
+    def _check(self):
+        try:
+            with self.engine.connect() as connection:
+                lag = connection.execute(text(LAG_QUERIES[self.engine.dialect.name])).scalar()
+            self.lag = float(lag) if lag is not None else None
+            self.last_error = None if lag is not None else 'replica did not report its lag'
+        except Exception as e:
+            self.lag = None
+            self.last_error = str(e)
+
+        healthy = self.lag is not None and self.lag <= self.max_lag
+        if healthy != self.healthy:
+            if healthy:
+                logger.info(f"Read replica caught up (lag {self.lag:.1f}s); routing read-only requests to it")
+            else:
+                reason = self.last_error or f'{self.lag:.1f}s behind, over {self.max_lag}s'
+                logger.warning(f"Read replica unavailable ({reason}); reading from the primary")
+        self.healthy = healthy
+
+    def record(self, route):
+        with self._stats_lock:
+            self._stats[route] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        data.update({'healthy': self.healthy, 'lag_seconds': self.lag, 'max_lag': self.max_lag, 'last_error': self.last_error})
+        return data
+
+def pinned_to_primary():
+    """Whether this client wrote recently enough that the replica may not show it yet."""
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def read_only(f):
+    """Decorator for endpoints that only read: their queries may go to the read replica.
+
+    Falls back to the primary when no replica is configured, the replica lags,
+    or the client wrote within the last REPLICA_PIN_SECONDS.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        monitor = current_app.extensions.get('read_replica')
+        if monitor is not None:
+            if pinned_to_primary():
+                monitor.record('pinned')
+            elif not monitor.available():
+                monitor.record('lagging')
+            else:
+                monitor.record('replica')
+                g.db_use_replica = True
+        return f(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def use_primary():
+    """Run the enclosed reads on the primary even inside a read-only request."""
+    previous = g.get('db_use_replica', False) if has_request_context() else False
+    if has_request_context():
+        g.db_use_replica = False
+    try:
+        yield
+    finally:
+        if has_request_context():
+            g.db_use_replica = previous
+
+def setup_read_replica(app):
+    """Route read-only requests to the REPLICA_BIND engine when DATABASE_REPLICA_URL is set.
+
+    A response to a request that wrote sets a cookie keeping that client on
+    the primary for REPLICA_PIN_SECONDS (read-your-writes across workers);
+    keep it above REPLICA_MAX_LAG.
+    """
+    from models import db
+
+    with app.app_context():
+        engine = db.engines.get(REPLICA_BIND)
+    if engine is None:
+        return None
+
+    monitor = ReplicaMonitor(
+        engine,
+        max_lag=float(app.config.get('REPLICA_MAX_LAG', 5)),
+        check_interval=float(app.config.get('REPLICA_LAG_CHECK_INTERVAL', 1))
+    )
+    app.extensions['read_replica'] = monitor
+    pin_seconds = int(app.config.get('REPLICA_PIN_SECONDS', 10))
+
+    @app.before_request
+    def reset_routing():
+        # g outlives the request when a test keeps an app context pushed
+        g.db_use_replica = False
+        g.db_wrote = False
+
+    @app.after_request
+    def pin_writers_to_primary(response):
+        if g.get('db_wrote', False):
+            response.set_cookie(
+                PIN_COOKIE,
+                str(int(time.time()) + pin_seconds),
+                max_age=pin_seconds,
+                httponly=True,
+                secure=app.config.get('JWT_COOKIE_SECURE', False),
+                samesite='Lax'
+            )
+        return response
+
+    return monitor
@@ -0,0 +1,46 @@
+"""Add indexes recommended by the index advisor
+
+Revision ID: 2e7db06c1e14
+Revises: 7c1d5e8f3a24
+Create Date: 2026-10-17 20:49:47.635501
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e7db06c1e14'
+down_revision = '7c1d5e8f3a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ### commands generated by scripts/index_advisor.py - please review! ###
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.create_index('ix_campaigns_user_id_start_date_id', ['user_id', 'start_date', 'id'], unique=False)
+        batch_op.create_index('ix_campaigns_user_id_status_platform_created_at', ['user_id', 'status', 'platform', 'created_at'], unique=False)
+        batch_op.create_index('ix_campaigns_user_id_updated_at_id', ['user_id', 'updated_at', 'id'], unique=False)
+
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.create_index('ix_payments_user_id_created_at', ['user_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('refresh_tokens', schema=None) as batch_op:
+        batch_op.create_index('ix_refresh_tokens_user_id_revoked_at', ['user_id', 'revoked_at'], unique=False)
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # ### commands generated by scripts/index_advisor.py - please review! ###
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.drop_index('ix_campaigns_user_id_start_date_id')
+        batch_op.drop_index('ix_campaigns_user_id_status_platform_created_at')
+        batch_op.drop_index('ix_campaigns_user_id_updated_at_id')
+
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.drop_index('ix_payments_user_id_created_at')
+
+    with op.batch_alter_table('refresh_tokens', schema=None) as batch_op:
+        batch_op.drop_index('ix_refresh_tokens_user_id_revoked_at')
+    # ### end Alembic commands ###
@@ -1,12 +1,91 @@
 
 from flask_sqlalchemy import SQLAlchemy
+import uuid
 from datetime import datetime
-from passlib.hash import pbkdf2_sha256
+from services.password_hasher import get_password_hasher
+from middleware.read_replica import RoutingSession
 
-db = SQLAlchemy()
+from serializers import compile_serializer, json_loads, JSON_LIST, NESTED
+
+# Read-only requests may read from a replica, see middleware/read_replica.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def serialize_fields(obj, fields):
+    """Serialize the named attributes of a model instance or query row."""
+    data = {}
+    for field in fields:
+        value = getattr(obj, field)
+        if isinstance(value, db.Model):
+            value = value.to_dict()
+        data[field] = value
+    return data
+
+# Serializers are generated once at import time. Datetimes are left for the
+# response encoder to format.
+serialize_user = compile_serializer('user', (
+    ('id', 'id'),
+    ('email', 'email'),
+    ('firstName', 'first_name'),
+    ('lastName', 'last_name'),
+    ('role', 'role'),
+    ('subscriptionStatus', 'subscription_status'),
+    ('subscriptionEndDate', 'subscription_end_date'),
+    ('createdAt', 'created_at')
+))
+
+serialize_subscription = compile_serializer('subscription', (
+    ('id', 'id'),
+    ('name', 'name'),
+    ('price', 'price'),
+    ('duration_days', 'duration_days'),
+    ('features', 'features', JSON_LIST),
+    ('max_campaigns', 'max_campaigns'),
+    ('is_active', 'is_active')
+))
+
+serialize_campaign = compile_serializer('campaign', (
+    ('id', 'id'),
+    ('name', 'name'),
+    ('objective', 'objective'),
+    ('platform', 'platform'),
+    ('budget_type', 'budget_type'),
+    ('budget', 'budget'),
+    ('start_date', 'start_date'),
+    ('end_date', 'end_date'),
+    ('status', 'status'),
+    ('impressions', 'impressions'),
+    ('clicks', 'clicks'),
+    ('spend', 'spend'),
+    ('targeting', 'targeting', NESTED),
+    ('creative', 'creative', NESTED),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at')
+))
+
+serialize_targeting = compile_serializer('targeting', (
+    ('locations', 'locations', JSON_LIST),
+    ('age_min', 'age_min'),
+    ('age_max', 'age_max'),
+    ('gender', 'gender'),
+    ('interests', 'interests', JSON_LIST)
+))
+
+serialize_creative = compile_serializer('creative', (
+    ('headline', 'headline'),
+    ('description', 'description'),
+    ('primary_text', 'primary_text'),
+    ('call_to_action', 'call_to_action'),
+    ('image_url', 'image_url')
+))
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Serves the expiry sweep; partial, so the many free accounts are not indexed
+        db.Index('ix_users_subscription_status_end_date', 'subscription_status', 'subscription_end_date',
+                 postgresql_where=db.text("subscription_status IN ('active', 'canceled')"),
+                 sqlite_where=db.text("subscription_status IN ('active', 'canceled')")),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -22,38 +101,38 @@ class User(db.Model):
     
     # RBAC fields
     role = db.Column(db.String(20), default='user')  # 'admin', 'user', 'guest'
+    claims_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped when role changes
     
     # Subscription fields
     subscription_id = db.Column(db.Integer, db.ForeignKey('subscriptions.id'), nullable=True)
     subscription_status = db.Column(db.String(20), default='free')  # 'free', 'active', 'canceled', 'expired'
     subscription_end_date = db.Column(db.DateTime, nullable=True)
+    campaign_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Maintained on campaign insert/delete, checked against max_campaigns
     
     # Relationship with campaigns
     campaigns = db.relationship('Campaign', backref='user', lazy=True)
     refresh_tokens = db.relationship('RefreshToken', backref='user', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = pbkdf2_sha256.hash(password)
+        self.password_hash = get_password_hasher().hash(password)
         
     def check_password(self, password):
         if self.password_hash:
-            return pbkdf2_sha256.verify(password, self.password_hash)
+            return get_password_hasher().verify(password, self.password_hash)
         return False
     
+    def password_needs_rehash(self):
+        return bool(self.password_hash) and get_password_hasher().needs_update(self.password_hash)
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'email': self.email,
-            'firstName': self.first_name,
-            'lastName': self.last_name,
-            'role': self.role,
-            'subscriptionStatus': self.subscription_status,
-            'subscriptionEndDate': self.subscription_end_date.isoformat() if self.subscription_end_date else None,
-            'createdAt': self.created_at.isoformat()
-        }
+        return serialize_user(self)
     
     def has_permission(self, permission):
-        if self.role == 'admin':
+        return User.role_has_permission(self.role, permission)
+    
+    @staticmethod
+    def role_has_permission(role, permission):
+        if role == 'admin':
             return True
         
         permissions = {
@@ -61,20 +140,25 @@ class User(db.Model):
             'guest': ['view_own_campaigns']
         }
         
-        return permission in permissions.get(self.role, [])
+        return permission in permissions.get(role, [])
 
 class RefreshToken(db.Model):
     __tablename__ = 'refresh_tokens'
+    __table_args__ = (
+        # Serves revoking a user's live tokens (user_id = ? AND revoked_at IS NULL)
+        db.Index('ix_refresh_tokens_user_id_revoked_at', 'user_id', 'revoked_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     token = db.Column(db.String(255), unique=True, nullable=False)  # JWT ID (jti)
-    expires_at = db.Column(db.DateTime, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=True, index=True)
     
     def is_valid(self):
         """Check if the refresh token is still valid."""
-        return datetime.utcnow() < self.expires_at
+        return self.revoked_at is None and datetime.utcnow() < self.expires_at
 
 class Subscription(db.Model):
     __tablename__ = 'subscriptions'
@@ -91,19 +175,19 @@ class Subscription(db.Model):
     users = db.relationship('User', backref='subscription', lazy=True)
     
     def to_dict(self):
-        import json
-        return {
-            'id': self.id,
-            'name': self.name,
-            'price': self.price,
-            'duration_days': self.duration_days,
-            'features': json.loads(self.features) if self.features else [],
-            'max_campaigns': self.max_campaigns,
-            'is_active': self.is_active
-        }
+        return serialize_subscription(self)
 
 class Campaign(db.Model):
     __tablename__ = 'campaigns'
+    __table_args__ = (
+        # Supports keyset pagination of a user's campaigns in created_at order
+        db.Index('ix_campaigns_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        # Filtered lists and their total_count; recommended by scripts/index_advisor.py
+        db.Index('ix_campaigns_user_id_status_platform_created_at', 'user_id', 'status', 'platform', 'created_at'),
+        # Keyset pagination by the other date columns
+        db.Index('ix_campaigns_user_id_start_date_id', 'user_id', 'start_date', 'id'),
+        db.Index('ix_campaigns_user_id_updated_at_id', 'user_id', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -127,26 +211,137 @@ class Campaign(db.Model):
     targeting = db.relationship('Targeting', backref='campaign', uselist=False, cascade="all, delete-orphan")
     creative = db.relationship('Creative', backref='campaign', uselist=False, cascade="all, delete-orphan")
     
+    # Fields that can be requested through sparse fieldsets (?fields=)
+    COLUMN_FIELDS = ('id', 'name', 'objective', 'platform', 'budget_type', 'budget', 'start_date', 'end_date',
+                     'status', 'impressions', 'clicks', 'spend', 'created_at', 'updated_at')
+    RELATIONSHIP_FIELDS = ('targeting', 'creative')
+    
+    def to_dict(self, fields=None):
+        if fields is not None:
+            return serialize_fields(self, fields)
+        return serialize_campaign(self)
+
+class CampaignSummary(db.Model):
+    __tablename__ = 'campaign_summaries'
+    
+    # Per-user totals over all campaigns, kept current by services/summary_service.py
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    campaign_count = db.Column(db.Integer, nullable=False, default=0)
+    active_campaign_count = db.Column(db.Integer, nullable=False, default=0)
+    total_budget = db.Column(db.Float, nullable=False, default=0.0)
+    impressions = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    spend = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
     def to_dict(self):
+        impressions = self.impressions or 0
+        clicks = self.clicks or 0
+        spend = self.spend or 0.0
         return {
-            'id': self.id,
-            'name': self.name,
-            'objective': self.objective,
-            'platform': self.platform,
-            'budget_type': self.budget_type,
-            'budget': self.budget,
-            'start_date': self.start_date.isoformat(),
-            'end_date': self.end_date.isoformat() if self.end_date else None,
-            'status': self.status,
-            'impressions': self.impressions,
-            'clicks': self.clicks,
-            'spend': self.spend,
-            'targeting': self.targeting.to_dict() if self.targeting else None,
-            'creative': self.creative.to_dict() if self.creative else None,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'campaign_count': self.campaign_count,
+            'active_campaigns': self.active_campaign_count,
+            'total_budget': self.total_budget,
+            'impressions': impressions,
+            'clicks': clicks,
+            'spend': spend,
+            'ctr': clicks / impressions * 100 if impressions else 0.0,
+            'cpc': spend / clicks if clicks else 0.0,
+            'budget_utilization': spend / self.total_budget * 100 if self.total_budget else 0.0,
+            'updated_at': self.updated_at
         }
 
+class CampaignMetric(db.Model):
+    __tablename__ = 'campaign_metrics'
+    __table_args__ = (
+        # One row per campaign per hour; also serves range scans by campaign
+        db.UniqueConstraint('campaign_id', 'bucket_start', name='uq_campaign_metrics_campaign_id_bucket_start'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id', ondelete='CASCADE'), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)  # Start of the hour the counts belong to
+    impressions = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    spend = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, nullable=True, index=True)  # Last write; drives incremental rollup refresh
+
+# Rollups of campaign_metrics, rebuilt incrementally by services/rollup_service.py
+class CampaignMetricDaily(db.Model):
+    __tablename__ = 'campaign_metrics_daily'
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'bucket_start', name='uq_campaign_metrics_daily_campaign_id_bucket_start'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id', ondelete='CASCADE'), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)  # Midnight UTC
+    impressions = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    spend = db.Column(db.Float, nullable=False, default=0.0)
+
+class CampaignMetricMonthly(db.Model):
+    __tablename__ = 'campaign_metrics_monthly'
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'bucket_start', name='uq_campaign_metrics_monthly_campaign_id_bucket_start'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id', ondelete='CASCADE'), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)  # First day of the month
+    impressions = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    spend = db.Column(db.Float, nullable=False, default=0.0)
+
+class UserPlatformMetricDaily(db.Model):
+    __tablename__ = 'user_platform_metrics_daily'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'platform', 'bucket_start', name='uq_user_platform_metrics_daily_user_id_platform_bucket_start'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    platform = db.Column(db.String(20), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)  # Midnight UTC
+    impressions = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    spend = db.Column(db.Float, nullable=False, default=0.0)
+
+class UserPlatformMetricMonthly(db.Model):
+    __tablename__ = 'user_platform_metrics_monthly'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'platform', 'bucket_start', name='uq_user_platform_metrics_monthly_user_id_platform_bucket_start'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    platform = db.Column(db.String(20), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)  # First day of the month
+    impressions = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    spend = db.Column(db.Float, nullable=False, default=0.0)
+
+class RollupState(db.Model):
+    __tablename__ = 'rollup_state'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    high_water_mark = db.Column(db.DateTime, nullable=True)  # campaign_metrics.updated_at covered by the last refresh
+    refreshed_at = db.Column(db.DateTime, nullable=True)
+
+class RollupInvalidation(db.Model):
+    __tablename__ = 'rollup_invalidations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)  # Whose per-platform rollups the next refresh rebuilds whole
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CounterFlush(db.Model):
+    __tablename__ = 'counter_flushes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    segment = db.Column(db.String(255), unique=True, nullable=False)  # Counter journal segment applied by this flush
+    flushed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Targeting(db.Model):
     __tablename__ = 'targeting'
     
@@ -159,14 +354,7 @@ class Targeting(db.Model):
     interests = db.Column(db.String(500), nullable=True)  # JSON string of interests
     
     def to_dict(self):
-        import json
-        return {
-            'locations': json.loads(self.locations) if self.locations else [],
-            'age_min': self.age_min,
-            'age_max': self.age_max,
-            'gender': self.gender,
-            'interests': json.loads(self.interests) if self.interests else []
-        }
+        return serialize_targeting(self)
 
 class Creative(db.Model):
     __tablename__ = 'creative'
@@ -180,25 +368,88 @@ class Creative(db.Model):
     image_url = db.Column(db.String(200), nullable=True)
     
     def to_dict(self):
-        return {
-            'headline': self.headline,
-            'description': self.description,
-            'primary_text': self.primary_text,
-            'call_to_action': self.call_to_action,
-            'image_url': self.image_url
-        }
+        return serialize_creative(self)
 
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (
+        # A user's payment history, newest first
+        db.Index('ix_payments_user_id_created_at', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     subscription_id = db.Column(db.Integer, db.ForeignKey('subscriptions.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='pending')  # 'pending', 'completed', 'failed'
-    external_payment_id = db.Column(db.String(100), nullable=True)  # Reference to payment gateway
+    external_payment_id = db.Column(db.String(100), unique=True, nullable=True)  # Reference to payment gateway
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     user = db.relationship('User', backref='payments', lazy=True)
     subscription = db.relationship('Subscription', backref='payments', lazy=True)
+
+# Payments moved out when external_payment_id was made unique, kept for the books
+class PaymentDuplicate(db.Model):
+    __tablename__ = 'payments_duplicates'
+    
+    id = db.Column(db.Integer, primary_key=True)  # Its id in payments
+    user_id = db.Column(db.Integer, nullable=False)
+    subscription_id = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20))
+    external_payment_id = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime)
+
+class WebhookEvent(db.Model):
+    __tablename__ = 'webhook_events'
+    __table_args__ = (
+        # One row per provider event, so redeliveries are absorbed on insert
+        db.UniqueConstraint('provider', 'event_id', name='uq_webhook_events_provider_event_id'),
+        # Serves the workers' scan for due events
+        db.Index('ix_webhook_events_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(20), nullable=False)  # 'stripe', 'paypal', 'mpesa'
+    event_id = db.Column(db.String(255), nullable=False)
+    event_type = db.Column(db.String(100), nullable=True)
+    payload = db.Column(db.Text, nullable=False)  # Raw body as received (plus headers where verification needs them)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'processing', 'processed', 'ignored', 'failed', 'dead'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+class CheckoutJob(db.Model):
+    __tablename__ = 'checkout_jobs'
+    
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)  # Unguessable, handed to the client for polling
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscriptions.id'), nullable=False)
+    provider = db.Column(db.String(20), nullable=False)  # 'stripe', 'paypal', 'mpesa'
+    params = db.Column(db.Text, nullable=True)  # JSON string of provider inputs (payment method, phone number)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'succeeded', 'failed'
+    result = db.Column(db.Text, nullable=True)  # JSON string of what the client needs to finish paying
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+    
+    def to_dict(self):
+        return {
+            'jobId': self.id,
+            'provider': self.provider,
+            'status': self.status,
+            'result': json_loads(self.result) if self.result else None,
+            'error': self.error,
+            'createdAt': self.created_at,
+            'finishedAt': self.finished_at
+        }
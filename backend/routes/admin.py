@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify
 from models import User, db
-from middleware.rbac import require_role
+from middleware.rbac import require_role, invalidate_claims
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -58,8 +58,9 @@ def assign_role():
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    # Assign role
+    # Assign role and stop trusting tokens minted with the old one
     user.role = role
+    invalidate_claims(user.id)
     db.session.commit()
 
     return jsonify({'message': 'Role assigned successfully', 'user': user.to_dict()}), 200
\ No newline at end of file
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, make_response
+from flask import Blueprint, request, jsonify, make_response, current_app
 from flask_jwt_extended import (
     create_access_token, 
     create_refresh_token,
@@ -10,13 +10,18 @@ from flask_jwt_extended import (
     get_jwt,
     decode_token  # Added for decoding refresh tokens
 )
-import requests
+import os
 import json
 from datetime import datetime, timedelta
 import uuid
-from email_validator import validate_email, EmailNotValidError
 
 from models import db, User, RefreshToken
+from middleware.rbac import load_current_user
+from middleware.read_replica import read_only
+from services.password_hasher import PasswordHasherBusy
+from services.refresh_token_index import get_refresh_token_index
+from services.http_client import get_http_client, CircuitOpenError
+from services.google_auth import get_google_token_verifier, InvalidGoogleToken
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -29,7 +34,8 @@ def register():
         if not data.get('email') or not data.get('password'):
             return jsonify({'error': 'Email and password are required'}), 400
         
-        # Validate email format
+        # Validate email format (imported here, registration is rare)
+        from email_validator import validate_email, EmailNotValidError
         try:
             validate_email(data.get('email'))
         except EmailNotValidError:
@@ -78,6 +84,9 @@ def register():
         
         return resp
         
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        return busy_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -93,6 +102,15 @@ def login():
         if not user or not user.check_password(data.get('password')):
             return jsonify({'error': 'Invalid email or password'}), 401
         
+        # Upgrade hashes made with fewer rounds than currently configured
+        if user.password_needs_rehash():
+            try:
+                user.set_password(data.get('password'))
+                db.session.commit()
+            except PasswordHasherBusy:
+                # The login itself succeeded; upgrade on a later login
+                db.session.rollback()
+        
         # Generate tokens
         access_token = create_access_token(identity=str(user.id))
         refresh_token = create_refresh_token(identity=str(user.id))
@@ -111,6 +129,9 @@ def login():
         
         return resp
         
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        return busy_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -120,11 +141,10 @@ def google_login():
         data = request.json
         token = data.get('token')
         
-        # Verify Google token
-        google_response = requests.get(f'https://www.googleapis.com/oauth2/v3/tokeninfo?id_token={token}')
-        google_data = google_response.json()
-        
-        if 'error' in google_data:
+        # Verify Google token (locally against Google's cached signing keys)
+        try:
+            google_data = get_google_token_verifier().verify(token)
+        except InvalidGoogleToken:
             return jsonify({'error': 'Invalid Google token'}), 401
         
         email = google_data.get('email')
@@ -171,6 +191,9 @@ def google_login():
         
         return resp
         
+    except CircuitOpenError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -181,7 +204,10 @@ def facebook_login():
         token = data.get('token')
         
         # Verify Facebook token
-        facebook_response = requests.get(f'https://graph.facebook.com/me?fields=id,email,first_name,last_name&access_token={token}')
+        facebook_response = get_http_client('facebook').get(
+            f"{os.getenv('FACEBOOK_GRAPH_URL', 'https://graph.facebook.com')}/me",
+            params={'fields': 'id,email,first_name,last_name', 'access_token': token}
+        )
         facebook_data = facebook_response.json()
         
         if 'error' in facebook_data:
@@ -231,18 +257,19 @@ def facebook_login():
         
         return resp
         
+    except CircuitOpenError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/me', methods=['GET'])
+@read_only
 @jwt_required()
 def get_user():
     try:
-        # Get user ID from JWT
-        user_id = get_jwt_identity()
-        
-        # Find user by ID
-        user = User.query.filter_by(id=user_id).first()
+        # Find user from JWT
+        user = load_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
@@ -258,16 +285,13 @@ def refresh_token():
         user_id = get_jwt_identity()
         
         # Find user by ID
-        user = User.query.filter_by(id=user_id).first()
+        user = load_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Get the refresh token from the database
-        refresh_token_jti = get_jwt().get('jti')  # JWT ID of the refresh token
-        db_refresh_token = RefreshToken.query.filter_by(token=refresh_token_jti, user_id=user_id).first()
-        
-        # Check if the refresh token exists and is valid
-        if not db_refresh_token or not db_refresh_token.is_valid():
+        # Check the refresh token is still allow-listed (usually answered from memory)
+        claims = get_jwt()
+        if not is_refresh_token_valid(claims.get('jti'), claims.get('iat')):
             return jsonify({'error': 'Invalid or expired refresh token'}), 401
         
         # Generate new access token
@@ -288,14 +312,16 @@ def refresh_token():
 @jwt_required(optional=True)
 def logout():
     try:
-        # Get current token
-        token_jti = get_jwt().get('jti', None)
-        user_id = get_jwt_identity()
-        
-        # Delete refresh token if user is logged in
-        if user_id and token_jti:
-            RefreshToken.query.filter_by(token=token_jti, user_id=user_id).delete()
-            db.session.commit()
+        # Revoke the refresh token held in the refresh cookie
+        refresh_cookie = request.cookies.get(current_app.config['JWT_REFRESH_COOKIE_NAME'])
+        if refresh_cookie:
+            try:
+                token_jti = decode_token(refresh_cookie, allow_expired=True).get('jti')
+            except Exception:
+                token_jti = None
+            if token_jti:
+                revoke_refresh_tokens(RefreshToken.query.filter_by(token=token_jti))
+                db.session.commit()
         
         resp = make_response(jsonify({
             'message': 'Logged out successfully'
@@ -320,8 +346,8 @@ def store_refresh_token(user_id, refresh_token_jwt):
         if not token_id:
             raise ValueError("Refresh token does not contain a valid 'jti'")
         
-        # Calculate expiry time
-        expires_at = datetime.utcnow() + timedelta(days=30)  # 30 days
+        # Expire the row with the token itself
+        expires_at = datetime.utcfromtimestamp(decoded_token['exp'])
         
         # Create new refresh token
         refresh_token = RefreshToken(
@@ -334,12 +360,53 @@ def store_refresh_token(user_id, refresh_token_jwt):
         db.session.add(refresh_token)
         db.session.commit()
         
+        index = get_refresh_token_index()
+        if index is not None:
+            index.add(token_id)
+        
         return refresh_token
     except Exception as e:
         db.session.rollback()
         raise Exception(f"Failed to store refresh token: {str(e)}")
 
+def busy_response(error):
+    """503 telling the client to retry once password hashing has capacity again."""
+    resp = make_response(jsonify({'error': str(error)}), 503)
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+def is_refresh_token_valid(token_jti, issued_at):
+    """Check a refresh token against the allow-list, from memory when the index is enabled."""
+    if not token_jti:
+        return False
+    
+    index = get_refresh_token_index()
+    if index is not None:
+        return index.is_valid(token_jti, issued_at)
+    
+    refresh_token = RefreshToken.query.filter_by(token=token_jti).first()
+    return bool(refresh_token and refresh_token.is_valid())
+
+def revoke_refresh_tokens(query):
+    """Mark the refresh tokens matched by query as revoked; the caller commits.
+
+    Rows are kept until they expire so other workers can see the revocation.
+    """
+    now = datetime.utcnow()
+    tokens = query.filter(RefreshToken.revoked_at.is_(None)).with_entities(RefreshToken.token, RefreshToken.expires_at).all()
+    if not tokens:
+        return
+    
+    RefreshToken.query.filter(RefreshToken.token.in_([token for token, _ in tokens])).update(
+        {RefreshToken.revoked_at: now}, synchronize_session=False
+    )
+    
+    index = get_refresh_token_index()
+    if index is not None:
+        for token, expires_at in tokens:
+            index.revoke(token, expires_at)
+
 def delete_refresh_tokens(user_id):
-    """Delete all refresh tokens for a given user."""
-    RefreshToken.query.filter_by(user_id=user_id).delete()
+    """Revoke all refresh tokens for a given user."""
+    revoke_refresh_tokens(RefreshToken.query.filter_by(user_id=user_id))
     db.session.commit()
\ No newline at end of file
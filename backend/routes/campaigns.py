@@ -1,19 +1,30 @@
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
-from sqlalchemy import desc, asc
+import base64
+from sqlalchemy import desc, asc, and_, or_
+from sqlalchemy.orm import joinedload, selectinload, load_only
 from math import ceil
 
-from models import db, Campaign, Targeting, Creative, User
-from middleware.rbac import require_permission
+from models import db, Campaign, Targeting, Creative, serialize_fields
+from middleware.rbac import require_permission, require_role, load_current_user
+from middleware.query_counter import query_budget
+from middleware.read_replica import read_only
+from services.metrics_service import MetricsService
+from services.ingestion_service import IngestionService, MAX_BATCH_SIZE
+from services.counter_buffer import get_counter_buffer
+from services.summary_service import SummaryService
+from services.campaign_quota import CampaignLimitReached
 
 campaign_bp = Blueprint('campaigns', __name__)
 
 @campaign_bp.route('/', methods=['GET'])
+@read_only
 @jwt_required()
 @require_permission('view_own_campaigns')
+@query_budget(5)
 def get_campaigns():
     try:
         # Get user ID from JWT
@@ -26,6 +37,15 @@ def get_campaigns():
         platform = request.args.get('platform')
         sort_by = request.args.get('sort_by', 'created_at')
         sort_dir = request.args.get('sort_dir', 'desc')
+        cursor_mode = 'cursor' in request.args
+        
+        if per_page is None or per_page < 1:
+            return jsonify({'error': 'per_page must be a positive integer'}), 400
+        
+        try:
+            fields = parse_fields()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Start building the query
         query = Campaign.query.filter_by(user_id=user_id)
@@ -35,6 +55,18 @@ def get_campaigns():
             query = query.filter_by(status=status)
         if platform:
             query = query.filter_by(platform=platform)
+        
+        # Relationships are fetched with one SELECT ... IN per relationship for
+        # the whole page, not one per row. The cursor needs the sort column, so
+        # it is selected even when the caller did not ask for it.
+        if cursor_mode and fields is not None and sort_by not in fields:
+            query = load_campaign_fields(query, fields + [sort_by], selectinload)
+        else:
+            query = load_campaign_fields(query, fields, selectinload)
+            
+        # Keyset pagination: seek past the cursor instead of counting and offsetting
+        if cursor_mode:
+            return get_campaigns_by_cursor(query, per_page, sort_by, sort_dir, fields)
             
         # Apply sorting
         if sort_dir == 'desc':
@@ -50,7 +82,7 @@ def get_campaigns():
         campaigns = query.offset((page - 1) * per_page).limit(per_page).all()
         
         # Convert campaigns to dict
-        campaign_list = [campaign.to_dict() for campaign in campaigns]
+        campaign_list = [campaign_to_dict(campaign, fields) for campaign in campaigns]
         
         # Prepare pagination metadata
         pagination = {
@@ -70,27 +102,171 @@ def get_campaigns():
         return jsonify({'error': str(e)}), 500
 
 @campaign_bp.route('/<int:campaign_id>', methods=['GET'])
+@read_only
 @jwt_required()
 @require_permission('view_own_campaigns')
+@query_budget(3)
 def get_campaign(campaign_id):
     try:
         # Get user ID from JWT
         user_id = get_jwt_identity()
         
-        # Get campaign for the user
-        campaign = Campaign.query.filter_by(id=campaign_id, user_id=user_id).first()
+        try:
+            fields = parse_fields()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Get campaign for the user, joining its targeting and creative in the same query
+        query = Campaign.query.filter_by(id=campaign_id, user_id=user_id)
+        campaign = load_campaign_fields(query, fields, joinedload).first()
         
         # Check if campaign exists and user has access
         if not campaign:
             return jsonify({'error': 'Campaign not found'}), 404
         
         # Convert campaign to dict
-        campaign_dict = campaign.to_dict()
+        campaign_dict = campaign_to_dict(campaign, fields)
         
         return jsonify(campaign_dict), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@campaign_bp.route('/summary', methods=['GET'])
+@jwt_required()
+@require_permission('view_own_campaigns')
+@query_budget(6)
+def get_campaign_summary():
+    """Dashboard totals (spend, CTR, active campaigns, budget utilization) for the user."""
+    try:
+        # Get user ID from JWT
+        user_id = get_jwt_identity()
+        
+        # Served from the user's materialized summary row, so cost does not grow with campaign count
+        summary = SummaryService.get_summary(int(user_id))
+        
+        return jsonify(summary.to_dict()), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@campaign_bp.route('/metrics', methods=['GET'])
+@read_only
+@jwt_required()
+@require_permission('view_own_campaigns')
+@query_budget(5)
+def get_account_metrics():
+    """Metrics summed across all of the user's campaigns, optionally for one platform."""
+    try:
+        # Get user ID from JWT
+        user_id = get_jwt_identity()
+        
+        granularity = request.args.get('granularity', 'day')
+        platform = request.args.get('platform')
+        try:
+            start, end = parse_metrics_range()
+            metrics = MetricsService.get_user_metrics(user_id, start, end, granularity, platform)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'platform': platform,
+            'granularity': granularity,
+            'from': start,
+            'to': end,
+            'metrics': metrics
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@campaign_bp.route('/<int:campaign_id>/metrics', methods=['GET'])
+@read_only
+@jwt_required()
+@require_permission('view_own_campaigns')
+@query_budget(6)
+def get_campaign_metrics(campaign_id):
+    try:
+        # Get user ID from JWT
+        user_id = get_jwt_identity()
+        
+        # Check the campaign exists and belongs to the user
+        campaign = db.session.query(Campaign.id).filter_by(id=campaign_id, user_id=user_id).first()
+        if not campaign:
+            return jsonify({'error': 'Campaign not found'}), 404
+        
+        granularity = request.args.get('granularity', 'day')
+        try:
+            start, end = parse_metrics_range()
+            metrics = MetricsService.get_campaign_metrics(campaign_id, start, end, granularity)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'campaign_id': campaign_id,
+            'granularity': granularity,
+            'from': start,
+            'to': end,
+            'metrics': metrics
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@campaign_bp.route('/events', methods=['POST'])
+@jwt_required()
+@require_permission('edit_own_campaign')
+def ingest_events():
+    """Ingest a batch of impression and click events (JSON array or NDJSON)."""
+    try:
+        # Get user ID from JWT
+        user_id = get_jwt_identity()
+        
+        # Parse the batch
+        try:
+            events = IngestionService.parse_batch(request.get_data(), request.content_type)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if len(events) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch too large: at most {MAX_BATCH_SIZE} events per request'}), 413
+        
+        # Only the user's own campaigns accept events; look them up in one query
+        campaign_ids = {e.get('campaign_id') for e in events if isinstance(e, dict) and isinstance(e.get('campaign_id'), int)}
+        allowed_campaign_ids = set()
+        if campaign_ids:
+            allowed_campaign_ids = {row.id for row in db.session.query(Campaign.id).filter(
+                Campaign.user_id == user_id,
+                Campaign.id.in_(campaign_ids)
+            )}
+        
+        # Sum events per campaign and per hour, then write each sum once,
+        # either now or with the next write-behind flush
+        totals, buckets, errors = IngestionService.coalesce(events, allowed_campaign_ids)
+        counter_buffer = get_counter_buffer()
+        if counter_buffer is not None:
+            counter_buffer.add(totals, buckets, len(events) - len(errors))
+        else:
+            IngestionService.flush(totals, buckets)
+            db.session.commit()
+        
+        return jsonify({
+            'accepted': len(events) - len(errors),
+            'rejected': len(errors),
+            'errors': errors[:100]
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@campaign_bp.route('/events/stats', methods=['GET'])
+@jwt_required()
+@require_role('admin')
+def get_ingestion_stats():
+    """Buffered counter deltas and flush latency for this worker."""
+    counter_buffer = get_counter_buffer()
+    if counter_buffer is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, **counter_buffer.stats()}), 200
+
 @campaign_bp.route('/', methods=['POST'])
 @jwt_required()
 @require_permission('create_campaign')
@@ -99,16 +275,6 @@ def create_campaign():
         # Get user ID from JWT
         user_id = get_jwt_identity()
         
-        # Check subscription limits
-        user = User.query.get(user_id)
-        campaign_count = Campaign.query.filter_by(user_id=user_id).count()
-        
-        if user.subscription and campaign_count >= user.subscription.max_campaigns:
-            return jsonify({
-                'error': 'Campaign limit reached for your subscription plan',
-                'message': f'Your plan allows a maximum of {user.subscription.max_campaigns} campaigns'
-            }), 403
-        
         # Get request data
         data = request.json
         
@@ -138,7 +304,17 @@ def create_campaign():
             status='draft'
         )
         db.session.add(campaign)
-        db.session.flush()
+        
+        # Inserting the campaign also takes a slot of the plan's campaign limit, atomically
+        try:
+            db.session.flush()
+        except CampaignLimitReached:
+            db.session.rollback()
+            user = load_current_user()
+            return jsonify({
+                'error': 'Campaign limit reached for your subscription plan',
+                'message': f'Your plan allows a maximum of {user.subscription.max_campaigns} campaigns'
+            }), 403
         
         # Create targeting
         targeting_data = data.get('targeting', {})
@@ -282,3 +458,208 @@ def delete_campaign(campaign_id):
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+
+
+# Helper functions for metrics
+def parse_metrics_range():
+    """Parse ?from= and ?to= into naive UTC datetimes, defaulting to the last 30 days."""
+    try:
+        end = datetime.fromisoformat(request.args['to'].replace('Z', '+00:00')) if request.args.get('to') else datetime.utcnow()
+        start = datetime.fromisoformat(request.args['from'].replace('Z', '+00:00')) if request.args.get('from') else end - timedelta(days=30)
+    except ValueError:
+        raise ValueError('Invalid date format')
+    
+    # Buckets are stored as naive UTC
+    return start.replace(tzinfo=None), end.replace(tzinfo=None)
+
+# Helper functions for sparse fieldsets
+def parse_fields():
+    """Parse ?fields= into a list of campaign fields, or None for the full object."""
+    raw_fields = request.args.get('fields')
+    if not raw_fields:
+        return None
+    
+    fields = ['id']
+    for field in raw_fields.split(','):
+        field = field.strip()
+        if field and field not in fields:
+            fields.append(field)
+    
+    unknown = [f for f in fields if f not in Campaign.COLUMN_FIELDS + Campaign.RELATIONSHIP_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+def load_campaign_fields(query, fields, relationship_loader):
+    """Restrict a campaign query to the requested fields.
+    
+    Without fields the full model is loaded along with both relationships.
+    When only columns are requested the query returns plain rows, which skips
+    ORM hydration entirely; otherwise unrequested columns are deferred and
+    only the requested relationships are loaded.
+    """
+    if fields is None:
+        return query.options(
+            relationship_loader(Campaign.targeting),
+            relationship_loader(Campaign.creative)
+        )
+    
+    columns = [getattr(Campaign, f) for f in fields if f in Campaign.COLUMN_FIELDS]
+    relationships = [getattr(Campaign, f) for f in fields if f in Campaign.RELATIONSHIP_FIELDS]
+    if not relationships:
+        return query.with_entities(*columns)
+    return query.options(load_only(*columns), *[relationship_loader(r) for r in relationships])
+
+def campaign_to_dict(campaign, fields):
+    """Serialize a campaign loaded by load_campaign_fields()."""
+    if fields is None:
+        return campaign.to_dict()
+    return serialize_fields(campaign, fields)
+
+# Columns that can drive keyset pagination, with the type of their cursor
+# value. (value, id) gives a strict total order over a user's campaigns;
+# in nullable columns NULL sorts after every value (see seek_past).
+CURSOR_SORT_COLUMNS = {
+    'created_at': 'datetime',
+    'updated_at': 'datetime',
+    'start_date': 'datetime',
+    'name': 'str',
+    'status': 'str',
+    'platform': 'str',
+    'budget': 'float',
+    'spend': 'float',
+    'impressions': 'int',
+    'clicks': 'int',
+    'id': 'int'
+}
+
+def get_campaigns_by_cursor(query, per_page, sort_by, sort_dir, fields=None):
+    """Return one page of campaigns that follow the position encoded in ?cursor=.
+    
+    The page is fetched with an index seek on (sort_by, id) rather than an
+    OFFSET, so every page costs the same no matter how deep it is. The total
+    count is only computed when the caller passes include_total=true.
+    """
+    if sort_by not in CURSOR_SORT_COLUMNS:
+        return jsonify({'error': f'Cannot use cursor pagination with sort_by={sort_by}'}), 400
+    
+    descending = sort_dir == 'desc'
+    include_total = request.args.get('include_total', 'false').lower() == 'true'
+    
+    # Total count is opt-in since it scans every matching row
+    total_count = query.count() if include_total else None
+    
+    # Seek past the last row of the previous page
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            last_value, last_id = decode_cursor(cursor, sort_by, sort_dir)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        query = query.filter(seek_past(sort_by, descending, last_value, last_id))
+    
+    # Break ties on id so the order matches the seek condition
+    query = query.order_by(*cursor_order(sort_by, descending))
+    
+    # Fetch one extra row to learn whether another page exists
+    campaigns = query.limit(per_page + 1).all()
+    has_next = len(campaigns) > per_page
+    campaigns = campaigns[:per_page]
+    
+    next_cursor = None
+    if has_next:
+        last = campaigns[-1]
+        next_cursor = encode_cursor(sort_by, sort_dir, getattr(last, sort_by), last.id)
+    
+    pagination = {
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+        'has_next': has_next
+    }
+    if include_total:
+        pagination['total_count'] = total_count
+    
+    return jsonify({
+        'campaigns': [campaign_to_dict(campaign, fields) for campaign in campaigns],
+        'pagination': pagination
+    }), 200
+
+def is_nullable(sort_by):
+    return Campaign.__table__.c[sort_by].nullable
+
+def cursor_order(sort_by, descending):
+    """ORDER BY for keyset pages: NULL after every value ascending, before every value descending.
+
+    That is PostgreSQL's default, so its (user_id, column, id) indexes serve
+    both directions; SQLite is told explicitly.
+    """
+    sort_column = getattr(Campaign, sort_by)
+    if descending:
+        column_order = sort_column.desc().nulls_first() if is_nullable(sort_by) else sort_column.desc()
+        return column_order, Campaign.id.desc()
+    column_order = sort_column.asc().nulls_last() if is_nullable(sort_by) else sort_column.asc()
+    return column_order, Campaign.id.asc()
+
+def seek_past(sort_by, descending, last_value, last_id):
+    """Condition for the rows after (last_value, last_id) in cursor_order().
+
+    A comparison with NULL is never true, so rows whose sort value is NULL
+    are matched explicitly; without that they would never be returned.
+    """
+    sort_column = getattr(Campaign, sort_by)
+    if sort_by == 'id':
+        return Campaign.id < last_id if descending else Campaign.id > last_id
+    
+    after_id = Campaign.id < last_id if descending else Campaign.id > last_id
+    if last_value is None:
+        # Within the NULLs: later ids, then (descending) every row with a value
+        if descending:
+            return or_(and_(sort_column.is_(None), after_id), sort_column.isnot(None))
+        return and_(sort_column.is_(None), after_id)
+    
+    after_value = sort_column < last_value if descending else sort_column > last_value
+    condition = or_(after_value, and_(sort_column == last_value, after_id))
+    if is_nullable(sort_by) and not descending:
+        # NULLs come after every value
+        condition = or_(condition, sort_column.is_(None))
+    return condition
+
+def encode_cursor(sort_by, sort_dir, value, campaign_id):
+    """Build an opaque cursor token from the sort key of the last row on a page."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps({'s': sort_by, 'd': sort_dir, 'v': value, 'i': campaign_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_by, sort_dir):
+    """Decode a cursor token into the (value, id) pair to seek past."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value, campaign_id = payload['v'], int(payload['i'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Invalid cursor')
+    
+    # A cursor is only meaningful for the ordering it was issued under
+    if payload.get('s') != sort_by or payload.get('d') != sort_dir:
+        raise ValueError('Cursor does not match the requested sort order')
+    
+    value_type = CURSOR_SORT_COLUMNS[sort_by]
+    try:
+        if value is None:
+            # The previous page ended among the rows without a value
+            if not is_nullable(sort_by):
+                raise ValueError
+        elif value_type == 'datetime':
+            value = datetime.fromisoformat(value)
+        elif value_type == 'float':
+            value = float(value)
+        elif value_type == 'int':
+            value = int(value)
+        elif not isinstance(value, str):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    
+    return value, campaign_id
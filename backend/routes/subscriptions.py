@@ -1,23 +1,35 @@
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, make_response, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime, timedelta
 import os
 import json
+import math
 
 from models import db, User, Subscription, Payment
-from services.payment_service import PaymentService
+from services.payment_service import PaymentService, stripe_sdk
+from services.plan_catalog import get_plan_catalog
+from services.checkout_service import CheckoutService, CheckoutBusy
+from services.webhook_service import WebhookService, PAYPAL_SIGNATURE_HEADERS
+from middleware.rbac import load_current_user, require_role
+from middleware.read_replica import read_only
 
 subscription_bp = Blueprint('subscriptions', __name__)
 
 payment_service = PaymentService()
 
 @subscription_bp.route('/', methods=['GET'])
+@read_only
 def get_subscriptions():
     """Get all active subscription plans"""
     try:
-        subscriptions = Subscription.query.filter_by(is_active=True).all()
-        return jsonify([sub.to_dict() for sub in subscriptions]), 200
+        catalog = get_plan_catalog().get()
+        
+        # Cacheable by browsers and CDNs; revalidation is answered with a 304 from memory
+        response = current_app.response_class(catalog.body, mimetype='application/json')
+        response.set_etag(catalog.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['PLAN_CATALOG_MAX_AGE']
+        return response.make_conditional(request)
     except Exception as e:
         current_app.logger.error(f"Error getting subscriptions: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -27,8 +39,7 @@ def get_subscriptions():
 def get_user_subscription():
     """Get current user's subscription details"""
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = load_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -78,7 +89,7 @@ def subscribe_with_stripe():
             return jsonify({'error': 'Subscription ID and payment method ID are required'}), 400
             
         # Get user and subscription
-        user = User.query.get(user_id)
+        user = load_current_user()
         subscription = Subscription.query.get(data.get('subscriptionId'))
         
         if not user:
@@ -90,24 +101,13 @@ def subscribe_with_stripe():
         if not subscription.is_active:
             return jsonify({'error': 'Subscription plan is not active'}), 400
             
-        # Create payment intent with Stripe
+        # Create the payment intent in the background; the client polls the job for its client secret
         try:
-            payment_intent = payment_service.create_stripe_payment_intent(
-                amount=subscription.price,
-                metadata={
-                    'user_id': user_id,
-                    'subscription_id': subscription.id
-                }
-            )
+            job = CheckoutService.start(user.id, subscription, 'stripe', {'paymentMethodId': data.get('paymentMethodId')})
+        except CheckoutBusy as e:
+            return checkout_busy_response(e)
             
-            return jsonify({
-                'clientSecret': payment_intent['clientSecret'],
-                'paymentIntentId': payment_intent['id']
-            }), 200
-            
-        except Exception as e:
-            current_app.logger.error(f"Stripe payment processing failed: {str(e)}")
-            return jsonify({'error': f'Payment processing failed: {str(e)}'}), 400
+        return jsonify(checkout_job_response(job)), 202
             
     except Exception as e:
         current_app.logger.error(f"Error in stripe subscription: {str(e)}")
@@ -126,7 +126,7 @@ def subscribe_with_paypal():
             return jsonify({'error': 'Subscription ID is required'}), 400
             
         # Get user and subscription
-        user = User.query.get(user_id)
+        user = load_current_user()
         subscription = Subscription.query.get(data.get('subscriptionId'))
         
         if not user:
@@ -138,24 +138,13 @@ def subscribe_with_paypal():
         if not subscription.is_active:
             return jsonify({'error': 'Subscription plan is not active'}), 400
             
-        # Create PayPal payment
+        # Create the PayPal payment in the background; the client polls the job for the approval URL
         try:
-            payment = payment_service.create_paypal_payment(
-                amount=subscription.price,
-                description=f"Subscription to {subscription.name} plan"
-            )
+            job = CheckoutService.start(user.id, subscription, 'paypal')
+        except CheckoutBusy as e:
+            return checkout_busy_response(e)
             
-            # Store payment info in session or database for later retrieval
-            # We'll handle this in the PayPal callback routes
-            
-            return jsonify({
-                'paymentId': payment['id'],
-                'approvalUrl': payment['approvalUrl']
-            }), 200
-            
-        except Exception as e:
-            current_app.logger.error(f"PayPal payment processing failed: {str(e)}")
-            return jsonify({'error': f'Payment processing failed: {str(e)}'}), 400
+        return jsonify(checkout_job_response(job)), 202
             
     except Exception as e:
         current_app.logger.error(f"Error in paypal subscription: {str(e)}")
@@ -174,7 +163,7 @@ def subscribe_with_mpesa():
             return jsonify({'error': 'Subscription ID and phone number are required'}), 400
             
         # Get user and subscription
-        user = User.query.get(user_id)
+        user = load_current_user()
         subscription = Subscription.query.get(data.get('subscriptionId'))
         
         if not user:
@@ -186,31 +175,44 @@ def subscribe_with_mpesa():
         if not subscription.is_active:
             return jsonify({'error': 'Subscription plan is not active'}), 400
             
-        # Initiate MPESA payment
+        # Send the STK push in the background; the client polls the job until it is sent
         try:
-            mpesa_response = payment_service.initiate_mpesa_payment(
-                phone_number=data.get('phoneNumber'),
-                amount=subscription.price,
-                account_reference=f"SUB{subscription.id}",
-                transaction_desc=f"Subscription to {subscription.name} plan"
-            )
-            
-            # Store necessary info for later validation
-            # We'll handle this in the MPESA callback route
+            job = CheckoutService.start(user.id, subscription, 'mpesa', {'phoneNumber': data.get('phoneNumber')})
+        except CheckoutBusy as e:
+            return checkout_busy_response(e)
             
-            return jsonify({
-                'requestId': mpesa_response.get('CheckoutRequestID'),
-                'message': 'MPESA payment initiated. Please check your phone to complete the transaction.'
-            }), 200
-            
-        except Exception as e:
-            current_app.logger.error(f"MPESA payment processing failed: {str(e)}")
-            return jsonify({'error': f'Payment processing failed: {str(e)}'}), 400
+        return jsonify(checkout_job_response(job)), 202
             
     except Exception as e:
         current_app.logger.error(f"Error in MPESA subscription: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@subscription_bp.route('/checkout/<job_id>', methods=['GET'])
+@jwt_required()
+def get_checkout(job_id):
+    """Get the status of a checkout job, optionally waiting up to ?wait= seconds for it to finish"""
+    try:
+        user_id = get_jwt_identity()
+        
+        try:
+            wait = float(request.args.get('wait', 0))
+        except ValueError:
+            wait = None
+        if wait is None or not math.isfinite(wait):
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
+        wait = min(max(wait, 0.0), current_app.config['CHECKOUT_LONG_POLL_MAX'])
+            
+        job = CheckoutService.get_job(job_id, int(user_id), wait, current_app.config['CHECKOUT_JOB_TIMEOUT'])
+        
+        if not job:
+            return jsonify({'error': 'Checkout not found'}), 404
+            
+        return jsonify(job.to_dict()), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error getting checkout: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @subscription_bp.route('/confirm-payment', methods=['POST'])
 @jwt_required()
 def confirm_payment():
@@ -222,12 +224,16 @@ def confirm_payment():
         if not data.get('subscriptionId') or not data.get('paymentId') or not data.get('paymentMethod'):
             return jsonify({'error': 'Subscription ID, payment ID, and payment method are required'}), 400
             
-        user = User.query.get(user_id)
+        user = load_current_user()
         subscription = Subscription.query.get(data.get('subscriptionId'))
         
         if not user or not subscription:
             return jsonify({'error': 'User or subscription plan not found'}), 404
             
+        existing = Payment.query.filter_by(external_payment_id=data.get('paymentId')).first()
+        if existing and existing.user_id != user.id:
+            return jsonify({'error': 'Payment belongs to another user'}), 403
+            
         # Verify payment based on payment method
         payment_confirmed = False
         payment_method = data.get('paymentMethod')
@@ -249,23 +255,12 @@ def confirm_payment():
         if not payment_confirmed:
             return jsonify({'error': 'Payment could not be confirmed'}), 400
             
-        # Update user subscription
-        user.subscription_id = subscription.id
-        user.subscription_status = 'active'
-        user.subscription_end_date = datetime.utcnow() + timedelta(days=subscription.duration_days)
-        
-        # Create payment record
-        payment = Payment(
-            user_id=user.id,
-            subscription_id=subscription.id,
-            amount=subscription.price,
-            status='completed',
-            external_payment_id=data.get('paymentId')
-        )
-        
-        db.session.add(payment)
+        # Activate the subscription, unless the provider's webhook already did
+        payment = PaymentService.complete_payment(data.get('paymentId'), user.id, subscription.id)
         db.session.commit()
         
+        subscription = payment.subscription
+        
         return jsonify({
             'message': 'Payment confirmed and subscription activated successfully',
             'subscription': {
@@ -285,8 +280,7 @@ def confirm_payment():
 def cancel_subscription():
     """Cancel user's current subscription"""
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = load_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -313,97 +307,69 @@ def cancel_subscription():
 # Payment provider webhooks
 @subscription_bp.route('/webhook/stripe', methods=['POST'])
 def stripe_webhook():
-    """Handle Stripe webhook events"""
+    """Verify a Stripe webhook and queue it for processing"""
     try:
         payload = request.get_data(as_text=True)
         sig_header = request.headers.get('Stripe-Signature')
         
         # Verify webhook signature
         try:
-            event = stripe.Webhook.construct_event(
+            event = stripe_sdk().Webhook.construct_event(
                 payload, sig_header, os.getenv('STRIPE_WEBHOOK_SECRET')
             )
         except Exception as e:
             current_app.logger.error(f"Stripe webhook verification failed: {str(e)}")
             return jsonify({'error': 'Webhook verification failed'}), 400
             
-        # Handle specific events
-        if event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-            
-            # Extract metadata
-            metadata = payment_intent.get('metadata', {})
-            user_id = metadata.get('user_id')
-            subscription_id = metadata.get('subscription_id')
-            
-            if user_id and subscription_id:
-                # Process successful payment
-                try:
-                    user = User.query.get(int(user_id))
-                    subscription = Subscription.query.get(int(subscription_id))
-                    
-                    if user and subscription:
-                        # Update user subscription
-                        user.subscription_id = subscription.id
-                        user.subscription_status = 'active'
-                        user.subscription_end_date = datetime.utcnow() + timedelta(days=subscription.duration_days)
-                        
-                        # Create payment record
-                        payment = Payment(
-                            user_id=user.id,
-                            subscription_id=subscription.id,
-                            amount=subscription.price,
-                            status='completed',
-                            external_payment_id=payment_intent['id']
-                        )
-                        
-                        db.session.add(payment)
-                        db.session.commit()
-                        
-                        current_app.logger.info(f"Subscription activated for user {user_id}")
-                except Exception as e:
-                    current_app.logger.error(f"Error processing Stripe webhook: {str(e)}")
-                    db.session.rollback()
-        
+        WebhookService.receive('stripe', event['id'], event['type'], payload)
         return jsonify({'status': 'success'}), 200
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Error in Stripe webhook: {str(e)}")
-        return jsonify({'error': str(e)}), 400
+        return jsonify({'error': str(e)}), 500
 
 @subscription_bp.route('/webhook/paypal', methods=['POST'])
 def paypal_webhook():
-    """Handle PayPal webhook events"""
+    """Queue a PayPal webhook; its signature is verified with PayPal when it is processed"""
     try:
-        # PayPal webhook implementation would go here
-        # Similar to Stripe webhook but with PayPal-specific event handling
+        body = request.get_data(as_text=True)
+        event = json.loads(body or '{}')
+        
+        if not event.get('id'):
+            return jsonify({'error': 'Event ID is required'}), 400
+            
+        payload = json.dumps({
+            'headers': {name: request.headers.get(name) for name in PAYPAL_SIGNATURE_HEADERS},
+            'body': body
+        })
+        WebhookService.receive('paypal', event['id'], event.get('event_type'), payload)
         return jsonify({'status': 'success'}), 200
+    except ValueError:
+        return jsonify({'error': 'Invalid JSON'}), 400
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Error in PayPal webhook: {str(e)}")
-        return jsonify({'error': str(e)}), 400
+        return jsonify({'error': str(e)}), 500
 
 @subscription_bp.route('/webhook/mpesa', methods=['POST'])
 def mpesa_webhook():
-    """Handle MPESA callback"""
+    """Queue an MPESA STK push callback"""
     try:
-        callback_data = request.json
+        payload = request.get_data(as_text=True)
+        callback = json.loads(payload or '{}').get('Body', {}).get('stkCallback', {})
         
-        # Verify the callback
-        if payment_service.verify_mpesa_callback(callback_data):
-            # Extract necessary data
-            # Implementation depends on MPESA callback structure
-            # Process the successful payment similar to Stripe webhook
-            pass
+        if not callback.get('CheckoutRequestID'):
+            return jsonify({'error': 'CheckoutRequestID is required'}), 400
             
+        # One callback per STK push, so its CheckoutRequestID doubles as the event ID
+        WebhookService.receive('mpesa', callback['CheckoutRequestID'], 'stkCallback', payload)
         return jsonify({'status': 'success'}), 200
+    except ValueError:
+        return jsonify({'error': 'Invalid JSON'}), 400
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Error in MPESA webhook: {str(e)}")
-        return jsonify({'error': str(e)}), 400
-
-from flask import Blueprint, request, jsonify
-from models import User, Subscription, db
-from middleware.rbac import require_role
-
-subscription_bp = Blueprint('subscriptions', __name__)
+        return jsonify({'error': str(e)}), 500
 
 @subscription_bp.route('/override', methods=['POST'])
 @require_role('superuser')  # Only superuser can access this route
@@ -436,4 +402,16 @@ def override_subscription():
         'message': 'Subscription overridden successfully',
         'user': user.to_dict(),
         'subscription': subscription.to_dict()
-    }), 200
\ No newline at end of file
+    }), 200
+
+def checkout_job_response(job):
+    """202 body pointing the client at the job to poll."""
+    data = job.to_dict()
+    data['statusUrl'] = url_for('subscriptions.get_checkout', job_id=job.id)
+    return data
+
+def checkout_busy_response(error):
+    """503 telling the client to retry once the checkout queue has room again."""
+    resp = make_response(jsonify({'error': str(error)}), 503)
+    resp.headers['Retry-After'] = '1'
+    return resp
@@ -0,0 +1,190 @@
+import sys
+import os
+import time
+import signal
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import importlib.util
+from datetime import datetime
+
+# Use a throwaway SQLite database unless one is given explicitly
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark_gunicorn.db')}"
+os.environ.setdefault('JWT_COOKIE_CSRF_PROTECT', 'False')
+
+# Add the parent directory to the Python path
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import requests
+from app import create_app
+from models import db, User, Campaign
+
+EMAIL = 'benchmark@optimad.com'
+PASSWORD = 'benchmark-password'
+
+# Each client alternates between these: a cheap route and a database-backed page of JSON
+PATHS = ['/', '/campaigns/?per_page=20']
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def seed(campaigns):
+    """One user with a page of campaigns to list."""
+    app = create_app(role='cli')
+    with app.app_context():
+        db.create_all()
+        if User.query.filter_by(email=EMAIL).first():
+            return
+        user = User(email=EMAIL, role='user', subscription_status='free')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all([
+            Campaign(user_id=user.id, name=f'Campaign {i}', objective='traffic', platform='google',
+                     budget_type='daily', budget=50.0, start_date=datetime.utcnow())
+            for i in range(campaigns)
+        ])
+        db.session.commit()
+
+def start_server(port, worker_class, workers, preload, gc_freeze):
+    """Start gunicorn with gunicorn.conf.py and wait until it answers."""
+    env = dict(os.environ)
+    env.update({
+        'GUNICORN_BIND': f'127.0.0.1:{port}',
+        'GUNICORN_WORKER_CLASS': worker_class,
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_PRELOAD': str(preload),
+        'GUNICORN_GC_FREEZE': str(gc_freeze),
+        'GUNICORN_MAX_REQUESTS': '0',  # Recycling would reset the memory being measured
+        'GUNICORN_LOG_LEVEL': 'warning'
+    })
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        requests.get(f'{base_url}/', timeout=1)
+        raise RuntimeError(f'Something is already listening on port {port}; pass another --port')
+    except requests.RequestException:
+        pass
+
+    # Run gunicorn in this interpreter (not a launcher script) so process.pid is the master
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        try:
+            requests.get(f'{base_url}/', timeout=5)
+            return process, base_url
+        except (requests.ConnectionError, requests.Timeout):
+            # Without preload_app the socket accepts before the workers have loaded the app
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start within 30s')
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def worker_pids(master_pid):
+    """Processes whose parent is the gunicorn master."""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name in parentheses may contain spaces; the parent pid follows the state
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == master_pid:
+            pids.append(int(entry))
+    return pids
+
+def memory(pid):
+    """RSS, and the part of it private to the process (USS), in MB from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Rss'] / 1024, (fields['Private_Clean'] + fields['Private_Dirty']) / 1024
+
+def run_load(base_url, duration, clients):
+    """Logged-in clients request PATHS in turn as fast as they can."""
+    stop = time.perf_counter() + duration
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        session.post(f'{base_url}/auth/login', json={'email': EMAIL, 'password': PASSWORD})
+        own, failed, i = [], 0, 0
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            status = session.get(f'{base_url}{PATHS[i % len(PATHS)]}').status_code
+            own.append(time.perf_counter() - started)
+            failed += status != 200
+            i += 1
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+def run_benchmark(worker_classes, workers, duration, clients, port):
+    seed(campaigns=20)
+
+    print(f"{workers} workers, {clients} clients for {duration:.0f}s on {', '.join(PATHS)}")
+    print(f"{'worker class':<10} {'mode':<22} {'req/s':>7} {'p50':>8} {'p99':>8} {'errors':>7} "
+          f"{'RSS/worker':>11} {'private/worker':>15} {'master RSS':>11}")
+    for worker_class in worker_classes:
+        if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print(f"{worker_class:<10} skipped: gevent is not installed (pip install gevent)")
+            continue
+        for mode, preload, gc_freeze in (('no preload', False, False), ('preload', True, False), ('preload + gc.freeze', True, True)):
+            process, base_url = start_server(port, worker_class, workers, preload, gc_freeze)
+            try:
+                # Warm every worker up (imports, pools, caches) before measuring
+                run_load(base_url, 1.0, clients)
+                latencies, errors = run_load(base_url, duration, clients)
+                pids = worker_pids(process.pid)
+                usage = [memory(pid) for pid in pids]
+                master_rss, _ = memory(process.pid)
+            finally:
+                stop_server(process)
+            print(f"{worker_class:<10} {mode:<22} {len(latencies) / duration:7.0f} "
+                  f"{statistics.median(latencies) * 1000:6.1f}ms {percentile(latencies, 99) * 1000:6.1f}ms {errors:7d} "
+                  f"{statistics.mean(rss for rss, _ in usage):9.1f}MB {statistics.mean(uss for _, uss in usage):13.1f}MB "
+                  f"{master_rss:9.1f}MB")
+
+# Run the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Load-test gunicorn.conf.py per worker class: throughput, latency and memory per worker.'
+    )
+    parser.add_argument('--worker-class', action='append', choices=['sync', 'gthread', 'gevent'],
+                        help='worker classes to measure (default: all)')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load per run')
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+    run_benchmark(args.worker_class or ['sync', 'gthread', 'gevent'], args.workers, args.duration, args.clients, args.port)
@@ -0,0 +1,120 @@
+import sys
+import os
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from models import Campaign, Targeting, Creative
+from middleware.json_encoder import FastJSONProvider, StdlibJSONProvider
+
+def legacy_campaign_to_dict(campaign):
+    """The hand-built Campaign.to_dict() the compiled serializers replaced."""
+    targeting = campaign.targeting
+    creative = campaign.creative
+    return {
+        'id': campaign.id,
+        'name': campaign.name,
+        'objective': campaign.objective,
+        'platform': campaign.platform,
+        'budget_type': campaign.budget_type,
+        'budget': campaign.budget,
+        'start_date': campaign.start_date.isoformat(),
+        'end_date': campaign.end_date.isoformat() if campaign.end_date else None,
+        'status': campaign.status,
+        'impressions': campaign.impressions,
+        'clicks': campaign.clicks,
+        'spend': campaign.spend,
+        'targeting': {
+            'locations': json.loads(targeting.locations) if targeting.locations else [],
+            'age_min': targeting.age_min,
+            'age_max': targeting.age_max,
+            'gender': targeting.gender,
+            'interests': json.loads(targeting.interests) if targeting.interests else []
+        } if targeting else None,
+        'creative': {
+            'headline': creative.headline,
+            'description': creative.description,
+            'primary_text': creative.primary_text,
+            'call_to_action': creative.call_to_action,
+            'image_url': creative.image_url
+        } if creative else None,
+        'created_at': campaign.created_at.isoformat(),
+        'updated_at': campaign.updated_at.isoformat()
+    }
+
+def build_campaigns(count):
+    """Build transient campaigns shaped like a large account's campaign list."""
+    now = datetime(2025, 3, 1, 12, 30, 15, 123456)
+    campaigns = []
+    for i in range(count):
+        campaign = Campaign(
+            id=i + 1, user_id=1, name=f'Campaign {i}', objective='conversions', platform='facebook',
+            budget_type='daily', budget=50.0 + i, start_date=now, end_date=now + timedelta(days=30),
+            status='active', impressions=i * 1000, clicks=i * 17, spend=i * 3.25,
+            created_at=now, updated_at=now
+        )
+        campaign.targeting = Targeting(
+            locations=json.dumps(['Nairobi', 'Mombasa', 'Kisumu']), age_min=18, age_max=45,
+            gender='all', interests=json.dumps(['sports', 'music', 'technology', 'travel'])
+        )
+        campaign.creative = Creative(
+            headline='Summer sale', description='Up to 50% off', primary_text='Shop the summer sale today',
+            call_to_action='Shop now', image_url='https://cdn.example.com/summer.png'
+        )
+        campaigns.append(campaign)
+    return campaigns
+
+def measure(label, encode, campaigns, repeat):
+    """Time encode(campaigns) and record its peak traced allocation."""
+    encode(campaigns)  # Warm up
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encode(campaigns)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    encode(campaigns)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<40} {elapsed * 1000:9.2f} ms/list {peak / 1024:10.1f} KiB peak")
+    return elapsed
+
+def run_benchmark(count=1000, repeat=20):
+    """Compare the legacy to_dict + jsonify path with compiled serializers + the fast encoder."""
+    app = Flask(__name__)
+    campaigns = build_campaigns(count)
+
+    legacy = DefaultJSONProvider(app)
+    stdlib = StdlibJSONProvider(app)
+    fast = FastJSONProvider(app)
+
+    def encode_legacy(items):
+        return legacy.response({'campaigns': [legacy_campaign_to_dict(c) for c in items]}).get_data()
+
+    def encode_stdlib(items):
+        return stdlib.response({'campaigns': [c.to_dict() for c in items]}).get_data()
+
+    def encode_fast(items):
+        return fast.response({'campaigns': [c.to_dict() for c in items]}).get_data()
+
+    # All paths must produce the same document
+    assert json.loads(encode_legacy(campaigns)) == json.loads(encode_fast(campaigns)) == json.loads(encode_stdlib(campaigns))
+
+    print(f"Encoding {count} campaigns, {repeat} runs each")
+    baseline = measure('legacy to_dict + DefaultJSONProvider', encode_legacy, campaigns, repeat)
+    measure('compiled serializers + stdlib json', encode_stdlib, campaigns, repeat)
+    fast_elapsed = measure('compiled serializers + FastJSONProvider', encode_fast, campaigns, repeat)
+    print(f"Speedup: {baseline / fast_elapsed:.1f}x")
+
+# Run the script
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    run_benchmark(count)
@@ -0,0 +1,102 @@
+import sys
+import os
+import time
+import logging
+import threading
+import tempfile
+import statistics
+
+# Use a throwaway SQLite database unless one is given explicitly
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark_login.db')}"
+os.environ.setdefault('JWT_COOKIE_CSRF_PROTECT', 'False')
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from werkzeug.serving import make_server
+from app import create_app
+from models import db, User
+from services.password_hasher import setup_password_hasher
+
+app = create_app()
+
+EMAIL = 'benchmark@optimad.com'
+PASSWORD = 'benchmark-password'
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def start_server():
+    """Serve the app from a threaded WSGI server on a free local port."""
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+def run_storm(base_url, duration, login_clients, probe_clients):
+    """Hammer /auth/login while probe clients time a cheap endpoint."""
+    stop = time.perf_counter() + duration
+    results = {'ok': 0, 'busy': 0, 'failed': 0}
+    latencies = []
+    lock = threading.Lock()
+
+    def login_loop():
+        session = requests.Session()
+        while time.perf_counter() < stop:
+            status = session.post(f'{base_url}/auth/login', json={'email': EMAIL, 'password': PASSWORD}).status_code
+            key = 'ok' if status == 200 else 'busy' if status == 503 else 'failed'
+            with lock:
+                results[key] += 1
+
+    def probe_loop():
+        session = requests.Session()
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            session.get(f'{base_url}/')
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=login_loop) for _ in range(login_clients)]
+    threads += [threading.Thread(target=probe_loop) for _ in range(probe_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, latencies
+
+def run_benchmark(duration=5.0, login_clients=16, probe_clients=2):
+    """Compare inline hashing with the process pool under a login storm."""
+    with app.app_context():
+        db.create_all()
+        if not User.query.filter_by(email=EMAIL).first():
+            user = User(email=EMAIL, role='user', subscription_status='free')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            db.session.commit()
+
+    server, base_url = start_server()
+    print(f"{duration:.0f}s login storm: {login_clients} login clients, {probe_clients} clients on GET /")
+    print(f"{'hashing':<28} {'logins/s':>9} {'503s':>6} {'probe p50':>10} {'probe p99':>10}")
+    try:
+        for label, workers in (('inline (request thread)', 0), (f'process pool ({os.cpu_count()} workers)', os.cpu_count())):
+            app.config['PASSWORD_HASH_WORKERS'] = workers
+            setup_password_hasher(app)
+            results, latencies = run_storm(base_url, duration, login_clients, probe_clients)
+            print(f"{label:<28} {results['ok'] / duration:9.1f} {results['busy']:6d} "
+                  f"{statistics.median(latencies) * 1000:8.1f}ms {percentile(latencies, 99) * 1000:8.1f}ms")
+            if results['failed']:
+                print(f"  {results['failed']} logins failed")
+    finally:
+        server.shutdown()
+
+# Run the script
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    run_benchmark(duration)
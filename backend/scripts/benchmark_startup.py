@@ -0,0 +1,75 @@
+import sys
+import os
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What app.py imported at startup before create_app() deferred them
+EAGER_IMPORTS = ['stripe', 'paypalrestsdk', 'requests', 'email_validator', 'flask_migrate', 'flask_cors', 'flask_jwt_extended']
+
+# Runs in a fresh interpreter: build the app, then report wall time and peak RSS
+CHILD = """
+import time, json, resource
+started = time.perf_counter()
+{preload}
+from app import create_app
+create_app(role={role!r})
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+def run(role, eager, env, importtime=False):
+    """Start one process; returns (measurements, -X importtime output)."""
+    preload = '\n'.join(f'import {module}' for module in EAGER_IMPORTS) if eager else ''
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD.format(preload=preload, role=role)]
+    result = subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+def slowest_imports(importtime_output, count):
+    """Top-level packages by total import time of their modules, from -X importtime output."""
+    totals = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        totals[package] = totals.get(package, 0) + int(self_us)
+    return sorted(totals.items(), key=lambda item: -item[1])[:count]
+
+def benchmark(roles, repeat, top):
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark_startup.db')}")
+    env.setdefault('COUNTER_BUFFER_JOURNAL_DIR', tempfile.mkdtemp())
+
+    # Compile everything once so no run pays for writing .pyc files
+    run('api', True, env)
+
+    # Before the factory every process, whatever it did, built the full API with everything imported
+    print(f"{'process':<32} {'startup ms (median)':>20} {'peak RSS MB':>12}")
+    for label, role, eager in [('before: full app, eager imports', 'api', True)] + \
+                              [(f'{role} role, lazy imports', role, False) for role in roles]:
+        samples = [run(role, eager, env)[0] for _ in range(repeat)]
+        seconds = statistics.median(sample['seconds'] for sample in samples)
+        rss = statistics.median(sample['max_rss_kb'] for sample in samples) / 1024
+        print(f"{label:<32} {seconds * 1000:20.0f} {rss:12.1f}")
+
+    for role in roles:
+        _, output = run(role, False, env, importtime=True)
+        print(f"\nSlowest imports for role '{role}' (python -X importtime, ms):")
+        for package, microseconds in slowest_imports(output, top):
+            print(f"  {package:<24} {microseconds / 1000:8.1f}")
+
+# Run the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare process startup per role with the old eager imports.'
+    )
+    parser.add_argument('--role', action='append', choices=['api', 'worker', 'cli'], help='roles to measure (default: all)')
+    parser.add_argument('--repeat', type=int, default=5, help='processes started per measurement')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list per role')
+    args = parser.parse_args()
+    benchmark(args.role or ['api', 'worker', 'cli'], args.repeat, args.top)
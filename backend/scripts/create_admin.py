@@ -6,7 +6,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from models import User, db
 from passlib.hash import pbkdf2_sha256
-from app import app  # Import the Flask app
+from app import create_app
+
+app = create_app(role='cli')
 
 def create_admin():
     """Create an admin user for testing."""
@@ -0,0 +1,34 @@
+import sys
+import os
+import time
+import argparse
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db
+from services.subscription_service import SubscriptionService
+from app import create_app
+
+app = create_app(role='cli')
+
+def expire_subscriptions(batch_size, interval=None):
+    """Expire due subscriptions once, or every interval seconds when given."""
+    with app.app_context():
+        while True:
+            result = SubscriptionService.expire_due(batch_size=batch_size)
+            print(f"Expired {result['expired']} subscription(s) in {result['batches']} batch(es), "
+                  f"{result['seconds']:.3f}s ({result['rows_per_second']:.0f} rows/s)")
+            db.session.remove()
+            if not interval:
+                return
+            time.sleep(interval)
+
+# Run the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mark subscriptions past their end date as expired.')
+    parser.add_argument('--batch-size', type=int, default=app.config['SUBSCRIPTION_EXPIRY_BATCH'],
+                        help='rows updated per transaction')
+    parser.add_argument('--loop', type=float, metavar='SECONDS', help='keep sweeping at this interval')
+    args = parser.parse_args()
+    expire_subscriptions(args.batch_size, args.loop)
@@ -0,0 +1,516 @@
+import sys
+import os
+import re
+import json
+import uuid
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect, select, func, desc, insert
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BooleanClauseList, UnaryExpression, Grouping
+from sqlalchemy.schema import Column
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+
+from models import db, User, Campaign, RefreshToken, Payment, Subscription
+from routes.campaigns import CURSOR_SORT_COLUMNS, cursor_order
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+EQUALITY_OPERATORS = (operators.eq, operators.is_, operators.in_op)
+RANGE_OPERATORS = (operators.lt, operators.le, operators.gt, operators.ge, operators.between_op)
+
+# Timing differences below this are noise, not a better or worse plan
+MIN_DELTA_MS = 0.05
+
+# Query shapes
+
+def query_shapes(sample):
+    """The statements the app issues on hot paths, with representative values.
+
+    Each shape mirrors a query built in routes/ or services/; keep them in
+    step when those queries change. Shapes are (name, statement, weight),
+    the weight being how common the shape is relative to the default list.
+    """
+    user_id = sample['user_id']
+    shapes = [
+        # GET /campaigns: page/per_page mode, default sort and each filter combination
+        ('campaigns: list', select(Campaign).where(Campaign.user_id == user_id)
+            .order_by(desc(Campaign.created_at)).limit(10), 1.0),
+        ('campaigns: list by status', select(Campaign).where(Campaign.user_id == user_id, Campaign.status == sample['status'])
+            .order_by(desc(Campaign.created_at)).limit(10), 0.5),
+        ('campaigns: list by platform', select(Campaign).where(Campaign.user_id == user_id, Campaign.platform == sample['platform'])
+            .order_by(desc(Campaign.created_at)).limit(10), 0.5),
+        ('campaigns: list by status and platform', select(Campaign)
+            .where(Campaign.user_id == user_id, Campaign.status == sample['status'], Campaign.platform == sample['platform'])
+            .order_by(desc(Campaign.created_at)).limit(10), 0.25),
+        # total_count of every page/per_page request
+        ('campaigns: count by status and platform', select(func.count()).select_from(Campaign)
+            .where(Campaign.user_id == user_id, Campaign.status == sample['status'], Campaign.platform == sample['platform']), 1.0),
+    ]
+
+    # GET /campaigns?cursor=&sort_by=: first page of keyset pagination for every sortable column
+    for sort_by in CURSOR_SORT_COLUMNS:
+        if sort_by in ('id', 'created_at'):
+            continue
+        shapes.append((f'campaigns: keyset by {sort_by}', select(Campaign).where(Campaign.user_id == user_id)
+                       .order_by(*cursor_order(sort_by, descending=True)).limit(11), 0.1))
+
+    shapes += [
+        # Refresh: allow-list lookups and revoking a user's tokens
+        ('refresh_tokens: by token', select(RefreshToken).where(RefreshToken.token == sample['token']), 1.0),
+        ('refresh_tokens: by token and user', select(RefreshToken)
+            .where(RefreshToken.token == sample['token'], RefreshToken.user_id == sample['token_user_id']), 1.0),
+        ('refresh_tokens: live tokens of user', select(RefreshToken.token, RefreshToken.expires_at)
+            .where(RefreshToken.user_id == sample['token_user_id'], RefreshToken.revoked_at.is_(None)), 0.1),
+        # Payments: webhook settlement and a user's payment history
+        ('payments: by external id', select(Payment).where(Payment.external_payment_id == sample['external_payment_id']), 0.1),
+        ('payments: history of user', select(Payment).where(Payment.user_id == sample['payment_user_id'])
+            .order_by(desc(Payment.created_at)), 0.1),
+    ]
+    return shapes
+
+# Candidate indexes
+
+def conjuncts(clause):
+    """Flatten the top-level ANDs of a WHERE clause."""
+    if clause is None:
+        return []
+    if isinstance(clause, Grouping):
+        return conjuncts(clause.element)
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        return [part for element in clause.clauses for part in conjuncts(element)]
+    return [clause]
+
+def shape_table(statement):
+    return statement.get_final_froms()[0]
+
+def candidate_for(statement):
+    """Index columns for a shape: equality columns, then sort columns, then one range column."""
+    table = shape_table(statement)
+    equality, in_lists, ranges = [], [], []
+    for condition in conjuncts(statement.whereclause):
+        if not isinstance(condition, BinaryExpression) or not isinstance(condition.left, Column):
+            continue
+        if condition.left.table.name != table.name or condition.left.name in equality + in_lists:
+            continue
+        if condition.operator is operators.in_op:
+            in_lists.append(condition.left.name)
+        elif condition.operator in EQUALITY_OPERATORS:
+            equality.append(condition.left.name)
+        elif condition.operator in RANGE_OPERATORS:
+            ranges.append(condition.left.name)
+    # IN lists go after plain equalities, since they fan out the seek
+    equality += in_lists
+
+    sort = []
+    for clause in statement._order_by_clauses:
+        column = clause
+        while isinstance(column, UnaryExpression):  # DESC, NULLS FIRST/LAST
+            column = column.element
+        if isinstance(column, Column) and column.table.name == table.name and column.name not in equality + sort:
+            sort.append(column.name)
+
+    columns = equality + sort
+    if not sort and ranges:
+        columns.append(ranges[0])
+    if not columns or columns == [col.name for col in table.primary_key.columns]:
+        return None
+    return table.name, tuple(columns)
+
+def index_name(table, columns):
+    name = f"ix_{table}_{'_'.join(columns)}"
+    if len(name) > 63:
+        name = f"{name[:54]}_{uuid.uuid5(uuid.NAMESPACE_OID, name).hex[:8]}"
+    return name
+
+def existing_indexes(connection, table):
+    """Column tuples already indexed on table: primary key, unique constraints and indexes."""
+    inspector = inspect(connection)
+    indexed = {}
+    pk = inspector.get_pk_constraint(table)
+    if pk.get('constrained_columns'):
+        indexed[tuple(pk['constrained_columns'])] = 'PRIMARY KEY'
+    for constraint in inspector.get_unique_constraints(table):
+        indexed[tuple(constraint['column_names'])] = constraint['name'] or 'UNIQUE'
+    for index in inspector.get_indexes(table):
+        indexed[tuple(index['column_names'])] = index['name']
+    return indexed
+
+def covered_by(columns, indexed):
+    """Name of an existing index that already serves columns (as a prefix), if any."""
+    for existing, name in indexed.items():
+        if existing[:len(columns)] == columns:
+            return name
+    return None
+
+# Measuring
+
+def compile_shape(statement, dialect):
+    return str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+def explain(connection, sql):
+    """(plan summary, planner cost or None) for sql on the connection's database."""
+    if connection.dialect.name == 'postgresql':
+        plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {sql}').scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]['Plan']
+        return ' > '.join(describe_pg_node(root)), root['Total Cost']
+
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    return '; '.join(row[-1] for row in rows), None
+
+def describe_pg_node(node):
+    label = node['Node Type']
+    if node.get('Index Name'):
+        label += f" using {node['Index Name']}"
+    yield label
+    for child in node.get('Plans', []):
+        yield from describe_pg_node(child)
+
+def time_query(connection, sql, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        connection.exec_driver_sql(sql).fetchall()
+        timings.append(time.perf_counter() - started)
+    # The fastest run is the least disturbed by everything else on the machine
+    return min(timings) * 1000
+
+def analyze(connection, tables):
+    if connection.dialect.name == 'postgresql':
+        for table in tables:
+            connection.exec_driver_sql(f'ANALYZE {table}')
+    else:
+        connection.exec_driver_sql('ANALYZE')
+
+def measure(connection, shapes, repeat):
+    results = {}
+    for name, sql in shapes:
+        plan, cost = explain(connection, sql)
+        results[name] = {'plan': plan, 'cost': cost, 'ms': time_query(connection, sql, repeat)}
+    return results
+
+# Scratch data
+
+def seed(connection, users=200, heavy_campaigns=5000, campaigns_per_user=40):
+    """Fill an empty schema with skewed synthetic data: one heavy account and many small ones."""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    statuses = ['draft', 'active', 'paused', 'completed']
+    platforms = ['facebook', 'instagram', 'google', 'tiktok', 'twitter']
+
+    connection.execute(insert(Subscription), [{'name': 'Pro', 'price': 20.0, 'duration_days': 30, 'features': '[]', 'max_campaigns': 100000}])
+    connection.execute(insert(User), [
+        {'email': f'user{i}@example.com', 'role': 'user', 'subscription_status': 'active', 'subscription_id': 1,
+         'claims_version': 0, 'campaign_count': 0}
+        for i in range(users)
+    ])
+
+    campaigns = []
+    for user_id in range(1, users + 1):
+        for _ in range(heavy_campaigns if user_id == 1 else campaigns_per_user):
+            created = now - timedelta(minutes=rng.randint(0, 500000))
+            campaigns.append({
+                'user_id': user_id, 'name': f'Campaign {rng.randint(0, 10 ** 6)}', 'objective': 'conversions',
+                'platform': rng.choice(platforms), 'budget_type': 'daily', 'budget': rng.uniform(5, 500),
+                'start_date': created, 'status': rng.choice(statuses), 'created_at': created, 'updated_at': created,
+                'impressions': rng.randint(0, 10 ** 6), 'clicks': rng.randint(0, 10 ** 4), 'spend': rng.uniform(0, 1000)
+            })
+    connection.execute(insert(Campaign), campaigns)
+
+    connection.execute(insert(RefreshToken), [
+        {'user_id': rng.randint(1, users), 'token': uuid.uuid4().hex, 'created_at': now,
+         'expires_at': now + timedelta(days=30), 'revoked_at': now if rng.random() < 0.3 else None}
+        for _ in range(users * 50)
+    ])
+    connection.execute(insert(Payment), [
+        {'user_id': rng.randint(1, users), 'subscription_id': 1, 'amount': 20.0, 'status': 'completed',
+         'external_payment_id': f'pi_{uuid.uuid4().hex}', 'created_at': now - timedelta(days=rng.randint(0, 700))}
+        for _ in range(users * 20)
+    ])
+
+def pick_sample(connection):
+    """Representative parameter values: the busiest account and real tokens and payment ids."""
+    user_id = connection.execute(select(Campaign.user_id).group_by(Campaign.user_id)
+                                 .order_by(desc(func.count())).limit(1)).scalar() or 1
+    status = connection.execute(select(Campaign.status).where(Campaign.user_id == user_id).limit(1)).scalar() or 'active'
+    platform = connection.execute(select(Campaign.platform).where(Campaign.user_id == user_id).limit(1)).scalar() or 'facebook'
+    token = connection.execute(select(RefreshToken.token, RefreshToken.user_id).limit(1)).first() or ('missing', user_id)
+    payment = connection.execute(select(Payment.external_payment_id, Payment.user_id).limit(1)).first() or ('missing', user_id)
+    return {
+        'user_id': user_id, 'status': status, 'platform': platform,
+        'token': token[0], 'token_user_id': token[1],
+        'external_payment_id': payment[0], 'payment_user_id': payment[1]
+    }
+
+# Migration output
+
+MIGRATION_TEMPLATE = '''"""Add indexes recommended by the index advisor
+
+Revision ID: {revision}
+Revises: {down_revision}
+Create Date: {create_date}
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '{revision}'
+down_revision = '{down_revision}'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ### commands generated by scripts/index_advisor.py - please review! ###
+{upgrade}
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # ### commands generated by scripts/index_advisor.py - please review! ###
+{downgrade}
+    # ### end Alembic commands ###
+'''
+
+def render_migration(recommended):
+    by_table = {}
+    for table, columns in recommended:
+        by_table.setdefault(table, []).append(columns)
+
+    upgrade, downgrade = [], []
+    for table in sorted(by_table):
+        upgrade.append(f"    with op.batch_alter_table('{table}', schema=None) as batch_op:")
+        downgrade.append(f"    with op.batch_alter_table('{table}', schema=None) as batch_op:")
+        for columns in by_table[table]:
+            upgrade.append(f"        batch_op.create_index('{index_name(table, columns)}', {list(columns)!r}, unique=False)")
+            downgrade.append(f"        batch_op.drop_index('{index_name(table, columns)}')")
+        upgrade.append('')
+        downgrade.append('')
+
+    script = ScriptDirectory.from_config(alembic_config())
+    return MIGRATION_TEMPLATE.format(
+        revision=uuid.uuid4().hex[:12],
+        down_revision=script.get_current_head(),
+        create_date=datetime.now(),
+        upgrade='\n'.join(upgrade).rstrip('\n'),
+        downgrade='\n'.join(downgrade).rstrip('\n')
+    )
+
+def alembic_config():
+    config = Config()
+    config.set_main_option('script_location', MIGRATIONS_DIR)
+    return config
+
+# Advisor
+
+def advise(engine, repeat=20, min_gain=0.2, max_per_table=3):
+    """Measure every shape before and after its candidate index; returns (report rows, recommendations)."""
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            analyze(connection, db.metadata.tables)
+            sample = pick_sample(connection)
+            shapes = [(name, statement, compile_shape(statement, connection.dialect))
+                      for name, statement, _ in query_shapes(sample)]
+            weights = {name: weight for name, _, weight in query_shapes(sample)}
+            before = measure(connection, [(name, sql) for name, _, sql in shapes], repeat)
+
+            # One candidate per shape, unless an existing index already leads with its columns
+            candidates, covered = {}, {}
+            indexed = {}
+            for name, statement, _ in shapes:
+                candidate = candidate_for(statement)
+                if candidate is None:
+                    continue
+                table, columns = candidate
+                if table not in indexed:
+                    indexed[table] = existing_indexes(connection, table)
+                existing = covered_by(columns, indexed[table])
+                if existing:
+                    covered[name] = existing
+                else:
+                    candidates.setdefault(candidate, []).append(name)
+
+            # A candidate that leads another on the same table is served by the longer one
+            for candidate in sorted(candidates, key=lambda c: len(c[1])):
+                table, columns = candidate
+                longer = next((other for other in candidates if other[0] == table
+                               and len(other[1]) > len(columns) and other[1][:len(columns)] == columns), None)
+                if longer is not None:
+                    candidates[longer] += candidates.pop(candidate)
+
+            # Build every candidate, then credit each with the time it saves the shapes that use it
+            for table, columns in candidates:
+                connection.exec_driver_sql(
+                    f"CREATE INDEX {index_name(table, columns)} ON {table} ({', '.join(columns)})"
+                )
+            analyze(connection, {table for table, _ in candidates})
+            trial = measure(connection, [(name, sql) for name, _, sql in shapes], repeat)
+
+            # A candidate that makes any shape slower is out, whatever it saves elsewhere
+            benefit = {}
+            for candidate in candidates:
+                used_by = [name for name, _, _ in shapes if uses(trial[name]['plan'], candidate)]
+                if any(regressed(before[name], trial[name], min_gain) for name in used_by):
+                    continue
+                gains = [gain(before[name], trial[name]) for name in used_by]
+                gains = [g for g in gains if g >= min_gain]
+                if gains:
+                    benefit[candidate] = sum(weights[name] * (before[name]['ms'] - trial[name]['ms']) for name in used_by)
+
+            # Keep the most valuable few per table; every extra index taxes writes
+            recommended = []
+            for table in {table for table, _ in benefit}:
+                ranked = sorted((c for c in benefit if c[0] == table and benefit[c] > 0), key=lambda c: -benefit[c])
+                recommended += ranked[:max_per_table]
+            recommended.sort()
+
+            # Re-measure with exactly the recommended set, which is what the migration creates.
+            # Plans can change again once the other candidates are gone, so drop any
+            # recommendation a shape got slower with and measure again until none is left.
+            dropped = [candidate for candidate in candidates if candidate not in recommended]
+            while True:
+                for candidate in dropped:
+                    connection.exec_driver_sql(f'DROP INDEX {index_name(*candidate)}')
+                analyze(connection, {table for table, _ in candidates})
+                after = measure(connection, [(name, sql) for name, _, sql in shapes], repeat)
+                dropped = [candidate for candidate in recommended
+                           if any(regressed(before[name], after[name], min_gain) and uses(after[name]['plan'], candidate)
+                                  for name, _, _ in shapes)]
+                if not dropped:
+                    break
+                recommended = [candidate for candidate in recommended if candidate not in dropped]
+        finally:
+            # Leave a Postgres database as we found it (SQLite has committed the DDL; see scratch_engine)
+            transaction.rollback()
+
+    rows = []
+    for name, _, _ in shapes:
+        rows.append({
+            'shape': name,
+            'before': before[name],
+            'after': after[name],
+            'covered_by': covered.get(name)
+        })
+    return rows, recommended
+
+def gain(before, after):
+    """Fractional improvement, by planner cost where the database reports one and by time otherwise."""
+    if before['cost'] and after['cost'] is not None:
+        return (before['cost'] - after['cost']) / before['cost']
+    if abs(before['ms'] - after['ms']) < MIN_DELTA_MS:
+        return 0.0
+    return (before['ms'] - after['ms']) / before['ms']
+
+def access_path(plan):
+    """A plan with index names left out."""
+    return re.sub(r'INDEX \w+', 'INDEX', plan)
+
+def regressed(before, after, min_gain):
+    """Whether a shape got slower by more than min_gain with a different plan.
+
+    Swapping one index for another with the same access path is only timing noise.
+    """
+    return gain(before, after) < -min_gain and access_path(before['plan']) != access_path(after['plan'])
+
+def uses(plan, candidate):
+    return re.search(rf'\b{index_name(*candidate)}\b', plan) is not None
+
+def print_report(rows, recommended, min_gain=0.2):
+    print(f"{'shape':<42} {'cost before':>12} {'cost after':>11} {'ms before':>10} {'ms after':>9}  plan after")
+    for row in rows:
+        before, after = row['before'], row['after']
+        cost_before = f"{before['cost']:.1f}" if before['cost'] is not None else '-'
+        cost_after = f"{after['cost']:.1f}" if after['cost'] is not None else '-'
+        print(f"{row['shape']:<42} {cost_before:>12} {cost_after:>11} {before['ms']:10.3f} {after['ms']:9.3f}  {after['plan']}")
+
+    covered = [row for row in rows if row['covered_by']]
+    if covered:
+        print('\nAlready served by existing indexes:')
+        for row in covered:
+            print(f"  {row['shape']}: {row['covered_by']}")
+
+    # Recommendations that slow a shape down are dropped, so anything left here is slower
+    # for another reason (a changed plan not using a new index); worth a look before merging
+    slower = [row for row in rows if regressed(row['before'], row['after'], min_gain)]
+    if slower:
+        print('\nSlower with the recommended indexes:')
+        for row in slower:
+            print(f"  {row['shape']}: {row['before']['plan']}  ->  {row['after']['plan']}")
+
+    print('\nRecommended indexes:' if recommended else '\nNo new indexes recommended.')
+    for table, columns in recommended:
+        print(f"  {index_name(table, columns)} ON {table} ({', '.join(columns)})")
+        print(f"    models.py: db.Index('{index_name(table, columns)}', {', '.join(repr(c) for c in columns)})")
+
+def scratch_engine(database_url, rows):
+    """Engine on a database the advisor may change: a copy of a SQLite file, or a seeded temp file.
+
+    Postgres is used in place: its DDL is transactional, so everything the
+    advisor creates is rolled back with the transaction. SQLite is only ever
+    worked on as a copy: pysqlite opens a transaction only before INSERT,
+    UPDATE and DELETE, so the advisor's CREATE and DROP INDEX run in
+    autocommit mode and the rollback does not undo them.
+    """
+    if database_url and not database_url.startswith('sqlite'):
+        return create_engine(database_url), None
+
+    directory = tempfile.mkdtemp(prefix='index_advisor_')
+    path = os.path.join(directory, 'scratch.db')
+    if database_url:
+        # Copy with the backup API so a live WAL database is copied consistently
+        source = sqlite3.connect(database_url.split('sqlite:///', 1)[1])
+        target = sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        engine = create_engine(f'sqlite:///{path}')
+    else:
+        engine = create_engine(f'sqlite:///{path}')
+        db.metadata.create_all(engine)
+        with engine.begin() as connection:
+            seed(connection, users=rows)
+    return engine, directory
+
+# Run the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay the app\'s hot query shapes and recommend indexes.')
+    parser.add_argument('--database-url', help='database to advise on (default: a seeded scratch SQLite database); '
+                                               'SQLite files are copied first, Postgres changes are rolled back')
+    parser.add_argument('--users', type=int, default=200, help='accounts to generate for the scratch database')
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs per query')
+    parser.add_argument('--min-gain', type=float, default=0.2, help='smallest improvement worth an index (0.2 = 20%%)')
+    parser.add_argument('--max-per-table', type=int, default=3, help='most new indexes to add to one table')
+    parser.add_argument('--write', action='store_true', help='write the recommendations as a migration in migrations/versions')
+    args = parser.parse_args()
+
+    engine, scratch = scratch_engine(args.database_url, args.users)
+    try:
+        rows, recommended = advise(engine, args.repeat, args.min_gain, args.max_per_table)
+    finally:
+        engine.dispose()
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    print_report(rows, recommended, args.min_gain)
+    if recommended and args.write:
+        migration = render_migration(recommended)
+        revision = re.search(r"^revision = '(\w+)'", migration, re.M).group(1)
+        path = os.path.join(MIGRATIONS_DIR, 'versions', f'{revision}_add_advised_indexes.py')
+        with open(path, 'w') as f:
+            f.write(migration)
+        print(f'\nWrote {os.path.relpath(path)}')
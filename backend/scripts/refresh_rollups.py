@@ -0,0 +1,32 @@
+import sys
+import os
+import time
+import argparse
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db
+from services.rollup_service import RollupService
+from app import create_app
+
+app = create_app(role='cli')
+
+def refresh_rollups(interval=None):
+    """Refresh metric rollups once, or every interval seconds when given."""
+    with app.app_context():
+        while True:
+            result = RollupService.refresh()
+            print(f"Rebuilt {result['campaign_days']} campaign-days, {result['campaign_months']} campaign-months "
+                  f"and {result['users']} users' platform rollups in {result['seconds']:.3f}s")
+            db.session.remove()
+            if not interval:
+                return
+            time.sleep(interval)
+
+# Run the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Incrementally refresh the campaign metric rollups.')
+    parser.add_argument('--loop', type=float, metavar='SECONDS', help='keep refreshing at this interval')
+    args = parser.parse_args()
+    refresh_rollups(args.loop)
@@ -0,0 +1,36 @@
+import sys
+import os
+import argparse
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, WebhookEvent
+from services.webhook_service import WebhookService
+from app import create_app
+
+app = create_app(role='worker')
+
+def reprocess_webhooks(statuses, provider=None, run=False):
+    """Requeue failed or dead webhook events, optionally processing them right away."""
+    with app.app_context():
+        count = WebhookService.requeue(statuses, provider)
+        print(f"Requeued {count} webhook event(s)")
+        if run:
+            processed = WebhookService.process_due(max_attempts=app.config['WEBHOOK_MAX_ATTEMPTS'])
+            print(f"Processed {processed} webhook event(s)")
+            failed = WebhookEvent.query.filter(WebhookEvent.status.in_(['failed', 'dead'])).count()
+            if failed:
+                print(f"{failed} event(s) still failing; see webhook_events.last_error")
+        db.session.remove()
+
+# Run the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Requeue webhook events that failed processing.')
+    parser.add_argument('--status', action='append', choices=['dead', 'failed', 'ignored', 'processed'],
+                        help="statuses to requeue (default: dead and failed); handlers are idempotent, "
+                             "so requeueing processed events is safe")
+    parser.add_argument('--provider', choices=['stripe', 'paypal', 'mpesa'])
+    parser.add_argument('--run', action='store_true', help='process the requeued events in this process')
+    args = parser.parse_args()
+    reprocess_webhooks(args.status or ['dead', 'failed'], args.provider, args.run)
@@ -0,0 +1,75 @@
+import sys
+import os
+import signal
+import time
+import argparse
+import threading
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db
+from services.subscription_service import SubscriptionService
+from services.refresh_token_index import sweep_expired_tokens
+from app import create_app
+
+app = create_app(role='worker')
+
+def expire_subscriptions():
+    result = SubscriptionService.expire_due(batch_size=app.config['SUBSCRIPTION_EXPIRY_BATCH'])
+    if result['expired']:
+        print(f"Expired {result['expired']} subscription(s)")
+
+def sweep_refresh_tokens():
+    # Here rather than in the API processes, so one process deletes expired tokens
+    sweep_expired_tokens(batch_size=app.config['REFRESH_TOKEN_SWEEP_BATCH'])
+
+def run_worker(expiry_interval=None):
+    """Drain the webhook inbox and sweep expired refresh tokens (optionally expiring subscriptions) until SIGTERM or Ctrl-C."""
+    sweep_interval = app.config['REFRESH_TOKEN_SWEEP_INTERVAL']
+    jobs = []  # [interval, job, next run]
+    if expiry_interval:
+        jobs.append([expiry_interval, expire_subscriptions, time.monotonic()])
+    if sweep_interval > 0:
+        jobs.append([sweep_interval, sweep_refresh_tokens, time.monotonic()])
+
+    pool = app.extensions.get('webhook_workers')
+    if pool is None and not jobs:
+        print("WEBHOOK_WORKERS is 0, no webhook workers to run")
+        return
+    if pool is not None:
+        pool.start()
+    print(f"Running {pool.workers if pool else 0} webhook worker(s)"
+          + (f", expiring subscriptions every {expiry_interval:.0f}s" if expiry_interval else '')
+          + (f", sweeping expired refresh tokens every {sweep_interval:.0f}s" if sweep_interval > 0 else ''))
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        while True:
+            for scheduled in jobs:
+                interval, job, next_run = scheduled
+                if time.monotonic() < next_run:
+                    continue
+                scheduled[2] = time.monotonic() + interval
+                with app.app_context():
+                    try:
+                        job()
+                    except Exception as e:
+                        print(f"{job.__name__} failed: {str(e)}")
+                    finally:
+                        db.session.remove()
+            timeout = min((next_run for _, _, next_run in jobs), default=None)
+            if stop.wait(None if timeout is None else max(0.0, timeout - time.monotonic())):
+                break
+    except KeyboardInterrupt:
+        pass
+    # Worker threads are daemons; an event being processed is retried once its lease expires
+
+# Run the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run background jobs outside the API processes.')
+    parser.add_argument('--expire-every', type=float, metavar='SECONDS',
+                        help='also expire due subscriptions at this interval')
+    args = parser.parse_args()
+    run_worker(args.expire_every)
@@ -0,0 +1,60 @@
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+
+def snapshot(primary_path, directory):
+    """Consistent copy of the primary, stamped with the time it was taken."""
+    taken_at = int(time.time())
+    path = os.path.join(directory, 'snapshot.db')
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(path)
+    try:
+        source.backup(target)
+        # What the app's lag check reads (see LAG_QUERIES in middleware/read_replica.py)
+        target.execute('CREATE TABLE IF NOT EXISTS replica_heartbeat (id INTEGER PRIMARY KEY, copied_at INTEGER NOT NULL)')
+        target.execute('INSERT OR REPLACE INTO replica_heartbeat (id, copied_at) VALUES (1, ?)', (taken_at,))
+        target.commit()
+    finally:
+        target.close()
+        source.close()
+    return path
+
+def apply(snapshot_path, replica_path):
+    """Replace the replica's contents with a snapshot; readers see the old or the new copy."""
+    source = sqlite3.connect(snapshot_path)
+    target = sqlite3.connect(replica_path, timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def replicate(primary_path, replica_path, interval=1.0, delay=0.0, once=False):
+    """Copy the primary to the replica every interval seconds, each copy delay seconds late."""
+    with tempfile.TemporaryDirectory() as directory:
+        while True:
+            started = time.monotonic()
+            path = snapshot(primary_path, directory)
+            if delay:
+                time.sleep(delay)
+            apply(path, replica_path)
+            print(f"Replicated {primary_path} -> {replica_path} in {time.monotonic() - started:.3f}s")
+            if once:
+                return
+            time.sleep(interval)
+
+# Run the script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Keep a SQLite file in step with another, to try read-replica routing locally '
+                    '(DATABASE_URL=sqlite:///<primary>, DATABASE_REPLICA_URL=sqlite:///<replica>).'
+    )
+    parser.add_argument('primary', help='path of the primary database file')
+    parser.add_argument('replica', help='path of the replica database file (created if missing)')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between copies')
+    parser.add_argument('--delay', type=float, default=0.0, help='extra replication lag to simulate, in seconds')
+    parser.add_argument('--once', action='store_true', help='copy once and exit')
+    args = parser.parse_args()
+    replicate(args.primary, args.replica, args.interval, args.delay, args.once)
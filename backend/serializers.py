@@ -0,0 +1,90 @@
+"""Precompiled model serializers and the JSON codec used for API responses.
+
+orjson is used when it is installed and the standard library json module
+otherwise. Serializers leave datetimes as-is; both codecs render them as ISO
+8601 strings when the response is encoded (see middleware/json_encoder.py).
+"""
+import json
+import datetime
+import decimal
+import uuid
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# Field kinds understood by compile_serializer()
+JSON_LIST = 'json_list'  # String column holding a JSON array, decoded to a list
+NESTED = 'nested'        # Related model, serialized with its own to_dict()
+
+def json_loads(s):
+    """Decode JSON with the fastest available codec."""
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+def json_default(obj):
+    """Fallback for values neither codec handles natively."""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def json_dumps_bytes(obj, indent=False):
+    """Encode obj as UTF-8 JSON bytes with the fastest available codec."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=json_default, option=option)
+    if indent:
+        return json.dumps(obj, default=json_default, indent=2).encode()
+    return json.dumps(obj, default=json_default, separators=(',', ':')).encode()
+
+def compile_serializer(name, fields):
+    """Generate a function that turns a model instance into a dict.
+
+    fields is a sequence of (key, attribute) or (key, attribute, kind) tuples.
+    The function body is a single dict literal built once at import time, so
+    serializing a row costs one lookup per field and no per-row branching on
+    the field list. Loaded attributes are read straight from the instance
+    __dict__; if any is missing (deferred, expired or not yet loaded) the
+    function falls back to regular attribute access, which loads it.
+    """
+    fast_lines, slow_lines = [], []
+    fast_items, slow_items = [], []
+    for i, field in enumerate(fields):
+        key, attribute = field[0], field[1]
+        kind = field[2] if len(field) > 2 else None
+        for lines, items, source in ((fast_lines, fast_items, f'd[{attribute!r}]'),
+                                     (slow_lines, slow_items, f'obj.{attribute}')):
+            if kind == JSON_LIST:
+                lines.append(f'v{i} = {source}')
+                items.append(f'{key!r}: json_loads(v{i}) if v{i} else []')
+            elif kind == NESTED:
+                lines.append(f'v{i} = {source}')
+                items.append(f'{key!r}: v{i}.to_dict() if v{i} is not None else None')
+            else:
+                items.append(f'{key!r}: {source}')
+
+    source = '\n'.join([
+        f'def serialize_{name}(obj):',
+        '    d = obj.__dict__',
+        '    try:',
+        *[f'        {line}' for line in fast_lines],
+        '        return {' + ', '.join(fast_items) + '}',
+        '    except KeyError:',
+        '        pass',
+        *[f'    {line}' for line in slow_lines],
+        '    return {' + ', '.join(slow_items) + '}'
+    ])
+
+    namespace = {'json_loads': json_loads}
+    exec(source, namespace)
+    return namespace[f'serialize_{name}']
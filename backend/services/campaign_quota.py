@@ -0,0 +1,54 @@
+from sqlalchemy import event, select, update, func
+
+from models import db, User, Campaign, Subscription
+
+users = User.__table__
+
+class CampaignLimitReached(Exception):
+    """Raised while flushing a new campaign that would exceed the owner's plan limit."""
+
+    def __init__(self, user_id):
+        super().__init__(f'Campaign limit reached for user {user_id}')
+        self.user_id = user_id
+
+class CampaignQuota:
+    """Keeps users.campaign_count equal to the number of campaigns each user owns.
+
+    Campaign inserts and deletes made through the ORM adjust the counter in
+    the same transaction (see the listeners below). An insert only goes
+    through if the owner has no plan or is below the plan's max_campaigns:
+    the check and the increment are one conditional UPDATE, so the row lock
+    it takes serializes concurrent creates and the limit holds under
+    parallel requests. Otherwise the flush fails with CampaignLimitReached.
+    """
+
+    @staticmethod
+    def recount(user_id=None):
+        """Reset campaign_count from the campaigns table (all users, or one); the caller commits."""
+        actual = select(func.count(Campaign.id)).where(Campaign.user_id == users.c.id).scalar_subquery()
+        statement = update(users).values(campaign_count=actual)
+        if user_id is not None:
+            statement = statement.where(users.c.id == user_id)
+        return db.session.execute(statement).rowcount
+
+@event.listens_for(Campaign, 'after_insert')
+def _campaign_inserted(mapper, connection, target):
+    plan_limit = select(Subscription.max_campaigns) \
+        .where(Subscription.id == users.c.subscription_id) \
+        .scalar_subquery()
+    result = connection.execute(
+        update(users)
+        .where(users.c.id == target.user_id)
+        .where(db.or_(plan_limit.is_(None), users.c.campaign_count < plan_limit))
+        .values(campaign_count=users.c.campaign_count + 1)
+    )
+    if result.rowcount == 0:
+        raise CampaignLimitReached(target.user_id)
+
+@event.listens_for(Campaign, 'after_delete')
+def _campaign_deleted(mapper, connection, target):
+    connection.execute(
+        update(users)
+        .where(users.c.id == target.user_id)
+        .values(campaign_count=users.c.campaign_count - 1)
+    )
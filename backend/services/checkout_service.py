@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+from models import db, CheckoutJob, Subscription
+from services.payment_service import PaymentService
+
+logger = logging.getLogger(__name__)
+
+class CheckoutBusy(Exception):
+    """Raised when the checkout queue has no room for another job."""
+
+class CheckoutService:
+    """Checkouts as background jobs.
+
+    The subscribe routes record a CheckoutJob and return its id; the call
+    to Stripe, PayPal or MPESA happens on the checkout queue, and the client
+    polls GET /subscriptions/checkout/<job_id> for the outcome. A successful
+    job leaves a pending Payment keyed by the provider's payment id, which
+    the provider's webhook or confirm-payment later completes.
+    """
+
+    @staticmethod
+    def start(user_id, subscription, provider, params=None):
+        """Create a job and queue it; raises CheckoutBusy when the queue is full."""
+        queue = get_checkout_queue()
+        if queue is not None:
+            queue.reserve()
+
+        try:
+            job = CheckoutJob(
+                user_id=user_id,
+                subscription_id=subscription.id,
+                provider=provider,
+                params=json.dumps(params or {})
+            )
+            db.session.add(job)
+            db.session.commit()
+        except Exception:
+            if queue is not None:
+                queue.release()
+            raise
+
+        if queue is not None:
+            queue.dispatch(job.id)
+        else:
+            CheckoutService.run(job.id)
+        return job
+
+    @staticmethod
+    def run(job_id):
+        """Call the provider for a queued job and record the outcome."""
+        job = db.session.get(CheckoutJob, job_id)
+        if job is None or job.status != 'queued':
+            return
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+        try:
+            subscription = db.session.get(Subscription, job.subscription_id)
+            result, external_payment_id = PROVIDERS[job.provider](job, subscription, json.loads(job.params or '{}'))
+            # The provider has started charging the customer: keep the pending
+            # Payment whatever happens to the job, or the provider's callback
+            # (MPESA and PayPal carry nothing else to go by) finds no payment
+            PaymentService.create_pending_payment(job.user_id, subscription, external_payment_id)
+            db.session.commit()
+            outcome = {'status': 'succeeded', 'result': json.dumps(result)}
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"{job.provider} checkout {job.id} failed: {str(e)}")
+            outcome = {'status': 'failed', 'error': f'Payment processing failed: {str(e)}'}
+        outcome['finished_at'] = datetime.utcnow()
+
+        # get_job may have reported the job failed (timed out) in the meantime,
+        # and the client may have acted on that: the answer it got stands. Any
+        # pending Payment is already committed, so a late callback still settles it
+        finished = CheckoutJob.query.filter_by(id=job_id, status='running') \
+            .update(outcome, synchronize_session=False)
+        if not finished:
+            db.session.rollback()
+            logger.warning(f"Checkout {job_id} finished after it was reported timed out; its outcome is discarded")
+            return
+        db.session.commit()
+
+    @staticmethod
+    def start_stripe(job, subscription, params):
+        payment_intent = PaymentService.create_stripe_payment_intent(
+            amount=subscription.price,
+            metadata={
+                'user_id': job.user_id,
+                'subscription_id': subscription.id
+            }
+        )
+        return {
+            'clientSecret': payment_intent['clientSecret'],
+            'paymentIntentId': payment_intent['id']
+        }, payment_intent['id']
+
+    @staticmethod
+    def start_paypal(job, subscription, params):
+        payment = PaymentService.create_paypal_payment(
+            amount=subscription.price,
+            description=f"Subscription to {subscription.name} plan"
+        )
+        return {
+            'paymentId': payment['id'],
+            'approvalUrl': payment['approvalUrl']
+        }, payment['id']
+
+    @staticmethod
+    def start_mpesa(job, subscription, params):
+        mpesa_response = PaymentService.initiate_mpesa_payment(
+            phone_number=params['phoneNumber'],
+            amount=subscription.price,
+            account_reference=f"SUB{subscription.id}",
+            transaction_desc=f"Subscription to {subscription.name} plan"
+        )
+        return {
+            'requestId': mpesa_response.get('CheckoutRequestID'),
+            'message': 'MPESA payment initiated. Please check your phone to complete the transaction.'
+        }, mpesa_response.get('CheckoutRequestID')
+
+    @staticmethod
+    def get_job(job_id, user_id, wait=0.0, job_timeout=120.0):
+        """Return the user's job, waiting up to wait seconds for it to finish.
+
+        Jobs still unfinished job_timeout seconds after they were created
+        belonged to a worker that died, and are reported as failed.
+        """
+        deadline = time.monotonic() + wait
+        queue = get_checkout_queue()
+        while True:
+            job = CheckoutJob.query.filter_by(id=job_id, user_id=user_id).first()
+            if job is None or job.finished:
+                return job
+
+            if job.created_at < datetime.utcnow() - timedelta(seconds=job_timeout):
+                # Only if it is still unfinished: the job may complete meanwhile
+                CheckoutJob.query.filter(CheckoutJob.id == job.id, CheckoutJob.status.in_(('queued', 'running'))).update({
+                    'status': 'failed',
+                    'error': 'Payment processing timed out, please try again',
+                    'finished_at': datetime.utcnow()
+                }, synchronize_session=False)
+                db.session.commit()
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+
+            # End the transaction so the connection goes back to the pool while waiting
+            db.session.rollback()
+            if queue is None or not queue.wait(job_id, remaining):
+                # Running in another process (or here, and still going): check again shortly
+                time.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+
+PROVIDERS = {
+    'stripe': CheckoutService.start_stripe,
+    'paypal': CheckoutService.start_paypal,
+    'mpesa': CheckoutService.start_mpesa
+}
+
+class CheckoutQueue:
+    """Threads that run checkout jobs outside the request thread.
+
+    Provider calls are network-bound, so a thread pool is enough to keep
+    them off request workers. At most workers + queue_depth jobs are
+    accepted at once; beyond that checkouts fail fast with CheckoutBusy (a
+    503) instead of piling up behind a slow provider.
+    """
+
+    def __init__(self, app, workers=8, queue_depth=64):
+        self.app = app
+        self.workers = workers
+        self.queue_depth = queue_depth
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._pid = None
+        self._executor = None
+        self._done = {}  # job_id -> Event, for long-polls served by this process
+        self._stats = {'submitted': 0, 'rejected': 0}
+
+    def _get_executor(self):
+        """Create the pool lazily in each process, so workers forked by gunicorn get their own."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='checkout')
+                    self._done = {}
+                    self._pid = os.getpid()
+        return self._executor
+
+    def reserve(self):
+        """Claim room for one job or raise CheckoutBusy."""
+        if not self._slots.acquire(blocking=False):
+            self._stats['rejected'] += 1
+            raise CheckoutBusy('Checkout is busy, try again shortly')
+
+    def release(self):
+        self._slots.release()
+
+    def dispatch(self, job_id):
+        """Run a job in the pool using the slot claimed by reserve()."""
+        executor = self._get_executor()
+        self._done[job_id] = threading.Event()
+        try:
+            executor.submit(self._run, job_id)
+        except Exception:
+            self._done.pop(job_id, None)
+            self.release()
+            raise
+        self._stats['submitted'] += 1
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                try:
+                    CheckoutService.run(job_id)
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            logger.error(f"Checkout job {job_id} crashed: {str(e)}")
+        finally:
+            self.release()
+            done = self._done.pop(job_id, None)
+            if done is not None:
+                done.set()
+
+    def wait(self, job_id, timeout):
+        """Block until a job running in this process finishes; False if it is not ours."""
+        done = self._done.get(job_id)
+        if done is None:
+            return False
+        done.wait(timeout)
+        return True
+
+    def stats(self):
+        return {**self._stats, 'in_flight': len(self._done)}
+
+def setup_checkout_queue(app):
+    """Attach a CheckoutQueue when CHECKOUT_WORKERS is positive.
+
+    With 0 workers the provider call runs in the subscribe request, which is
+    what scripts use.
+    """
+    workers = int(app.config.get('CHECKOUT_WORKERS', 0))
+    if workers <= 0:
+        return None
+
+    queue = CheckoutQueue(app, workers=workers, queue_depth=int(app.config.get('CHECKOUT_QUEUE_DEPTH', 64)))
+    app.extensions['checkout_queue'] = queue
+    return queue
+
+def get_checkout_queue():
+    """Return the current app's CheckoutQueue, or None when checkouts run inline."""
+    return current_app.extensions.get('checkout_queue')
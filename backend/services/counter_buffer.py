@@ -0,0 +1,390 @@
+import os
+import glob
+import json
+import time
+import uuid
+import fcntl
+import atexit
+import socket
+import logging
+import threading
+from datetime import datetime
+from flask import current_app
+
+from models import db, Campaign, CounterFlush
+from services.ingestion_service import IngestionService
+
+logger = logging.getLogger(__name__)
+
+# Journal file names embed the host, so dots (which separate name parts) are replaced
+HOSTNAME = socket.gethostname().replace('.', '_')
+
+class CounterBuffer:
+    """In-process write-behind buffer for campaign counters and metric buckets.
+
+    Ingested deltas are summed in memory and written by a background thread
+    every flush_interval seconds, or sooner once max_pending events are
+    waiting, so a hot campaign row is updated once per flush instead of once
+    per request.
+
+    Every add() is first appended to a per-process journal file. A flush
+    rotates the journal into a numbered segment and records the segment's
+    name in counter_flushes in the same transaction as the counter updates.
+    On start, journals and segments left by dead processes are replayed
+    unless their segment name is already recorded, so increments survive a
+    worker crash and are never applied twice.
+
+    Each instance holds an exclusive flock on its own lock file for as long
+    as its process lives. The kernel drops the lock when the process dies,
+    however it dies, so a file whose owner's lock can be taken is an orphan.
+    Unlike a pid check this is not fooled by pid reuse (after a container
+    restart the same pids are alive again). gunicorn.conf.py starts the
+    buffer as each worker boots, so orphans are replayed even by a worker
+    that never receives an event.
+    """
+
+    def __init__(self, app, journal_dir, flush_interval=1.0, max_pending=50000, fsync=False):
+        self.app = app
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._journal = None
+        self._owner_lock = None
+        self._reset_state()
+
+    def _reset_state(self):
+        self._totals = {}
+        self._buckets = {}
+        self._pending_events = 0
+        self._segments = []           # (path, name) of journal segments covered by pending deltas
+        self._committed_segments = []  # Names whose counter_flushes rows can be pruned
+        self._sequence = 0
+        self._instance_id = f'{HOSTNAME}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._stats = {
+            'flushes': 0,
+            'flush_failures': 0,
+            'flushed_events': 0,
+            'last_flush_at': None,
+            'last_flush_seconds': None,
+            'max_flush_seconds': 0.0,
+            'total_flush_seconds': 0.0
+        }
+
+    # Lifecycle
+
+    def start(self):
+        """Start the buffer in the current process (safe to call repeatedly).
+
+        Starting is lazy and tied to the process id, so an app preloaded
+        before a fork gets a fresh journal and flush thread in each worker.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._reset_state()
+            os.makedirs(self.journal_dir, exist_ok=True)
+            # Held until this process exits: marks its journal files as owned
+            self._owner_lock = open(self._lock_path(self._instance_id), 'w')
+            fcntl.flock(self._owner_lock, fcntl.LOCK_EX)
+            self._journal = open(self._journal_path(), 'a', encoding='utf-8')
+            self._pid = os.getpid()
+
+            self._thread = threading.Thread(target=self._run, name='counter-buffer', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+        try:
+            self.recover()
+        except Exception as e:
+            logger.error(f"Counter journal recovery failed: {str(e)}")
+
+    def close(self):
+        """Flush everything that is buffered; gunicorn.conf.py calls it from worker_exit."""
+        if self._pid != os.getpid():
+            return
+        self.flush()
+
+    # Writes
+
+    def add(self, totals, buckets, event_count):
+        """Buffer coalesced deltas from IngestionService.coalesce()."""
+        if not totals and not buckets:
+            return
+        self.start()
+
+        line = json.dumps({
+            't': [[cid, d['impressions'], d['clicks'], d['spend']] for cid, d in totals.items()],
+            'b': [[cid, bucket.isoformat(), d['impressions'], d['clicks'], d['spend']]
+                  for (cid, bucket), d in buckets.items()]
+        }, separators=(',', ':'))
+
+        with self._lock:
+            self._journal.write(line + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+
+            self._merge(totals, buckets)
+            self._pending_events += event_count
+            over_threshold = self._pending_events >= self.max_pending
+
+        if over_threshold:
+            self._wake.set()
+
+    def _merge(self, totals, buckets):
+        """Add deltas into the pending maps; caller holds self._lock."""
+        for campaign_id, delta in totals.items():
+            pending = self._totals.get(campaign_id)
+            if pending is None:
+                self._totals[campaign_id] = dict(delta)
+            else:
+                pending['impressions'] += delta['impressions']
+                pending['clicks'] += delta['clicks']
+                pending['spend'] += delta['spend']
+        for key, delta in buckets.items():
+            pending = self._buckets.get(key)
+            if pending is None:
+                self._buckets[key] = dict(delta)
+            else:
+                pending['impressions'] += delta['impressions']
+                pending['clicks'] += delta['clicks']
+                pending['spend'] += delta['spend']
+
+    # Flushing
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Counter buffer flush failed: {str(e)}")
+
+    def flush(self):
+        """Write all pending deltas in one transaction. Returns the number of events flushed."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._totals and not self._buckets:
+                    return 0
+                totals, buckets, events = self._totals, self._buckets, self._pending_events
+                self._totals, self._buckets, self._pending_events = {}, {}, 0
+                segments = self._segments + [self._rotate_journal()]
+                self._segments = []
+
+            started = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    self._write(totals, buckets, [name for _, name in segments])
+            except Exception:
+                # Put the deltas back; their segments stay on disk until a flush succeeds
+                with self._lock:
+                    self._merge(totals, buckets)
+                    self._pending_events += events
+                    self._segments = segments + self._segments
+                    self._stats['flush_failures'] += 1
+                raise
+
+            elapsed = time.perf_counter() - started
+            for path, name in segments:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._committed_segments.append(name)
+
+            with self._lock:
+                stats = self._stats
+                stats['flushes'] += 1
+                stats['flushed_events'] += events
+                stats['last_flush_at'] = datetime.utcnow()
+                stats['last_flush_seconds'] = elapsed
+                stats['max_flush_seconds'] = max(stats['max_flush_seconds'], elapsed)
+                stats['total_flush_seconds'] += elapsed
+            return events
+
+    def _write(self, totals, buckets, segment_names):
+        """Apply deltas and record their segments in one transaction."""
+        try:
+            # Campaigns deleted since their events were buffered are dropped
+            campaign_ids = set(totals) | {cid for cid, _ in buckets}
+            existing = {row.id for row in db.session.query(Campaign.id).filter(Campaign.id.in_(campaign_ids))}
+            totals = {cid: d for cid, d in totals.items() if cid in existing}
+            buckets = {key: d for key, d in buckets.items() if key[0] in existing}
+
+            IngestionService.flush(totals, buckets)
+            db.session.add_all([CounterFlush(segment=name) for name in segment_names])
+
+            # Segment files from earlier flushes are gone, so their markers are no longer needed
+            if self._committed_segments:
+                pruned = self._committed_segments
+                CounterFlush.query.filter(CounterFlush.segment.in_(pruned)).delete(synchronize_session=False)
+            db.session.commit()
+            self._committed_segments = []
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+    def _rotate_journal(self):
+        """Close the live journal as a numbered segment; caller holds self._lock."""
+        self._journal.close()
+        self._sequence += 1
+        name = f'{self._instance_id}.{self._sequence}'
+        path = os.path.join(self.journal_dir, f'{name}.segment')
+        os.replace(self._journal_path(), path)
+        self._journal = open(self._journal_path(), 'a', encoding='utf-8')
+        return path, name
+
+    def _journal_path(self):
+        return os.path.join(self.journal_dir, f'{self._instance_id}.journal')
+
+    def _lock_path(self, instance_id):
+        return os.path.join(self.journal_dir, f'{instance_id}.lock')
+
+    # Recovery
+
+    def recover(self):
+        """Replay journals and segments left behind by processes that are no longer running."""
+        replayed = 0
+        for path in glob.glob(os.path.join(self.journal_dir, '*.journal')) + \
+                glob.glob(os.path.join(self.journal_dir, '*.segment')):
+            filename = os.path.basename(path)
+            owner = filename.split('.', 1)[0]
+            if owner == self._instance_id or not self._is_orphan(owner):
+                continue
+
+            # Claim the file atomically so only one worker replays it
+            name = filename.rsplit('.', 1)[0]
+            if filename.endswith('.journal'):
+                name = f'{name}.recovered-{uuid.uuid4().hex[:8]}'
+            claimed = os.path.join(self.journal_dir, f'{name}.{self._instance_id}.claimed')
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+
+            with self.app.app_context():
+                already_applied = CounterFlush.query.filter_by(segment=name).first() is not None
+                db.session.remove()
+            if already_applied:
+                os.remove(claimed)
+                with self._flush_lock:
+                    self._committed_segments.append(name)
+                continue
+
+            totals, buckets, events = self._read_journal(claimed)
+            with self._lock:
+                self._merge(totals, buckets)
+                self._pending_events += events
+                self._segments.append((claimed, name))
+            replayed += 1
+
+        # Claims left by a worker that died mid-recovery are orphans too
+        for path in glob.glob(os.path.join(self.journal_dir, '*.claimed')):
+            owner = os.path.basename(path).rsplit('.', 2)[-2]
+            if owner != self._instance_id and self._is_orphan(owner):
+                os.rename(path, path.rsplit('.', 2)[0] + '.segment')
+
+        # Lock files of dead instances whose files have all been claimed
+        for path in glob.glob(os.path.join(self.journal_dir, '*.lock')):
+            owner = os.path.basename(path)[:-len('.lock')]
+            if owner == self._instance_id or not self._is_orphan(owner):
+                continue
+            if all(leftover == path for leftover in glob.glob(os.path.join(self.journal_dir, f'{owner}.*'))):
+                os.remove(path)
+
+        if replayed:
+            logger.info(f"Replayed {replayed} counter journal file(s)")
+            self._wake.set()
+        return replayed
+
+    def _is_orphan(self, instance_id):
+        """Whether the instance that wrote a journal file has exited (its lock is free)."""
+        try:
+            lock = open(self._lock_path(instance_id), 'r')
+        except FileNotFoundError:
+            # Lock files are created before any journal, and only removed once the owner is gone
+            return True
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        return True
+
+    @staticmethod
+    def _read_journal(path):
+        """Sum the deltas in a journal file, ignoring a torn final line."""
+        totals, buckets, events = {}, {}, 0
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                for cid, impressions, clicks, spend in entry.get('t', []):
+                    delta = totals.setdefault(cid, {'impressions': 0, 'clicks': 0, 'spend': 0.0})
+                    delta['impressions'] += impressions
+                    delta['clicks'] += clicks
+                    delta['spend'] += spend
+                    events += impressions + clicks
+                for cid, bucket, impressions, clicks, spend in entry.get('b', []):
+                    key = (cid, datetime.fromisoformat(bucket))
+                    delta = buckets.setdefault(key, {'impressions': 0, 'clicks': 0, 'spend': 0.0})
+                    delta['impressions'] += impressions
+                    delta['clicks'] += clicks
+                    delta['spend'] += spend
+        return totals, buckets, events
+
+    # Stats
+
+    def stats(self):
+        """Snapshot of buffered deltas and flush latency."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'pending_events': self._pending_events,
+                'pending_campaigns': len(self._totals),
+                'pending_buckets': len(self._buckets),
+                'pending_segments': len(self._segments),
+                'flush_interval': self.flush_interval,
+                'max_pending': self.max_pending
+            })
+        flushes = stats['flushes']
+        stats['avg_flush_seconds'] = stats['total_flush_seconds'] / flushes if flushes else None
+        return stats
+
+def setup_counter_buffer(app):
+    """Attach a CounterBuffer to the app when COUNTER_BUFFER_FLUSH_INTERVAL is positive.
+
+    With an interval of 0 ingested events are written synchronously.
+    """
+    interval = float(app.config.get('COUNTER_BUFFER_FLUSH_INTERVAL', 0))
+    if interval <= 0:
+        return None
+
+    buffer = CounterBuffer(
+        app,
+        journal_dir=app.config.get('COUNTER_BUFFER_JOURNAL_DIR', os.path.join(app.instance_path, 'counter_journal')),
+        flush_interval=interval,
+        max_pending=int(app.config.get('COUNTER_BUFFER_MAX_PENDING', 50000)),
+        fsync=app.config.get('COUNTER_BUFFER_FSYNC', False)
+    )
+    app.extensions['counter_buffer'] = buffer
+    return buffer
+
+def get_counter_buffer():
+    """Return the current app's CounterBuffer, or None when buffering is off."""
+    return current_app.extensions.get('counter_buffer')
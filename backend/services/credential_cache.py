@@ -0,0 +1,123 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+class CredentialCache:
+    """Provider access tokens shared by every worker on the host.
+
+    Tokens live in memory and in a small SQLite file, and are reused until
+    refresh_margin seconds before they expire. Refreshing is single-flight:
+    a per-name lock serializes threads in this process and a SQLite write
+    transaction (BEGIN IMMEDIATE) serializes processes, and each waiter
+    re-reads the store once it gets the lock, so one expiring token costs
+    one call to the provider however many checkouts are waiting on it.
+    """
+
+    def __init__(self, path, refresh_margin=60.0, busy_timeout=30.0):
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self.busy_timeout = busy_timeout
+
+        self._memory = {}  # name -> (value, expires_at)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {'memory_hits': 0, 'store_hits': 0, 'refreshes': 0}
+
+    def _connect(self):
+        """One connection per thread (and per process, since forks get new thread ids)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            os.chmod(self.path, 0o600)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS credentials '
+                '(name TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _lock_for(self, name):
+        with self._locks_lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def _fresh(self, entry):
+        return entry is not None and entry[1] - self.refresh_margin > time.time()
+
+    def _read(self, connection, name):
+        return connection.execute('SELECT value, expires_at FROM credentials WHERE name = ?', (name,)).fetchone()
+
+    def get(self, name, fetch):
+        """Return the cached credential for name, calling fetch() to refresh it when needed.
+
+        fetch returns (value, expires_in_seconds).
+        """
+        entry = self._memory.get(name)
+        if self._fresh(entry):
+            self._stats['memory_hits'] += 1
+            return entry[0]
+
+        with self._lock_for(name):
+            entry = self._memory.get(name)
+            if self._fresh(entry):
+                self._stats['memory_hits'] += 1
+                return entry[0]
+
+            connection = self._connect()
+            entry = self._read(connection, name)
+            if self._fresh(entry):
+                self._stats['store_hits'] += 1
+                self._memory[name] = entry
+                return entry[0]
+
+            # Take the write lock, then check again: another worker may have just refreshed it
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                entry = self._read(connection, name)
+                if self._fresh(entry):
+                    self._stats['store_hits'] += 1
+                else:
+                    value, expires_in = fetch()
+                    entry = (value, time.time() + float(expires_in))
+                    connection.execute(
+                        'INSERT OR REPLACE INTO credentials (name, value, expires_at) VALUES (?, ?, ?)',
+                        (name, entry[0], entry[1])
+                    )
+                    self._stats['refreshes'] += 1
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+            self._memory[name] = entry
+            return entry[0]
+
+    def invalidate(self, name):
+        """Forget a credential the provider has rejected, so the next get() refreshes it."""
+        with self._lock_for(name):
+            self._memory.pop(name, None)
+            self._connect().execute('DELETE FROM credentials WHERE name = ?', (name,))
+
+    def stats(self):
+        return dict(self._stats)
+
+def setup_credential_cache(app):
+    """Attach a CredentialCache stored at CREDENTIAL_CACHE_PATH."""
+    cache = CredentialCache(
+        app.config.get('CREDENTIAL_CACHE_PATH') or os.path.join(app.instance_path, 'credentials.db'),
+        refresh_margin=float(app.config.get('CREDENTIAL_REFRESH_MARGIN', 60))
+    )
+    app.extensions['credential_cache'] = cache
+    return cache
+
+def get_credential_cache():
+    """Return the current app's CredentialCache."""
+    return current_app.extensions['credential_cache']
@@ -0,0 +1,275 @@
+import time
+import logging
+import threading
+from collections import deque
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from models import db
+from middleware.read_replica import REPLICA_BIND
+
+logger = logging.getLogger(__name__)
+
+# Checkouts slower than this (seconds) are counted as slow
+SLOW_CHECKOUT = 0.1
+
+PROFILES = {
+    # SQLAlchemy's own defaults, for tests and local work
+    'dev': {
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': -1,
+        'pool_pre_ping': False,
+        'pool_use_lifo': False,
+        'statement_cache_size': 500,
+        'sqlite_busy_timeout': 5.0,
+        'sqlite_pragmas': {}
+    },
+    # One SQLite file shared by a few gunicorn workers: with WAL readers do
+    # not block the writer, and a writer waits for the lock instead of failing
+    'sqlite-wal': {
+        'pool_size': 8,
+        'max_overflow': 0,
+        'pool_timeout': 10,
+        'pool_recycle': -1,
+        'pool_pre_ping': False,
+        'pool_use_lifo': True,
+        'statement_cache_size': 1000,
+        'sqlite_busy_timeout': 15.0,
+        'sqlite_pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',  # Durable across app crashes; an OS crash can lose the last commits
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -16000,  # KiB
+            'temp_store': 'MEMORY'
+        }
+    },
+    # PostgreSQL behind several workers: a fixed pool per worker, reused most
+    # recently used first, connections checked before use and recycled before
+    # server or proxy idle timeouts cut them
+    'postgres-prod': {
+        'pool_size': 10,
+        'max_overflow': 5,
+        'pool_timeout': 5,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'pool_use_lifo': True,
+        'statement_cache_size': 1000,
+        'connect_timeout': 5
+    }
+}
+
+# Config keys that override a profile setting
+OVERRIDES = {
+    'DB_POOL_SIZE': ('pool_size', int),
+    'DB_MAX_OVERFLOW': ('max_overflow', int),
+    'DB_POOL_TIMEOUT': ('pool_timeout', float),
+    'DB_POOL_RECYCLE': ('pool_recycle', int),
+    'DB_STATEMENT_CACHE_SIZE': ('statement_cache_size', int),
+    'SQLITE_BUSY_TIMEOUT': ('sqlite_busy_timeout', float)
+}
+
+def is_sqlite(url):
+    return url.get_backend_name() == 'sqlite'
+
+def is_sqlite_memory(url):
+    return is_sqlite(url) and url.database in (None, '', ':memory:')
+
+def resolve_profile(name, url):
+    """The profile to use for url; 'auto' picks by database."""
+    if name and name != 'auto':
+        if name not in PROFILES:
+            raise ValueError(f"Unknown DB_ENGINE_PROFILE '{name}', expected one of {', '.join(PROFILES)}")
+        return name
+    if is_sqlite(url):
+        return 'dev' if is_sqlite_memory(url) else 'sqlite-wal'
+    if url.get_backend_name() == 'postgresql':
+        return 'postgres-prod'
+    return 'dev'
+
+def engine_options(settings, url):
+    """create_engine() arguments for a profile's settings."""
+    # Compiled SQL is cached per engine; the driver caches prepared statements too where it can
+    options = {'query_cache_size': settings['statement_cache_size']}
+
+    # In-memory SQLite lives in a single connection (Flask-SQLAlchemy uses StaticPool)
+    if not is_sqlite_memory(url):
+        options.update({
+            'poolclass': MeteredQueuePool,
+            'pool_size': settings['pool_size'],
+            'max_overflow': settings['max_overflow'],
+            'pool_timeout': settings['pool_timeout'],
+            'pool_recycle': settings['pool_recycle'],
+            'pool_pre_ping': settings['pool_pre_ping'],
+            'pool_use_lifo': settings['pool_use_lifo']
+        })
+
+    if is_sqlite(url):
+        options['connect_args'] = {
+            'timeout': settings.get('sqlite_busy_timeout', 5.0),
+            'cached_statements': settings['statement_cache_size']
+        }
+    elif url.get_backend_name() == 'postgresql' and settings.get('connect_timeout'):
+        options['connect_args'] = {'connect_timeout': settings['connect_timeout']}
+    return options
+
+class PoolMetrics:
+    """How long requests wait to get a connection from the pool (percentiles over recent checkouts)."""
+
+    def __init__(self, sample_size=1000):
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=sample_size)
+        self.counts = {'checkouts': 0, 'slow_checkouts': 0, 'timeouts': 0, 'connects': 0, 'invalidated': 0}
+        self.total_wait = 0.0
+
+    def record(self, wait):
+        with self._lock:
+            self.counts['checkouts'] += 1
+            self.total_wait += wait
+            self._waits.append(wait)
+            if wait >= SLOW_CHECKOUT:
+                self.counts['slow_checkouts'] += 1
+
+    def increment(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            data = dict(self.counts)
+            data['wait_total_ms'] = self.total_wait * 1000
+        if waits:
+            data.update({
+                'wait_p50_ms': waits[len(waits) // 2] * 1000,
+                'wait_p95_ms': waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000,
+                'wait_p99_ms': waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000,
+                'wait_max_ms': waits[-1] * 1000
+            })
+        return data
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long each checkout took, including opening a new connection."""
+
+    metrics = None
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            if self.metrics is not None:
+                self.metrics.increment('timeouts')
+            raise
+        if self.metrics is not None:
+            self.metrics.record(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() replaces the pool; keep counting into the same metrics
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+class DatabaseEngine:
+    """The engine profile in use and pool metrics for the primary and, if configured, the replica."""
+
+    def __init__(self, profile, settings, metrics):
+        self.profile = profile
+        self.settings = settings
+        self.metrics = metrics  # bind key -> PoolMetrics
+
+    def stats(self):
+        data = {'profile': self.profile}
+        for key, engine in db.engines.items():
+            pool = engine.pool
+            engine_stats = {'dialect': engine.dialect.name, 'pool': type(pool).__name__}
+            if isinstance(pool, QueuePool):
+                engine_stats.update({
+                    'pool_size': pool.size(),
+                    'checked_out': pool.checkedout(),
+                    'checked_in': pool.checkedin(),
+                    'overflow': pool.overflow()
+                })
+            engine_stats['checkout'] = self.metrics[key].snapshot()
+            data[key or 'primary'] = engine_stats
+
+        replica = current_app.extensions.get('read_replica')
+        if replica is not None:
+            data.setdefault('replica', {})['routing'] = replica.stats()
+        return data
+
+def instrument_engine(engine, settings):
+    """Meter an engine's pool and apply the profile's SQLite pragmas to its new connections."""
+    metrics = PoolMetrics()
+    if isinstance(engine.pool, MeteredQueuePool):
+        engine.pool.metrics = metrics
+
+    pragmas = settings.get('sqlite_pragmas') if is_sqlite(engine.url) else None
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        metrics.increment('connects')
+        if pragmas:
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+            cursor.close()
+
+    @event.listens_for(engine, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.increment('invalidated')
+
+    return metrics
+
+def setup_database(app):
+    """Initialise db with the DB_ENGINE_PROFILE engine settings and meter its pool.
+
+    SQLALCHEMY_ENGINE_OPTIONS set in config take precedence over the profile.
+    With DATABASE_REPLICA_URL set, a 'replica' bind is created with the same
+    profile for middleware/read_replica.py to route reads to.
+    """
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    profile = resolve_profile(app.config.get('DB_ENGINE_PROFILE', 'auto'), url)
+    settings = dict(PROFILES[profile])
+    for key, (setting, cast) in OVERRIDES.items():
+        if app.config.get(key) is not None:
+            settings[setting] = cast(app.config[key])
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(settings, url),
+        **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    }
+    if app.config.get('DATABASE_REPLICA_URL'):
+        replica_url = make_url(app.config['DATABASE_REPLICA_URL'])
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(REPLICA_BIND, {'url': replica_url, **engine_options(settings, replica_url)})
+    db.init_app(app)
+
+    with app.app_context():
+        engines = dict(db.engines)
+    metrics = {key: instrument_engine(engine, settings) for key, engine in engines.items()}
+
+    database = DatabaseEngine(profile, settings, metrics)
+    app.extensions['database'] = database
+    logger.info(f"Database engine profile '{profile}' ({engines[None].dialect.name}"
+                f"{', with a read replica' if REPLICA_BIND in engines else ''})")
+    return database
+
+def dispose_inherited_connections(app):
+    """Drop the pooled connections a forked worker inherited from its parent.
+
+    Two processes must never share a database socket. close=False leaves the
+    connections open for the parent and only gives this process fresh pools.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+def get_database():
+    """Return the current app's DatabaseEngine."""
+    return current_app.extensions['database']
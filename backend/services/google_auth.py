@@ -0,0 +1,173 @@
+import re
+import time
+import logging
+import threading
+import jwt
+from flask import current_app
+
+from services.http_client import get_http_client, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_ISSUERS = ['accounts.google.com', 'https://accounts.google.com']
+
+# Used when the JWKS response carries no max-age
+DEFAULT_JWKS_MAX_AGE = 300
+
+# Minimum seconds between refetches triggered by an unknown key id
+UNKNOWN_KID_REFETCH_INTERVAL = 10
+
+class InvalidGoogleToken(Exception):
+    """Raised for ID tokens that fail signature or claim checks."""
+
+class GoogleTokenVerifier:
+    """Verifies Google ID tokens locally against Google's signing keys.
+
+    The JWKS is cached for as long as its Cache-Control max-age allows
+    (less any Age), refetched early when a token names a key id we have not
+    seen (Google rotating keys), and kept past expiry if a refetch fails.
+    Signature, aud, iss and exp are checked here, so a sign-in needs no
+    call to Google at all while the keys are cached. Google's tokeninfo
+    endpoint is only used when keys cannot be fetched or no client ID is
+    configured to check aud against.
+    """
+
+    def __init__(self, client_ids, jwks_url, tokeninfo_url, leeway=30):
+        self.client_ids = client_ids
+        self.jwks_url = jwks_url
+        self.tokeninfo_url = tokeninfo_url
+        self.leeway = leeway
+
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._stats = {'local': 0, 'tokeninfo': 0, 'jwks_fetches': 0, 'rejected': 0}
+
+    def verify(self, token):
+        """Return the claims of a valid Google ID token or raise InvalidGoogleToken."""
+        if not token:
+            raise InvalidGoogleToken('Missing token')
+        if not self.client_ids:
+            return self._verify_with_tokeninfo(token)
+
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            self._stats['rejected'] += 1
+            raise InvalidGoogleToken(f'Malformed token: {str(e)}')
+
+        import requests
+
+        try:
+            key = self._get_key(header.get('kid'))
+        except (requests.exceptions.RequestException, CircuitOpenError, jwt.PyJWKError, ValueError) as e:
+            logger.warning(f"Google JWKS unavailable, falling back to tokeninfo: {str(e)}")
+            return self._verify_with_tokeninfo(token)
+        if key is None:
+            self._stats['rejected'] += 1
+            raise InvalidGoogleToken('Unknown signing key')
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=['RS256'],
+                audience=self.client_ids,
+                issuer=GOOGLE_ISSUERS,
+                leeway=self.leeway,
+                options={'require': ['exp', 'iat', 'iss', 'aud', 'sub']}
+            )
+        except jwt.PyJWTError as e:
+            self._stats['rejected'] += 1
+            raise InvalidGoogleToken(str(e))
+
+        self._stats['local'] += 1
+        return claims
+
+    def _get_key(self, kid):
+        """Signing key for kid from the cached JWKS, refetching when stale or kid is new."""
+        now = time.monotonic()
+        key = self._keys.get(kid)
+        if key is not None and now < self._expires_at:
+            return key
+
+        with self._lock:
+            key = self._keys.get(kid)
+            now = time.monotonic()
+            stale = now >= self._expires_at
+            unknown = key is None and now - self._fetched_at >= UNKNOWN_KID_REFETCH_INTERVAL
+            if stale or unknown:
+                try:
+                    self._fetch_keys()
+                except Exception:
+                    # Keys rotate with overlap, so stale keys beat no keys
+                    if not self._keys:
+                        raise
+                    logger.warning("Google JWKS refresh failed, using cached keys")
+            return self._keys.get(kid)
+
+    def _fetch_keys(self):
+        response = get_http_client('google').get(self.jwks_url)
+        response.raise_for_status()
+        keys = {}
+        for data in response.json().get('keys', []):
+            if data.get('kid'):
+                keys[data['kid']] = jwt.PyJWK(data, algorithm='RS256').key
+        if not keys:
+            raise ValueError('Google JWKS has no keys')
+
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        self._expires_at = self._fetched_at + self._max_age(response.headers)
+        self._stats['jwks_fetches'] += 1
+
+    @staticmethod
+    def _max_age(headers):
+        """Seconds the JWKS may be cached according to Cache-Control and Age."""
+        cache_control = headers.get('Cache-Control', '')
+        if 'no-store' in cache_control or 'no-cache' in cache_control:
+            return 0
+        match = re.search(r'max-age=(\d+)', cache_control)
+        max_age = int(match.group(1)) if match else DEFAULT_JWKS_MAX_AGE
+        try:
+            max_age -= int(headers.get('Age', 0))
+        except ValueError:
+            pass
+        return max(0, max_age)
+
+    def _verify_with_tokeninfo(self, token):
+        """Ask Google to validate the token (one round trip per sign-in)."""
+        response = get_http_client('google').get(self.tokeninfo_url, params={'id_token': token})
+        data = response.json()
+        if response.status_code != 200 or 'error' in data or 'error_description' in data:
+            self._stats['rejected'] += 1
+            raise InvalidGoogleToken('Invalid Google token')
+        if self.client_ids and data.get('aud') not in self.client_ids:
+            self._stats['rejected'] += 1
+            raise InvalidGoogleToken('Token was issued for another client')
+
+        self._stats['tokeninfo'] += 1
+        return data
+
+    def stats(self):
+        return {**self._stats, 'cached_keys': len(self._keys),
+                'keys_expire_in': max(0.0, self._expires_at - time.monotonic()) if self._keys else None}
+
+def setup_google_auth(app):
+    """Attach a GoogleTokenVerifier configured from GOOGLE_* settings.
+
+    GOOGLE_CLIENT_ID may list several comma-separated client IDs (web, iOS, Android).
+    """
+    client_ids = [cid.strip() for cid in (app.config.get('GOOGLE_CLIENT_ID') or '').split(',') if cid.strip()]
+    verifier = GoogleTokenVerifier(
+        client_ids,
+        jwks_url=app.config.get('GOOGLE_JWKS_URL', 'https://www.googleapis.com/oauth2/v3/certs'),
+        tokeninfo_url=app.config.get('GOOGLE_TOKENINFO_URL', 'https://www.googleapis.com/oauth2/v3/tokeninfo')
+    )
+    app.extensions['google_token_verifier'] = verifier
+    return verifier
+
+def get_google_token_verifier():
+    """Return the current app's GoogleTokenVerifier."""
+    return current_app.extensions['google_token_verifier']
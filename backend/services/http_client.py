@@ -0,0 +1,283 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from flask import current_app
+
+# requests is imported when a provider is first called, not at startup
+
+logger = logging.getLogger(__name__)
+
+# Methods that are safe to send twice
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# Responses that mean "try again" rather than "your request was wrong"
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+def request_not_sent(error):
+    """Whether a requests exception happened before any bytes reached the server."""
+    import requests
+    from urllib3.exceptions import MaxRetryError, NewConnectionError, ConnectTimeoutError
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = error.args[0]
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+    return False
+
+class CircuitBreaker:
+    """Stops calling a provider after failure_threshold consecutive failures.
+
+    After reset_timeout seconds one trial request is let through
+    (half-open); its outcome closes the circuit or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+class RetryBudget:
+    """Caps retries at ratio of recent requests (plus a small floor) so retries cannot snowball."""
+
+    def __init__(self, ratio=0.2, min_retries=3, window=10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._retries = deque()
+
+    def _trim(self, now):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self):
+        with self._lock:
+            self._requests.append(time.monotonic())
+
+    def try_spend(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._retries) >= max(self.min_retries, self.ratio * len(self._requests)):
+                return False
+            self._retries.append(now)
+            return True
+
+class ProviderMetrics:
+    """Request counts and latency for one provider (latency percentiles over recent calls)."""
+
+    def __init__(self, sample_size=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=sample_size)
+        self.counts = {'requests': 0, 'errors': 0, 'retries': 0, 'retries_denied': 0, 'circuit_rejections': 0}
+        self.last_error = None
+
+    def record(self, latency, error=None):
+        with self._lock:
+            self.counts['requests'] += 1
+            self._latencies.append(latency)
+            if error:
+                self.counts['errors'] += 1
+                self.last_error = error
+
+    def increment(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            data = dict(self.counts)
+            data['last_error'] = self.last_error
+        if latencies:
+            data.update({
+                'latency_p50_ms': latencies[len(latencies) // 2] * 1000,
+                'latency_p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+                'latency_max_ms': latencies[-1] * 1000
+            })
+        return data
+
+class HTTPClient:
+    """Outbound HTTP for one provider: pooled keep-alive connections, timeouts,
+    budgeted retries with jittered backoff, a circuit breaker and metrics."""
+
+    def __init__(self, provider, connect_timeout=3.05, read_timeout=10.0, retries=2, backoff=0.2,
+                 pool_maxsize=10, failure_threshold=5, reset_timeout=30.0):
+        self.provider = provider
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.budget = RetryBudget()
+        self.metrics = ProviderMetrics()
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Retries are done here, not by urllib3, so they count against the budget and metrics
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        """Send a request, retrying transport errors and 502/503/504 within the retry budget.
+
+        Non-idempotent methods are only retried when the request never
+        reached the server. Raises CircuitOpenError while the provider's
+        circuit is open; otherwise returns the last response or raises the
+        last requests exception.
+        """
+        import requests
+
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method in IDEMPOTENT_METHODS
+        self.budget.record_request()
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.metrics.increment('circuit_rejections')
+                raise CircuitOpenError(f'{self.provider} is unavailable (circuit open)')
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.metrics.record(time.perf_counter() - started, error=f'{type(e).__name__}: {e}')
+                self.breaker.record_failure()
+                if attempt < self.retries and (idempotent or request_not_sent(e)) and self._spend_retry():
+                    attempt += 1
+                    self._sleep(attempt)
+                    continue
+                raise
+
+            failed = response.status_code >= 500
+            self.metrics.record(time.perf_counter() - started, error=f'HTTP {response.status_code}' if failed else None)
+            if not failed:
+                self.breaker.record_success()
+                return response
+
+            self.breaker.record_failure()
+            if response.status_code in RETRY_STATUSES and idempotent and attempt < self.retries and self._spend_retry():
+                response.close()
+                attempt += 1
+                self._sleep(attempt)
+                continue
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _spend_retry(self):
+        if self.budget.try_spend():
+            self.metrics.increment('retries')
+            return True
+        self.metrics.increment('retries_denied')
+        return False
+
+    def _sleep(self, attempt):
+        time.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+    def stats(self):
+        return {'circuit': self.breaker.state, **self.metrics.snapshot()}
+
+class HTTPClientRegistry:
+    """One HTTPClient per provider, created on first use in each process."""
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._pid = None
+        self._clients = {}
+
+    def get(self, provider):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._clients = {}
+                    self._pid = os.getpid()
+
+        client = self._clients.get(provider)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(provider)
+                if client is None:
+                    client = self._clients[provider] = HTTPClient(provider, **self._settings(provider))
+        return client
+
+    def _settings(self, provider):
+        """HTTP_* settings, overridable per provider as HTTP_<PROVIDER>_*."""
+        def setting(name, default, cast):
+            value = self.config.get(f'HTTP_{provider.upper()}_{name}', self.config.get(f'HTTP_{name}', default))
+            return cast(value)
+
+        return {
+            'connect_timeout': setting('CONNECT_TIMEOUT', 3.05, float),
+            'read_timeout': setting('READ_TIMEOUT', 10.0, float),
+            'retries': setting('RETRIES', 2, int),
+            'pool_maxsize': setting('POOL_MAXSIZE', 10, int),
+            'failure_threshold': setting('BREAKER_THRESHOLD', 5, int),
+            'reset_timeout': setting('BREAKER_RESET', 30.0, float)
+        }
+
+    def stats(self):
+        return {provider: client.stats() for provider, client in list(self._clients.items())}
+
+def setup_http_clients(app):
+    """Attach the outbound HTTP client registry to the app."""
+    registry = HTTPClientRegistry(app.config)
+    app.extensions['http_clients'] = registry
+    return registry
+
+def get_http_client(provider):
+    """Return the pooled client for provider ('google', 'facebook', 'mpesa', ...)."""
+    return current_app.extensions['http_clients'].get(provider)
@@ -0,0 +1,129 @@
+from datetime import datetime
+from sqlalchemy import update, bindparam, func
+
+from models import db, Campaign
+from serializers import json_loads
+from services.metrics_service import MetricsService
+from services.summary_service import SummaryService
+
+# Largest number of events accepted in one request
+MAX_BATCH_SIZE = 10000
+
+# Event types and the counter each one increments
+EVENT_TYPES = {
+    'impression': 'impressions',
+    'click': 'clicks'
+}
+
+class IngestionService:
+    @staticmethod
+    def parse_batch(body, content_type):
+        """Split a request body into a list of raw events.
+
+        NDJSON bodies (application/x-ndjson) hold one event per line. JSON
+        bodies hold an array of events or an object with an "events" array.
+        Lines that fail to parse are returned as None so they can be
+        reported as rejected without failing the whole batch.
+        """
+        if content_type and 'ndjson' in content_type:
+            events = []
+            for line in body.splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    events.append(json_loads(line))
+                except ValueError:
+                    events.append(None)
+            return events
+
+        payload = json_loads(body)
+        if isinstance(payload, dict):
+            payload = payload.get('events')
+        if not isinstance(payload, list):
+            raise ValueError('Expected a JSON array of events or an object with an "events" array')
+        return payload
+
+    @staticmethod
+    def coalesce(events, allowed_campaign_ids):
+        """Validate events and sum them per campaign and per campaign-hour.
+
+        Returns (totals, buckets, errors). totals maps campaign_id to its
+        counter deltas, buckets maps (campaign_id, hour) to metric deltas,
+        and errors lists {'index', 'error'} for every rejected event.
+        """
+        totals = {}
+        buckets = {}
+        errors = []
+        now = datetime.utcnow()
+
+        for index, event in enumerate(events):
+            try:
+                if not isinstance(event, dict):
+                    raise ValueError('Malformed event')
+
+                campaign_id = event.get('campaign_id')
+                if campaign_id not in allowed_campaign_ids:
+                    raise ValueError('Unknown campaign')
+
+                counter = EVENT_TYPES.get(event.get('type'))
+                if counter is None:
+                    raise ValueError(f"Invalid event type: {event.get('type')}")
+
+                count = event.get('count', 1)
+                cost = event.get('cost', 0.0)
+                if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+                    raise ValueError('count must be a positive integer')
+                if not isinstance(cost, (int, float)) or isinstance(cost, bool) or cost < 0:
+                    raise ValueError('cost must be a non-negative number')
+
+                timestamp = now
+                if event.get('timestamp'):
+                    timestamp = datetime.fromisoformat(event['timestamp'].replace('Z', '+00:00')).replace(tzinfo=None)
+            except (ValueError, TypeError, AttributeError) as e:
+                errors.append({'index': index, 'error': str(e)})
+                continue
+
+            delta = totals.get(campaign_id)
+            if delta is None:
+                delta = totals[campaign_id] = {'impressions': 0, 'clicks': 0, 'spend': 0.0}
+            delta[counter] += count
+            delta['spend'] += cost
+
+            key = (campaign_id, MetricsService.bucket_for(timestamp))
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = {'impressions': 0, 'clicks': 0, 'spend': 0.0}
+            bucket[counter] += count
+            bucket['spend'] += cost
+
+        return totals, buckets, errors
+
+    @staticmethod
+    def flush(totals, buckets):
+        """Write coalesced deltas: one UPDATE per campaign plus one metrics upsert per bucket.
+
+        Counters are incremented in place (SET impressions = impressions + ?),
+        so campaign rows are never read and concurrent flushes cannot lose
+        updates. The owners' dashboard summaries are adjusted the same way.
+        Statements run as executemany; the caller commits.
+        """
+        if totals:
+            table = Campaign.__table__
+            stmt = update(table).where(table.c.id == bindparam('b_id')).values(
+                impressions=func.coalesce(table.c.impressions, 0) + bindparam('b_impressions'),
+                clicks=func.coalesce(table.c.clicks, 0) + bindparam('b_clicks'),
+                spend=func.coalesce(table.c.spend, 0.0) + bindparam('b_spend')
+            )
+            db.session.execute(stmt, [{
+                'b_id': campaign_id,
+                'b_impressions': delta['impressions'],
+                'b_clicks': delta['clicks'],
+                'b_spend': delta['spend']
+            } for campaign_id, delta in totals.items()])
+            SummaryService.add_counter_deltas(totals)
+
+        MetricsService.record_metrics([{
+            'campaign_id': campaign_id,
+            'bucket_start': bucket_start,
+            **delta
+        } for (campaign_id, bucket_start), delta in buckets.items()])
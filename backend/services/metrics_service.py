@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import (db, Campaign, CampaignMetric, CampaignMetricDaily, CampaignMetricMonthly,
+                    UserPlatformMetricDaily, UserPlatformMetricMonthly, RollupState)
+
+GRANULARITIES = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'month': timedelta(days=28)
+}
+
+# Output granularities each storage unit can be summed into
+ROLLUP_SERVES = {
+    'hour': ('hour', 'day', 'week', 'month'),
+    'day': ('day', 'week', 'month'),
+    'month': ('month',)
+}
+
+# Upper bound on buckets returned by a single query
+MAX_BUCKETS = 5000
+
+def dialect_insert():
+    """Return the INSERT construct for the bound dialect, which supports ON CONFLICT."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert
+    if dialect == 'sqlite':
+        return sqlite.insert
+    raise ValueError(f'Unsupported database dialect for metrics: {dialect}')
+
+def truncate(timestamp, unit):
+    """Truncate a timestamp to the start of its hour, day or month."""
+    if unit == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if unit == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def ceil_to(timestamp, unit):
+    """The first start of an hour, day or month at or after timestamp."""
+    floor = truncate(timestamp, unit)
+    if floor == timestamp:
+        return floor
+    if unit == 'hour':
+        return floor + timedelta(hours=1)
+    if unit == 'day':
+        return floor + timedelta(days=1)
+    return (floor + timedelta(days=32)).replace(day=1)
+
+def to_datetime(value):
+    """Normalize a bucket value; SQLite returns strftime() strings where Postgres returns datetimes."""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+class MetricsService:
+    @staticmethod
+    def bucket_for(timestamp):
+        """Truncate a timestamp to the start of its hourly bucket."""
+        return truncate(timestamp, 'hour')
+
+    @staticmethod
+    def record_metrics(rows):
+        """Add counts to hourly campaign buckets.
+
+        rows is a list of dicts with campaign_id, bucket_start, impressions,
+        clicks and spend. Each row becomes an INSERT ... ON CONFLICT DO UPDATE
+        that adds to the existing bucket, so writers never read before they
+        write and the whole batch goes to the database in one executemany.
+        The caller is responsible for committing.
+        """
+        if not rows:
+            return
+
+        now = datetime.utcnow()
+        table = CampaignMetric.__table__
+        stmt = dialect_insert()(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.campaign_id, table.c.bucket_start],
+            set_={
+                'impressions': table.c.impressions + stmt.excluded.impressions,
+                'clicks': table.c.clicks + stmt.excluded.clicks,
+                'spend': table.c.spend + stmt.excluded.spend,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt, [{**row, 'updated_at': now} for row in rows])
+
+    @staticmethod
+    def bucket_expression(column, granularity):
+        """SQL expression truncating column to the start of its hour, day, week (Monday) or month."""
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            return func.date_trunc(granularity, column)
+        if granularity == 'hour':
+            return func.strftime('%Y-%m-%d %H:00:00', column)
+        if granularity == 'day':
+            return func.strftime('%Y-%m-%d 00:00:00', column)
+        if granularity == 'month':
+            return func.strftime('%Y-%m-01 00:00:00', column)
+        # SQLite: step forward to the next Sunday, then back six days to Monday
+        return func.strftime('%Y-%m-%d 00:00:00', column, 'weekday 0', '-6 days')
+
+    @staticmethod
+    def get_campaign_metrics(campaign_id, start, end, granularity):
+        """Aggregate a campaign's metrics in [start, end) to the requested granularity."""
+        return MetricsService._query_metrics([
+            ('month', CampaignMetricMonthly, [CampaignMetricMonthly.campaign_id == campaign_id]),
+            ('day', CampaignMetricDaily, [CampaignMetricDaily.campaign_id == campaign_id]),
+            ('hour', CampaignMetric, [CampaignMetric.campaign_id == campaign_id])
+        ], start, end, granularity)
+
+    @staticmethod
+    def get_user_metrics(user_id, start, end, granularity, platform=None):
+        """Aggregate metrics across a user's campaigns, optionally for one platform."""
+        sources = []
+        for unit, model in (('month', UserPlatformMetricMonthly), ('day', UserPlatformMetricDaily)):
+            filters = [model.user_id == user_id]
+            if platform:
+                filters.append(model.platform == platform)
+            sources.append((unit, model, filters))
+
+        hourly_filters = [CampaignMetric.campaign_id == Campaign.id, Campaign.user_id == user_id]
+        if platform:
+            hourly_filters.append(Campaign.platform == platform)
+        sources.append(('hour', CampaignMetric, hourly_filters))
+
+        return MetricsService._query_metrics(sources, start, end, granularity)
+
+    @staticmethod
+    def _plan(sources, start, end, granularity, refreshed_at):
+        """Split [start, end) into (model, filters, start, stop) pieces, each read from the coarsest source that can.
+
+        A rollup takes the whole units inside the range that were complete at
+        the last rollup refresh; the unaligned head and the tail go to the
+        next finer source, down to the hourly table, which takes the rest.
+        """
+        if start >= end:
+            return []
+        (unit, model, filters), finer = sources[0], sources[1:]
+        if unit == 'hour':
+            return [(model, filters, start, end)]
+        if refreshed_at is None or granularity not in ROLLUP_SERVES[unit]:
+            return MetricsService._plan(finer, start, end, granularity, refreshed_at)
+
+        first = ceil_to(start, unit)
+        stop = min(truncate(end, unit), truncate(refreshed_at, unit))
+        if stop <= first:
+            return MetricsService._plan(finer, start, end, granularity, refreshed_at)
+        return (MetricsService._plan(finer, start, first, granularity, refreshed_at)
+                + [(model, filters, first, stop)]
+                + MetricsService._plan(finer, stop, end, granularity, refreshed_at))
+
+    @staticmethod
+    def _query_metrics(sources, start, end, granularity):
+        """Sum metrics over [start, end) from the coarsest storage that can answer.
+
+        sources lists (unit, model, filters) from coarsest to finest, ending
+        with the hourly table; see _plan for how the range is split between
+        them. Each piece is grouped and summed in SQL, so only one row per
+        output bucket per piece comes back.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Invalid granularity: {granularity}. Use one of: {', '.join(GRANULARITIES)}")
+        if start >= end:
+            raise ValueError("'from' must be before 'to'")
+        if (end - start) / GRANULARITIES[granularity] > MAX_BUCKETS:
+            raise ValueError(f'Range too large for {granularity} granularity')
+
+        state = db.session.get(RollupState, 'campaign_metrics')
+        refreshed_at = state.refreshed_at if state else None
+
+        totals = {}
+        for model, filters, piece_start, piece_stop in MetricsService._plan(sources, start, end, granularity, refreshed_at):
+            bucket = MetricsService.bucket_expression(model.bucket_start, granularity).label('bucket')
+            rows = db.session.query(
+                bucket,
+                func.sum(model.impressions).label('impressions'),
+                func.sum(model.clicks).label('clicks'),
+                func.sum(model.spend).label('spend')
+            ).filter(
+                *filters,
+                model.bucket_start >= piece_start,
+                model.bucket_start < piece_stop
+            ).group_by(literal_column('bucket')).all()
+
+            # An output bucket can straddle two pieces (e.g. a week split at the rollup cutoff)
+            for row in rows:
+                key = to_datetime(row.bucket)
+                total = totals.setdefault(key, {'bucket': key, 'impressions': 0, 'clicks': 0, 'spend': 0.0})
+                total['impressions'] += int(row.impressions or 0)
+                total['clicks'] += int(row.clicks or 0)
+                total['spend'] += float(row.spend or 0.0)
+
+        return [totals[key] for key in sorted(totals)]
@@ -0,0 +1,143 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app, has_app_context
+from passlib.hash import pbkdf2_sha256
+
+logger = logging.getLogger(__name__)
+
+# Pool processes are started from a clean server process (or spawned), never
+# forked from a threaded server worker holding locks and database connections
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool has no room for another request."""
+
+def _hash(password, rounds):
+    return pbkdf2_sha256.using(rounds=rounds).hash(password)
+
+def _verify(password, password_hash):
+    return pbkdf2_sha256.verify(password, password_hash)
+
+class PasswordHasher:
+    """pbkdf2 hashing and verification on a bounded pool of worker processes.
+
+    Hashing is CPU-bound by design, so running it in the request thread
+    stalls every other request the worker could be serving. Jobs go to
+    worker processes instead; at most workers + queue_depth jobs are
+    accepted at once, and anything beyond that fails fast with
+    PasswordHasherBusy (a 503) rather than queueing behind a login storm.
+    With workers=0 hashing runs inline, which is what scripts use. A pool
+    broken by a dead process (say, OOM-killed) is replaced and the job
+    retried once.
+    """
+
+    def __init__(self, rounds=None, workers=0, queue_depth=0, timeout=10.0):
+        self.rounds = rounds or pbkdf2_sha256.default_rounds
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._handler = pbkdf2_sha256.using(rounds=self.rounds)
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + queue_depth) if workers else None
+        self._pid = None
+        self._executor = None
+        self._rejected = 0
+        self._restarts = 0
+
+    def _get_executor(self):
+        """Create the pool lazily in each process, so workers forked by gunicorn get their own."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = self._new_executor()
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(START_METHOD))
+
+    def _replace_executor(self, broken):
+        """Swap a broken pool for a new one, once however many threads saw it break."""
+        with self._lock:
+            if self._executor is broken:
+                logger.warning("Password hashing pool broke (a worker process died), starting a new one")
+                broken.shutdown(wait=False)
+                self._executor = self._new_executor()
+                self._restarts += 1
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        executor = self._get_executor()
+        try:
+            return self._submit(executor, fn, *args)
+        except BrokenProcessPool:
+            return self._submit(self._replace_executor(executor), fn, *args)
+
+    def _submit(self, executor, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._rejected += 1
+            raise PasswordHasherBusy('Password hashing is saturated, try again shortly')
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordHasherBusy('Password hashing timed out')
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self._run(_verify, password, password_hash)
+
+    def needs_update(self, password_hash):
+        """Whether a stored hash uses fewer rounds than currently configured."""
+        return self._handler.needs_update(password_hash)
+
+    def stats(self):
+        return {
+            'rounds': self.rounds,
+            'workers': self.workers,
+            'queue_depth': self.queue_depth,
+            'rejected': self._rejected,
+            'restarts': self._restarts
+        }
+
+# Used outside an app context (seed data, scripts)
+_inline_hasher = PasswordHasher()
+
+def setup_password_hasher(app):
+    """Attach a PasswordHasher configured from PASSWORD_HASH_* settings."""
+    workers = app.config.get('PASSWORD_HASH_WORKERS')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = int(workers)
+
+    hasher = PasswordHasher(
+        rounds=app.config.get('PASSWORD_HASH_ROUNDS'),
+        workers=workers,
+        queue_depth=int(app.config.get('PASSWORD_HASH_QUEUE_DEPTH', workers * 4)),
+        timeout=float(app.config.get('PASSWORD_HASH_TIMEOUT', 10.0))
+    )
+    app.extensions['password_hasher'] = hasher
+    return hasher
+
+def get_password_hasher():
+    """Return the current app's PasswordHasher, or an inline one outside an app."""
+    if has_app_context():
+        return current_app.extensions.get('password_hasher', _inline_hasher)
+    return _inline_hasher
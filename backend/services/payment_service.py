@@ -1,28 +1,67 @@
 
 import os
-import stripe
-import paypalrestsdk
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
-import requests
 import base64
+import hashlib
 import logging
+from functools import lru_cache
+from sqlalchemy.exc import IntegrityError
 
-from models import Payment, User, Subscription
+from models import db, Payment, User, Subscription
+from services.http_client import get_http_client
+from services.credential_cache import get_credential_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Stripe
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+# The provider SDKs are imported on first use: stripe alone takes ~0.5s to
+# import, which every process would otherwise pay at startup. Both send their
+# HTTP calls through the pooled client for their provider, so they get the
+# same timeouts, retry budget, circuit breaker and metrics as MPESA
 
-# Initialize PayPal
-paypalrestsdk.configure({
-    "mode": os.getenv('PAYPAL_MODE', 'sandbox'),
-    "client_id": os.getenv('PAYPAL_CLIENT_ID'),
-    "client_secret": os.getenv('PAYPAL_CLIENT_SECRET')
-})
+@lru_cache(maxsize=None)
+def stripe_sdk():
+    """The stripe module, configured with STRIPE_SECRET_KEY."""
+    import stripe
+    from stripe.http_client import RequestsClient
+
+    class PooledStripeClient(RequestsClient):
+        def request(self, method, url, headers, post_data=None):
+            try:
+                response = get_http_client('stripe').request(method, url, headers=headers, data=post_data)
+            except Exception as e:
+                self._handle_request_error(e)  # Raised as stripe.error.APIConnectionError
+            return response.content, response.status_code, response.headers
+
+    stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+    if os.getenv('STRIPE_API_BASE'):
+        stripe.api_base = os.getenv('STRIPE_API_BASE')
+    stripe.default_http_client = PooledStripeClient()
+    stripe.max_network_retries = 0  # The pooled client retries, within its budget
+    return stripe
+
+@lru_cache(maxsize=None)
+def paypal_sdk():
+    """The paypalrestsdk module, configured from PAYPAL_* settings."""
+    import paypalrestsdk
+
+    class PooledPayPalApi(paypalrestsdk.Api):
+        def http_call(self, url, method, **kwargs):
+            response = get_http_client('paypal').request(method, url, proxies=self.proxies, **kwargs)
+            return self.handle_response(response, response.content.decode('utf-8'))
+
+    options = {
+        "mode": os.getenv('PAYPAL_MODE', 'sandbox'),
+        "client_id": os.getenv('PAYPAL_CLIENT_ID'),
+        "client_secret": os.getenv('PAYPAL_CLIENT_SECRET')
+    }
+    if os.getenv('PAYPAL_API_BASE'):
+        options["endpoint"] = os.getenv('PAYPAL_API_BASE')
+    # What paypalrestsdk.configure() sets, as the pooled subclass
+    paypalrestsdk.api.__api__ = PooledPayPalApi(options)
+    return paypalrestsdk
 
 class PaymentService:
     @staticmethod
@@ -34,7 +73,7 @@ class PaymentService:
     def create_stripe_payment_intent(amount, currency='usd', metadata=None):
         """Create a payment intent with Stripe"""
         try:
-            intent = stripe.PaymentIntent.create(
+            intent = stripe_sdk().PaymentIntent.create(
                 amount=int(amount * 100),  # Convert to cents
                 currency=currency,
                 metadata=metadata or {}
@@ -51,7 +90,7 @@ class PaymentService:
     def confirm_stripe_payment(payment_intent_id):
         """Confirm that a Stripe payment was successful"""
         try:
-            intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+            intent = stripe_sdk().PaymentIntent.retrieve(payment_intent_id)
             return intent.status == 'succeeded'
         except Exception as e:
             logger.error(f"Stripe payment confirmation failed: {str(e)}")
@@ -61,7 +100,7 @@ class PaymentService:
     def create_paypal_payment(amount, currency='USD', description='Subscription Payment'):
         """Create a PayPal payment"""
         try:
-            payment = paypalrestsdk.Payment({
+            payment = paypal_sdk().Payment({
                 "intent": "sale",
                 "payer": {
                     "payment_method": "paypal"
@@ -96,7 +135,7 @@ class PaymentService:
     def execute_paypal_payment(payment_id, payer_id):
         """Execute a PayPal payment after user approval"""
         try:
-            payment = paypalrestsdk.Payment.find(payment_id)
+            payment = paypal_sdk().Payment.find(payment_id)
             if payment.execute({"payer_id": payer_id}):
                 return True
             else:
@@ -107,30 +146,49 @@ class PaymentService:
             return False
 
     @staticmethod
-    def initiate_mpesa_payment(phone_number, amount, account_reference, transaction_desc='Subscription Payment'):
-        """Initiate an MPESA payment"""
-        try:
-            # MPESA settings
-            mpesa_env = os.getenv('MPESA_API_ENV', 'sandbox')
-            base_url = "https://sandbox.safaricom.co.ke" if mpesa_env == 'sandbox' else "https://api.safaricom.co.ke"
-            
-            # Get access token
-            consumer_key = os.getenv('MPESA_CONSUMER_KEY')
-            consumer_secret = os.getenv('MPESA_CONSUMER_SECRET')
-            auth_url = f"{base_url}/oauth/v1/generate?grant_type=client_credentials"
-            
-            auth_response = requests.get(
-                auth_url,
+    def get_mpesa_base_url():
+        """MPESA API root for the configured environment"""
+        mpesa_env = os.getenv('MPESA_API_ENV', 'sandbox')
+        return os.getenv('MPESA_BASE_URL') or ("https://sandbox.safaricom.co.ke" if mpesa_env == 'sandbox' else "https://api.safaricom.co.ke")
+
+    @staticmethod
+    def get_mpesa_access_token(base_url):
+        """Get an MPESA OAuth token, reusing the cached one until shortly before it expires"""
+        consumer_key = os.getenv('MPESA_CONSUMER_KEY')
+        consumer_secret = os.getenv('MPESA_CONSUMER_SECRET')
+
+        def fetch():
+            auth_response = get_http_client('mpesa').get(
+                f"{base_url}/oauth/v1/generate?grant_type=client_credentials",
                 headers={
                     "Authorization": "Basic " + base64.b64encode((consumer_key + ":" + consumer_secret).encode()).decode()
                 }
             )
-            
+
             if auth_response.status_code != 200:
                 logger.error(f"MPESA auth failed: {auth_response.text}")
                 raise ValueError("MPESA authentication failed")
-                
-            access_token = auth_response.json().get('access_token')
+
+            data = auth_response.json()
+            return data.get('access_token'), int(data.get('expires_in', 3599))
+
+        return get_credential_cache().get(PaymentService.mpesa_token_name(base_url), fetch)
+
+    @staticmethod
+    def mpesa_token_name(base_url):
+        """Credential cache key: one token per environment and consumer key"""
+        key_id = hashlib.sha256(f"{base_url}:{os.getenv('MPESA_CONSUMER_KEY')}".encode()).hexdigest()[:16]
+        return f"mpesa:{key_id}"
+
+    @staticmethod
+    def initiate_mpesa_payment(phone_number, amount, account_reference, transaction_desc='Subscription Payment'):
+        """Initiate an MPESA payment"""
+        try:
+            # MPESA settings
+            base_url = PaymentService.get_mpesa_base_url()
+            
+            # Get access token
+            access_token = PaymentService.get_mpesa_access_token(base_url)
             
             # Format phone number (remove leading 0 or +)
             if phone_number.startswith('+'):
@@ -148,10 +206,6 @@ class PaymentService:
             
             # STK Push request
             stk_url = f"{base_url}/mpesa/stkpush/v1/processrequest"
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
             
             payload = {
                 "BusinessShortCode": shortcode,
@@ -167,7 +221,13 @@ class PaymentService:
                 "TransactionDesc": transaction_desc
             }
             
-            response = requests.post(stk_url, json=payload, headers=headers)
+            response = get_http_client('mpesa').post(stk_url, json=payload, headers={"Authorization": f"Bearer {access_token}"})
+            
+            # A cached token revoked before its expiry: refresh it and try once more
+            if response.status_code == 401:
+                get_credential_cache().invalidate(PaymentService.mpesa_token_name(base_url))
+                access_token = PaymentService.get_mpesa_access_token(base_url)
+                response = get_http_client('mpesa').post(stk_url, json=payload, headers={"Authorization": f"Bearer {access_token}"})
             
             if response.status_code != 200:
                 logger.error(f"MPESA STK push failed: {response.text}")
@@ -188,3 +248,59 @@ class PaymentService:
         except Exception as e:
             logger.error(f"MPESA callback verification failed: {str(e)}")
             return False
+
+    @staticmethod
+    def create_pending_payment(user_id, subscription, external_payment_id):
+        """Record a checkout awaiting the provider's confirmation; the caller commits"""
+        payment = Payment(
+            user_id=user_id,
+            subscription_id=subscription.id,
+            amount=subscription.price,
+            status='pending',
+            external_payment_id=external_payment_id
+        )
+        db.session.add(payment)
+        return payment
+
+    @staticmethod
+    def complete_payment(external_payment_id, user_id=None, subscription_id=None):
+        """Mark a payment completed and activate the subscription it paid for.
+
+        Idempotent per external_payment_id: webhook redeliveries and the
+        confirm-payment route racing a webhook only activate the subscription
+        once. A payment with no pending row is created from user_id and
+        subscription_id (Stripe carries them as metadata); without them it is
+        not ours and None is returned. The caller commits.
+        """
+        payment = Payment.query.filter_by(external_payment_id=external_payment_id).with_for_update().first()
+        if payment is None:
+            if not user_id or not subscription_id:
+                return None
+            subscription = db.session.get(Subscription, int(subscription_id))
+            if subscription is None:
+                raise ValueError(f"Subscription plan {subscription_id} not found")
+            try:
+                with db.session.begin_nested():
+                    payment = PaymentService.create_pending_payment(int(user_id), subscription, external_payment_id)
+            except IntegrityError:
+                # Inserted concurrently by another delivery or confirm-payment; settle that row
+                payment = Payment.query.filter_by(external_payment_id=external_payment_id).with_for_update().one()
+
+        if payment.status == 'completed':
+            return payment
+
+        user = payment.user
+        subscription = payment.subscription
+        user.subscription_id = subscription.id
+        user.subscription_status = 'active'
+        user.subscription_end_date = datetime.utcnow() + timedelta(days=subscription.duration_days)
+        payment.status = 'completed'
+        return payment
+
+    @staticmethod
+    def fail_payment(external_payment_id):
+        """Mark a pending payment failed; completed payments are left alone. The caller commits"""
+        payment = Payment.query.filter_by(external_payment_id=external_payment_id).with_for_update().first()
+        if payment is not None and payment.status == 'pending':
+            payment.status = 'failed'
+        return payment
@@ -0,0 +1,86 @@
+import time
+import hashlib
+import threading
+from collections import namedtuple
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import Subscription
+from middleware.read_replica import use_primary
+from serializers import json_dumps_bytes
+
+CatalogEntry = namedtuple('CatalogEntry', ['body', 'etag', 'loaded_at'])
+
+class PlanCatalog:
+    """The active subscription plans, encoded once and shared by every request.
+
+    Plans almost never change, so GET /subscriptions/ serves these bytes
+    and their strong ETag straight from memory. Writes to plans through the
+    ORM drop the cached copy when they commit (see the listeners below);
+    changes made by other processes or bulk UPDATEs are picked up within
+    ttl seconds.
+    """
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entry = None
+        self._generation = 0
+
+    def get(self):
+        entry = self._entry
+        if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+            return entry
+
+        with self._lock:
+            entry = self._entry
+            if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+                return entry
+
+            generation = self._generation
+            # A lagging replica could hand back plans from before the write that invalidated us
+            with use_primary():
+                plans = Subscription.query.filter_by(is_active=True).order_by(Subscription.id).all()
+            body = json_dumps_bytes([plan.to_dict() for plan in plans])
+            entry = CatalogEntry(body, hashlib.blake2b(body, digest_size=16).hexdigest(), time.monotonic())
+            # A plan write committed while we were reading; serve this copy but do not keep it
+            if generation == self._generation:
+                self._entry = entry
+            return entry
+
+    def invalidate(self):
+        self._generation += 1
+        self._entry = None
+
+def setup_plan_catalog(app):
+    """Attach a PlanCatalog refreshed at least every PLAN_CATALOG_TTL seconds."""
+    catalog = PlanCatalog(ttl=float(app.config.get('PLAN_CATALOG_TTL', 60)))
+    app.extensions['plan_catalog'] = catalog
+    return catalog
+
+def get_plan_catalog():
+    """Return the current app's PlanCatalog."""
+    return current_app.extensions['plan_catalog']
+
+# Invalidate once the transaction that changed a plan commits, so no request
+# can cache the catalog as it was before the change
+
+def _plan_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['plan_catalog_dirty'] = True
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Subscription, _event, _plan_changed)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('plan_catalog_dirty', False) and has_app_context():
+        catalog = current_app.extensions.get('plan_catalog')
+        if catalog is not None:
+            catalog.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('plan_catalog_dirty', None)
@@ -0,0 +1,227 @@
+import os
+import math
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+
+from models import db, RefreshToken
+
+logger = logging.getLogger(__name__)
+
+# Re-read rows this far behind the last sync so writes committed late (or
+# stamped by a host with a slightly different clock) are not missed
+SYNC_OVERLAP = timedelta(seconds=30)
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings: no false negatives, ~error_rate false positives."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RefreshTokenIndex:
+    """Per-process index of issued and revoked refresh tokens.
+
+    refresh_tokens is the allow-list: a refresh token is honoured while its
+    row exists, is unexpired and has not been revoked. Rather than querying
+    it on every refresh, each process keeps a Bloom filter of issued jtis and
+    an exact map of revoked ones, brought up to date every sync_interval
+    seconds by a background thread that reads only rows created or revoked
+    since the previous sync.
+
+    A jti issued before the last sync is answered from memory: revoked or
+    missing from the filter is a rejection, a filter hit is an acceptance.
+    Only tokens issued since the last sync (by another process) are looked
+    up in refresh_tokens, and found rows are added to the filter. Two things
+    follow, both bounded by sync_interval: a revocation committed by another
+    process is honoured here after this process's next sync (revocations made
+    here apply at once), and a filter false positive (~0.1%) can only let
+    through a jti that is signed by us, unexpired and has no row, i.e. one
+    whose insert failed.
+
+    Expired rows are deleted by sweep_expired_tokens(), which runs in the
+    worker process (scripts/run_worker.py) rather than in every API process.
+    """
+
+    def __init__(self, app, sync_interval=5.0, capacity=100000):
+        self.app = app
+        self.sync_interval = sync_interval
+        self.capacity = capacity
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._reset_state()
+
+    def _reset_state(self):
+        self._bloom = None
+        self._revoked = {}        # jti -> expires_at
+        self._synced_until = None  # Every token issued before this is in the filter
+        self._stats = {'hits': 0, 'negative_hits': 0, 'revoked_hits': 0, 'db_lookups': 0}
+
+    # Lifecycle
+
+    def start(self):
+        """Start the sync thread in the current process (safe to call repeatedly)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._reset_state()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='refresh-token-index', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    try:
+                        self.sync()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                logger.error(f"Refresh token index sync failed: {str(e)}")
+            time.sleep(self.sync_interval)
+
+    # Background work
+
+    def sync(self):
+        """Load rows created or revoked since the last sync (everything on the first run)."""
+        now = datetime.utcnow()
+        query = db.session.query(RefreshToken.token, RefreshToken.expires_at, RefreshToken.revoked_at) \
+            .filter(RefreshToken.expires_at > now)
+
+        full = self._synced_until is None
+        if full:
+            rows = query.all()
+            bloom = BloomFilter(max(self.capacity, len(rows) * 2))
+        else:
+            since = self._synced_until - SYNC_OVERLAP
+            rows = query.filter(db.or_(RefreshToken.created_at >= since, RefreshToken.revoked_at >= since)).all()
+            bloom = self._bloom
+
+        revoked = {}
+        for token, expires_at, revoked_at in rows:
+            if revoked_at is not None:
+                revoked[token] = expires_at
+            elif token not in bloom:
+                bloom.add(token)
+
+        with self._lock:
+            self._bloom = bloom
+            self._revoked.update(revoked)
+            # Forget revocations of tokens that have expired anyway
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+            self._synced_until = now
+
+        # Rebuild from scratch once the filter holds more than it was sized for
+        if bloom.count > bloom.capacity:
+            with self._lock:
+                self._synced_until = None
+
+    # Checks
+
+    def is_valid(self, jti, issued_at):
+        """Whether the refresh token with this jti (issued at epoch seconds issued_at) is allowed."""
+        self.start()
+        with self._lock:
+            bloom, revoked, synced_until = self._bloom, self._revoked, self._synced_until
+
+        if jti in revoked:
+            self._stats['revoked_hits'] += 1
+            return False
+        if bloom is not None and synced_until is not None \
+                and datetime.utcfromtimestamp(issued_at) < synced_until - SYNC_OVERLAP:
+            # The last sync saw this token's row, if it has one
+            if jti in bloom:
+                self._stats['hits'] += 1
+                return True
+            self._stats['negative_hits'] += 1
+            return False
+
+        # Issued since the last sync, possibly by another process
+        self._stats['db_lookups'] += 1
+        token = RefreshToken.query.filter_by(token=jti).first()
+        if not token or not token.is_valid():
+            return False
+        self.add(jti)
+        return True
+
+    def add(self, jti):
+        """Record a token issued by this process."""
+        self.start()
+        with self._lock:
+            if self._bloom is not None and jti not in self._bloom:
+                self._bloom.add(jti)
+
+    def revoke(self, jti, expires_at):
+        """Record a revocation made by this process."""
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'filtered_tokens': self._bloom.count if self._bloom else 0,
+                'revoked_tokens': len(self._revoked),
+                'synced_until': self._synced_until
+            })
+        return stats
+
+def sweep_expired_tokens(batch_size=1000):
+    """Delete expired refresh tokens in batches, committing after each; returns how many."""
+    now = datetime.utcnow()
+    total = 0
+    while True:
+        ids = [row.id for row in db.session.query(RefreshToken.id)
+               .filter(RefreshToken.expires_at <= now).limit(batch_size)]
+        if not ids:
+            break
+        RefreshToken.query.filter(RefreshToken.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        total += len(ids)
+        if len(ids) < batch_size:
+            break
+    if total:
+        logger.info(f"Swept {total} expired refresh token(s)")
+    return total
+
+def setup_refresh_token_index(app):
+    """Attach a RefreshTokenIndex when REFRESH_TOKEN_SYNC_INTERVAL is positive.
+
+    With an interval of 0 every check reads refresh_tokens directly.
+    """
+    interval = float(app.config.get('REFRESH_TOKEN_SYNC_INTERVAL', 0))
+    if interval <= 0:
+        return None
+
+    index = RefreshTokenIndex(app, sync_interval=interval)
+    app.extensions['refresh_token_index'] = index
+    return index
+
+def get_refresh_token_index():
+    """Return the current app's RefreshTokenIndex, or None when it is off."""
+    return current_app.extensions.get('refresh_token_index')
@@ -0,0 +1,207 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, inspect, insert, literal, or_
+
+from models import (db, Campaign, CampaignMetric, CampaignMetricDaily, CampaignMetricMonthly,
+                    UserPlatformMetricDaily, UserPlatformMetricMonthly, RollupState, RollupInvalidation)
+from services.metrics_service import MetricsService, dialect_insert, truncate, to_datetime
+
+logger = logging.getLogger(__name__)
+
+# Re-scan this much history before the high-water mark so writes that
+# committed late (or on a host with a slightly different clock) are not missed
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+# Largest IN (...) list per statement
+CHUNK_SIZE = 500
+
+def next_month(bucket):
+    return (bucket + timedelta(days=32)).replace(day=1)
+
+def chunks(ids):
+    ids = sorted(ids)
+    for i in range(0, len(ids), CHUNK_SIZE):
+        yield ids[i:i + CHUNK_SIZE]
+
+class RollupService:
+    STATE_NAME = 'campaign_metrics'
+
+    @staticmethod
+    def refresh():
+        """Bring the daily and monthly rollups up to date with campaign_metrics.
+
+        Only buckets touched since the last refresh are rebuilt: hourly rows
+        with updated_at past the high-water mark mark their (campaign, day)
+        dirty, and dirty days mark their months and their owner's
+        (user, platform) rows dirty. Each dirty bucket is recomputed from the
+        level below with INSERT ... SELECT ... ON CONFLICT DO UPDATE, so
+        rebuilding a bucket twice is harmless; a user's rows for the bucket
+        are deleted first, so platforms the user no longer has campaigns on
+        do not keep their old totals.
+
+        Deleting a campaign or moving it to another platform leaves no trace
+        in campaign_metrics, so those write a rollup_invalidations row (see
+        the listeners below) and the user's per-platform rollups are rebuilt
+        whole. Returns counts of what was rebuilt.
+        """
+        started = datetime.utcnow()
+        state = db.session.get(RollupState, RollupService.STATE_NAME)
+        if state is None:
+            state = RollupState(name=RollupService.STATE_NAME)
+            db.session.add(state)
+
+        # Find (campaign, day) pairs with hourly writes since the high-water mark
+        day = MetricsService.bucket_expression(CampaignMetric.bucket_start, 'day')
+        query = db.session.query(CampaignMetric.campaign_id, day).distinct()
+        if state.high_water_mark is not None:
+            query = query.filter(or_(
+                CampaignMetric.updated_at > state.high_water_mark - REFRESH_OVERLAP,
+                CampaignMetric.updated_at.is_(None)
+            ))
+
+        dirty_days = {}
+        dirty_months = {}
+        for campaign_id, bucket in query:
+            bucket = to_datetime(bucket)
+            dirty_days.setdefault(bucket, set()).add(campaign_id)
+            dirty_months.setdefault(truncate(bucket, 'month'), set()).add(campaign_id)
+
+        invalidations = db.session.query(RollupInvalidation.id, RollupInvalidation.user_id).all()
+        invalidated_users = {user_id for _, user_id in invalidations}
+
+        # Owners of dirty campaigns, for the per-user/platform rollups
+        campaign_ids = set().union(*dirty_days.values()) if dirty_days else set()
+        owners = {}
+        for ids in chunks(campaign_ids):
+            owners.update(db.session.query(Campaign.id, Campaign.user_id).filter(Campaign.id.in_(ids)))
+
+        for bucket, ids in sorted(dirty_days.items()):
+            RollupService._rebuild_campaign_rollup(CampaignMetricDaily, CampaignMetric, bucket, bucket + timedelta(days=1), ids)
+        for bucket, ids in sorted(dirty_months.items()):
+            RollupService._rebuild_campaign_rollup(CampaignMetricMonthly, CampaignMetricDaily, bucket, next_month(bucket), ids)
+        for bucket, ids in sorted(dirty_days.items()):
+            users = {owners[cid] for cid in ids if cid in owners} - invalidated_users
+            RollupService._rebuild_user_daily(bucket, users)
+        for bucket, ids in sorted(dirty_months.items()):
+            users = {owners[cid] for cid in ids if cid in owners} - invalidated_users
+            RollupService._rebuild_user_monthly(bucket, users)
+        RollupService._rebuild_users(invalidated_users)
+        for ids in chunks([invalidation_id for invalidation_id, _ in invalidations]):
+            RollupInvalidation.query.filter(RollupInvalidation.id.in_(ids)).delete(synchronize_session=False)
+
+        state.high_water_mark = started
+        state.refreshed_at = started
+        db.session.commit()
+
+        result = {
+            'campaign_days': sum(len(ids) for ids in dirty_days.values()),
+            'campaign_months': sum(len(ids) for ids in dirty_months.values()),
+            'users': len(set(owners.values()) | invalidated_users),
+            'seconds': (datetime.utcnow() - started).total_seconds()
+        }
+        logger.info(f"Rollup refresh: {result}")
+        return result
+
+    @staticmethod
+    def _upsert_from_select(model, key_columns, select_query):
+        """Replace rollup rows with the result of an aggregate SELECT."""
+        table = model.__table__
+        columns = key_columns + ['impressions', 'clicks', 'spend']
+        stmt = dialect_insert()(table).from_select(columns, select_query)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={c: stmt.excluded[c] for c in ('impressions', 'clicks', 'spend')}
+        )
+        db.session.execute(stmt)
+
+    @staticmethod
+    def _rebuild_campaign_rollup(target, source, start, end, campaign_ids):
+        """Recompute target's [start, end) bucket for campaign_ids from the finer source table."""
+        for ids in chunks(campaign_ids):
+            select_query = db.select(
+                source.campaign_id,
+                literal(start, db.DateTime),
+                func.sum(source.impressions),
+                func.sum(source.clicks),
+                func.sum(source.spend)
+            ).where(
+                source.campaign_id.in_(ids),
+                source.bucket_start >= start,
+                source.bucket_start < end
+            ).group_by(source.campaign_id)
+            RollupService._upsert_from_select(target, ['campaign_id', 'bucket_start'], select_query)
+
+    @staticmethod
+    def _rebuild_user_daily(bucket, user_ids):
+        """Recompute users' per-platform totals for one day from the campaign daily rollup."""
+        for ids in chunks(user_ids):
+            UserPlatformMetricDaily.query.filter(
+                UserPlatformMetricDaily.user_id.in_(ids),
+                UserPlatformMetricDaily.bucket_start == bucket
+            ).delete(synchronize_session=False)
+            select_query = db.select(
+                Campaign.user_id,
+                Campaign.platform,
+                literal(bucket, db.DateTime),
+                func.sum(CampaignMetricDaily.impressions),
+                func.sum(CampaignMetricDaily.clicks),
+                func.sum(CampaignMetricDaily.spend)
+            ).join(Campaign, Campaign.id == CampaignMetricDaily.campaign_id).where(
+                Campaign.user_id.in_(ids),
+                CampaignMetricDaily.bucket_start == bucket
+            ).group_by(Campaign.user_id, Campaign.platform)
+            RollupService._upsert_from_select(UserPlatformMetricDaily, ['user_id', 'platform', 'bucket_start'], select_query)
+
+    @staticmethod
+    def _rebuild_user_monthly(bucket, user_ids):
+        """Recompute users' per-platform totals for one month from the user daily rollup."""
+        for ids in chunks(user_ids):
+            UserPlatformMetricMonthly.query.filter(
+                UserPlatformMetricMonthly.user_id.in_(ids),
+                UserPlatformMetricMonthly.bucket_start == bucket
+            ).delete(synchronize_session=False)
+            select_query = db.select(
+                UserPlatformMetricDaily.user_id,
+                UserPlatformMetricDaily.platform,
+                literal(bucket, db.DateTime),
+                func.sum(UserPlatformMetricDaily.impressions),
+                func.sum(UserPlatformMetricDaily.clicks),
+                func.sum(UserPlatformMetricDaily.spend)
+            ).where(
+                UserPlatformMetricDaily.user_id.in_(ids),
+                UserPlatformMetricDaily.bucket_start >= bucket,
+                UserPlatformMetricDaily.bucket_start < next_month(bucket)
+            ).group_by(UserPlatformMetricDaily.user_id, UserPlatformMetricDaily.platform)
+            RollupService._upsert_from_select(UserPlatformMetricMonthly, ['user_id', 'platform', 'bucket_start'], select_query)
+
+    @staticmethod
+    def _rebuild_users(user_ids):
+        """Recompute all of users' per-platform rollups, dropping buckets nothing contributes to any more."""
+        for ids in chunks(user_ids):
+            UserPlatformMetricDaily.query.filter(UserPlatformMetricDaily.user_id.in_(ids)).delete(synchronize_session=False)
+            UserPlatformMetricMonthly.query.filter(UserPlatformMetricMonthly.user_id.in_(ids)).delete(synchronize_session=False)
+            days = {to_datetime(bucket) for bucket, in db.session.query(CampaignMetricDaily.bucket_start).distinct()
+                    .join(Campaign, Campaign.id == CampaignMetricDaily.campaign_id).filter(Campaign.user_id.in_(ids))}
+            for bucket in sorted(days):
+                RollupService._rebuild_user_daily(bucket, ids)
+            for bucket in sorted({truncate(day, 'month') for day in days}):
+                RollupService._rebuild_user_monthly(bucket, ids)
+
+def _invalidate(connection, user_id):
+    connection.execute(insert(RollupInvalidation.__table__).values(user_id=user_id, created_at=datetime.utcnow()))
+
+@event.listens_for(Campaign, 'after_delete')
+def _campaign_deleted(mapper, connection, target):
+    _invalidate(connection, target.user_id)
+
+@event.listens_for(Campaign, 'after_update')
+def _campaign_updated(mapper, connection, target):
+    state = inspect(target)
+    for name in ('user_id', 'platform'):
+        history = state.attrs[name].history
+        if history.deleted:
+            # Its totals move between (user, platform) rows
+            _invalidate(connection, target.user_id)
+            if name == 'user_id':
+                _invalidate(connection, history.deleted[0])
+            return
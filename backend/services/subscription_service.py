@@ -0,0 +1,58 @@
+import time
+import logging
+from datetime import datetime
+from sqlalchemy import select, update
+
+from models import db, User
+
+logger = logging.getLogger(__name__)
+
+# Statuses that still grant access until subscription_end_date
+EXPIRING_STATUSES = ('active', 'canceled')
+
+class SubscriptionService:
+    @staticmethod
+    def expire_due(now=None, batch_size=5000, max_batches=None):
+        """Move subscriptions whose end date has passed to 'expired'.
+
+        Works in batches of one UPDATE ... WHERE id IN (SELECT ... LIMIT n)
+        each, committed separately, so no User objects are loaded, locks are
+        held briefly and an interrupted sweep just resumes on the next run.
+        The sub-select walks ix_users_subscription_status_end_date and skips
+        rows another transaction has locked (e.g. a renewal in progress);
+        the outer WHERE repeats the condition so a row renewed in the
+        meantime is left alone. Returns the row count and throughput.
+        """
+        now = now or datetime.utcnow()
+        due = db.and_(
+            User.subscription_status.in_(EXPIRING_STATUSES),
+            User.subscription_end_date <= now
+        )
+
+        started = time.perf_counter()
+        expired = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            batch_ids = select(User.id).where(due).limit(batch_size).with_for_update(skip_locked=True).scalar_subquery()
+            result = db.session.execute(
+                update(User)
+                .where(User.id.in_(batch_ids))
+                .where(due)
+                .values(subscription_status='expired'),
+                execution_options={'synchronize_session': False}
+            )
+            db.session.commit()
+            batches += 1
+            expired += result.rowcount
+            if result.rowcount < batch_size:
+                break
+
+        seconds = time.perf_counter() - started
+        if expired:
+            logger.info(f"Expired {expired} subscription(s) in {seconds:.3f}s")
+        return {
+            'expired': expired,
+            'batches': batches,
+            'seconds': seconds,
+            'rows_per_second': expired / seconds if seconds > 0 else 0.0
+        }
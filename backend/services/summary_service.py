@@ -0,0 +1,147 @@
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import event, func, case, inspect, select, update, bindparam
+
+from models import db, Campaign, CampaignSummary
+from services.metrics_service import dialect_insert
+
+summaries = CampaignSummary.__table__
+campaigns = Campaign.__table__
+
+class SummaryService:
+    """Maintains one materialized CampaignSummary row per user.
+
+    Campaign inserts, updates and deletes made through the ORM adjust the
+    row in the same transaction (see the listeners below), and bulk counter
+    increments call add_counter_deltas(). Rows are only ever adjusted, never
+    created, by those paths: a missing row is rebuilt from the campaigns
+    table the first time it is read. A row being rebuilt has a NULL
+    updated_at, which deltas leave alone, so readers rebuild it rather
+    than trust it.
+    """
+
+    @staticmethod
+    def get_summary(user_id):
+        """Return the user's summary, materializing it on first use."""
+        summary = db.session.get(CampaignSummary, user_id)
+        if summary is None or summary.updated_at is None:
+            summary = SummaryService.rebuild(user_id)
+        return summary
+
+    @staticmethod
+    def rebuild(user_id):
+        """Recompute a user's summary from their campaigns.
+
+        The row is created empty and committed first, so every campaign
+        write committed from then on adjusts it. It is then locked, which
+        waits out writers that adjusted it and have not committed, and
+        overwritten by one UPDATE whose subqueries read the campaigns as of
+        that moment. Each write is thus either counted by the subqueries
+        (and its delta overwritten) or applied as a delta afterwards, never
+        lost in between.
+        """
+        db.session.execute(
+            dialect_insert()(summaries).values(user_id=user_id, updated_at=None)
+            .on_conflict_do_nothing(index_elements=[summaries.c.user_id])
+        )
+        db.session.commit()
+
+        db.session.execute(select(summaries.c.user_id).where(summaries.c.user_id == user_id).with_for_update())
+
+        def total(expression, empty):
+            return select(func.coalesce(expression, empty)).where(campaigns.c.user_id == user_id).scalar_subquery()
+
+        db.session.execute(update(summaries).where(summaries.c.user_id == user_id).values(
+            campaign_count=total(func.count(campaigns.c.id), 0),
+            active_campaign_count=total(func.sum(case((campaigns.c.status == 'active', 1), else_=0)), 0),
+            total_budget=total(func.sum(campaigns.c.budget), 0.0),
+            impressions=total(func.sum(campaigns.c.impressions), 0),
+            clicks=total(func.sum(campaigns.c.clicks), 0),
+            spend=total(func.sum(campaigns.c.spend), 0.0),
+            updated_at=datetime.utcnow()
+        ))
+        db.session.commit()
+        return db.session.get(CampaignSummary, user_id, populate_existing=True)
+
+    @staticmethod
+    def add_counter_deltas(totals):
+        """Fold per-campaign counter increments into their owners' summaries.
+
+        totals maps campaign_id to {'impressions', 'clicks', 'spend'} as
+        produced by IngestionService.coalesce(). Issues one owner lookup and
+        one executemany UPDATE; the caller commits.
+        """
+        if not totals:
+            return
+
+        owners = db.session.query(Campaign.id, Campaign.user_id).filter(Campaign.id.in_(list(totals)))
+        per_user = {}
+        for campaign_id, user_id in owners:
+            delta = totals[campaign_id]
+            user_delta = per_user.setdefault(user_id, {'impressions': 0, 'clicks': 0, 'spend': 0.0})
+            user_delta['impressions'] += delta['impressions']
+            user_delta['clicks'] += delta['clicks']
+            user_delta['spend'] += delta['spend']
+
+        if per_user:
+            stmt = update(summaries).where(summaries.c.user_id == bindparam('b_user_id')).values(
+                impressions=summaries.c.impressions + bindparam('b_impressions'),
+                clicks=summaries.c.clicks + bindparam('b_clicks'),
+                spend=summaries.c.spend + bindparam('b_spend'),
+                updated_at=touched()
+            )
+            db.session.execute(stmt, [{
+                'b_user_id': user_id,
+                'b_impressions': delta['impressions'],
+                'b_clicks': delta['clicks'],
+                'b_spend': delta['spend']
+            } for user_id, delta in per_user.items()])
+
+def touched():
+    """New updated_at for an adjusted row; a row being rebuilt keeps its NULL."""
+    return case((summaries.c.updated_at.is_(None), None), else_=datetime.utcnow())
+
+def _apply_delta(connection, user_id, sign, campaign_count=0, active=0, budget=0.0, impressions=0, clicks=0, spend=0.0):
+    """Adjust a user's summary row in the flushing transaction (no-op if it is not materialized yet)."""
+    connection.execute(update(summaries).where(summaries.c.user_id == user_id).values(
+        campaign_count=summaries.c.campaign_count + sign * campaign_count,
+        active_campaign_count=summaries.c.active_campaign_count + sign * active,
+        total_budget=summaries.c.total_budget + sign * budget,
+        impressions=summaries.c.impressions + sign * impressions,
+        clicks=summaries.c.clicks + sign * clicks,
+        spend=summaries.c.spend + sign * spend,
+        updated_at=touched()
+    ))
+
+def _campaign_values(campaign):
+    return {
+        'campaign_count': 1,
+        'active': 1 if campaign.status == 'active' else 0,
+        'budget': campaign.budget or 0.0,
+        'impressions': campaign.impressions or 0,
+        'clicks': campaign.clicks or 0,
+        'spend': campaign.spend or 0.0
+    }
+
+@event.listens_for(Campaign, 'after_insert')
+def _campaign_inserted(mapper, connection, target):
+    _apply_delta(connection, target.user_id, 1, **_campaign_values(target))
+
+@event.listens_for(Campaign, 'after_delete')
+def _campaign_deleted(mapper, connection, target):
+    _apply_delta(connection, target.user_id, -1, **_campaign_values(target))
+
+@event.listens_for(Campaign, 'after_update')
+def _campaign_updated(mapper, connection, target):
+    state = inspect(target)
+    tracked = ('user_id', 'status', 'budget', 'impressions', 'clicks', 'spend')
+    if not any(state.attrs[name].history.has_changes() for name in tracked):
+        return
+
+    # Subtract the campaign as it was and add it back as it is now
+    previous = {}
+    for name in tracked:
+        history = state.attrs[name].history
+        previous[name] = history.deleted[0] if history.deleted else getattr(target, name)
+    _apply_delta(connection, previous['user_id'], -1, **_campaign_values(SimpleNamespace(**previous)))
+    _apply_delta(connection, target.user_id, 1, **_campaign_values(target))
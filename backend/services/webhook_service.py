@@ -0,0 +1,305 @@
+import os
+import json
+import random
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+
+from models import db, WebhookEvent
+from services.metrics_service import dialect_insert
+from services.payment_service import PaymentService, paypal_sdk
+
+logger = logging.getLogger(__name__)
+
+# Statuses a worker may pick up once next_attempt_at has passed
+RUNNABLE_STATUSES = ('pending', 'failed')
+
+# Headers PayPal signs a webhook with; kept with the body so it can be verified later
+PAYPAL_SIGNATURE_HEADERS = (
+    'Paypal-Transmission-Id', 'Paypal-Transmission-Time', 'Paypal-Transmission-Sig',
+    'Paypal-Cert-Url', 'Paypal-Auth-Algo'
+)
+
+class WebhookService:
+    """Inbox for payment provider webhooks and the handlers that apply them.
+
+    Routes only store the raw event, keyed by (provider, event_id) so a
+    redelivery is absorbed by the insert, and answer the provider straight
+    away. Handlers run later in the worker pool and settle payments through
+    PaymentService, whose updates are idempotent per external_payment_id, so
+    an event that is retried or reprocessed by hand is never applied twice.
+    """
+
+    @staticmethod
+    def receive(provider, event_id, event_type, payload):
+        """Store an event unless it was already received; returns True when it is new."""
+        insert = dialect_insert()
+        result = db.session.execute(
+            insert(WebhookEvent.__table__)
+            .values(
+                provider=provider,
+                event_id=event_id,
+                event_type=event_type,
+                payload=payload,
+                status='pending',
+                attempts=0,
+                next_attempt_at=datetime.utcnow(),
+                received_at=datetime.utcnow()
+            )
+            .on_conflict_do_nothing(index_elements=['provider', 'event_id'])
+        )
+        db.session.commit()
+
+        created = result.rowcount == 1
+        if created:
+            pool = get_webhook_workers()
+            if pool is not None:
+                pool.notify()
+            else:
+                WebhookService.process_due(max_attempts=int(current_app.config.get('WEBHOOK_MAX_ATTEMPTS', 8)), limit=1)
+        return created
+
+    @staticmethod
+    def handle(event):
+        """Apply one event; returns 'processed' or 'ignored'. The caller commits."""
+        handler = HANDLERS.get(event.provider)
+        if handler is None:
+            raise ValueError(f'No webhook handler for provider {event.provider}')
+        return handler(event)
+
+    @staticmethod
+    def handle_stripe(event):
+        data = json.loads(event.payload)
+        payment_intent = data['data']['object']
+
+        if data['type'] == 'payment_intent.succeeded':
+            metadata = payment_intent.get('metadata') or {}
+            payment = PaymentService.complete_payment(
+                payment_intent['id'],
+                user_id=metadata.get('user_id'),
+                subscription_id=metadata.get('subscription_id')
+            )
+            return 'processed' if payment else 'ignored'
+
+        if data['type'] == 'payment_intent.payment_failed':
+            return 'processed' if PaymentService.fail_payment(payment_intent['id']) else 'ignored'
+
+        return 'ignored'
+
+    @staticmethod
+    def handle_paypal(event):
+        stored = json.loads(event.payload)
+        headers = stored['headers']
+        webhook_id = os.getenv('PAYPAL_WEBHOOK_ID')
+        if not webhook_id:
+            raise ValueError('PAYPAL_WEBHOOK_ID is not set, cannot verify PayPal webhooks')
+
+        verified = paypal_sdk().WebhookEvent.verify(
+            headers.get('Paypal-Transmission-Id'),
+            headers.get('Paypal-Transmission-Time'),
+            webhook_id,
+            stored['body'],
+            headers.get('Paypal-Cert-Url'),
+            headers.get('Paypal-Transmission-Sig'),
+            headers.get('Paypal-Auth-Algo')
+        )
+        if not verified:
+            # Forged or corrupted; retrying will not change that
+            logger.warning(f"PayPal webhook {event.event_id} failed signature verification")
+            return 'ignored'
+
+        data = json.loads(stored['body'])
+        resource = data.get('resource') or {}
+        # Sales reference the payment created at checkout, which holds our pending row
+        payment_id = resource.get('parent_payment')
+        if not payment_id:
+            return 'ignored'
+
+        if data.get('event_type') == 'PAYMENT.SALE.COMPLETED':
+            return 'processed' if PaymentService.complete_payment(payment_id) else 'ignored'
+        if data.get('event_type') in ('PAYMENT.SALE.DENIED', 'PAYMENT.SALE.REVERSED'):
+            return 'processed' if PaymentService.fail_payment(payment_id) else 'ignored'
+        return 'ignored'
+
+    @staticmethod
+    def handle_mpesa(event):
+        data = json.loads(event.payload)
+        checkout_request_id = data.get('Body', {}).get('stkCallback', {}).get('CheckoutRequestID')
+        if not checkout_request_id:
+            return 'ignored'
+
+        # A non-zero ResultCode means the customer cancelled or the charge failed
+        if PaymentService.verify_mpesa_callback(data):
+            payment = PaymentService.complete_payment(checkout_request_id)
+        else:
+            payment = PaymentService.fail_payment(checkout_request_id)
+        return 'processed' if payment else 'ignored'
+
+    @staticmethod
+    def claim_next(lease):
+        """Lease the oldest due event to this worker, or return None when there is nothing to do.
+
+        The conditional UPDATE is the lock: of several workers racing for the
+        same row only one matches it. An event whose lease ran out (its worker
+        died mid-event) becomes claimable again.
+        """
+        now = datetime.utcnow()
+        due = db.or_(
+            db.and_(WebhookEvent.status.in_(RUNNABLE_STATUSES), WebhookEvent.next_attempt_at <= now),
+            db.and_(WebhookEvent.status == 'processing', WebhookEvent.locked_until < now)
+        )
+        candidates = [row.id for row in db.session.query(WebhookEvent.id)
+                      .filter(due).order_by(WebhookEvent.next_attempt_at).limit(10)]
+        db.session.rollback()
+
+        for event_id in candidates:
+            claimed = WebhookEvent.query.filter(WebhookEvent.id == event_id, due).update({
+                'status': 'processing',
+                'locked_until': now + timedelta(seconds=lease),
+                'attempts': WebhookEvent.attempts + 1
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return db.session.get(WebhookEvent, event_id)
+        return None
+
+    @staticmethod
+    def process(event, max_attempts=8, backoff=30.0):
+        """Run one claimed event and record its outcome.
+
+        The handler's payment changes commit together with the event's new
+        status. A failure is retried with exponential backoff and parked as
+        'dead' after max_attempts.
+        """
+        try:
+            event.status = WebhookService.handle(event)
+            event.processed_at = datetime.utcnow()
+            event.locked_until = None
+            event.last_error = None
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Webhook {event.provider}/{event.event_id} failed (attempt {event.attempts}): {str(e)}")
+
+            event = db.session.get(WebhookEvent, event.id)
+            event.status = 'dead' if event.attempts >= max_attempts else 'failed'
+            event.last_error = f'{type(e).__name__}: {e}'[:2000]
+            event.locked_until = None
+            delay = min(backoff * (2 ** (event.attempts - 1)), 6 * 3600) * random.uniform(0.8, 1.2)
+            event.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+            db.session.commit()
+            return False
+
+    @staticmethod
+    def process_due(max_attempts=8, lease=300.0, limit=None):
+        """Process due events in this thread until none are left (or limit is reached)."""
+        processed = 0
+        while limit is None or processed < limit:
+            event = WebhookService.claim_next(lease)
+            if event is None:
+                break
+            WebhookService.process(event, max_attempts=max_attempts)
+            processed += 1
+        return processed
+
+    @staticmethod
+    def requeue(statuses=('dead', 'failed'), provider=None):
+        """Make failed or dead events due again with a fresh attempt count; returns how many."""
+        query = WebhookEvent.query.filter(WebhookEvent.status.in_(statuses))
+        if provider:
+            query = query.filter(WebhookEvent.provider == provider)
+        count = query.update({
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': datetime.utcnow(),
+            'locked_until': None
+        }, synchronize_session=False)
+        db.session.commit()
+        return count
+
+HANDLERS = {
+    'stripe': WebhookService.handle_stripe,
+    'paypal': WebhookService.handle_paypal,
+    'mpesa': WebhookService.handle_mpesa
+}
+
+class WebhookWorkerPool:
+    """Threads that drain the webhook inbox.
+
+    Workers wake when a route stores a new event and otherwise poll every
+    poll_interval seconds, which also picks up retries whose backoff has
+    passed, events left by other processes and expired leases.
+    """
+
+    def __init__(self, app, workers=2, poll_interval=5.0, max_attempts=8, lease=300.0):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._threads = []
+
+    def start(self):
+        """Start the workers in the current process (safe to call repeatedly)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'webhook-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def notify(self):
+        """Wake the workers for a newly stored event."""
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    try:
+                        WebhookService.process_due(max_attempts=self.max_attempts, lease=self.lease)
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                logger.error(f"Webhook worker failed: {str(e)}")
+
+def setup_webhook_workers(app):
+    """Attach a WebhookWorkerPool when WEBHOOK_WORKERS is positive.
+
+    With 0 workers each event is processed in the request that received it,
+    after it has been stored.
+    """
+    workers = int(app.config.get('WEBHOOK_WORKERS', 0))
+    if workers <= 0:
+        return None
+
+    pool = WebhookWorkerPool(
+        app,
+        workers=workers,
+        poll_interval=float(app.config.get('WEBHOOK_POLL_INTERVAL', 5)),
+        max_attempts=int(app.config.get('WEBHOOK_MAX_ATTEMPTS', 8))
+    )
+    app.extensions['webhook_workers'] = pool
+    # Start in each worker process, so events stored while no process was running are picked up
+    app.before_request(pool.start)
+    return pool
+
+def get_webhook_workers():
+    """Return the current app's WebhookWorkerPool, or None when events are processed inline."""
+    return current_app.extensions.get('webhook_workers')
@@ -0,0 +1,76 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+# Add the backend directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models import db, User, Campaign, Targeting, Creative
+
+EMAIL = 'test@optimad.com'
+PASSWORD = 'test-password'
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build an API app on a throwaway SQLite file, with background work done inline."""
+    def make(**config):
+        settings = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+            'DB_ENGINE_PROFILE': 'dev',
+            'JWT_COOKIE_CSRF_PROTECT': False,
+            'PASSWORD_HASH_ROUNDS': 1000,
+            'PASSWORD_HASH_WORKERS': 0,
+            'CHECKOUT_WORKERS': 0,
+            'WEBHOOK_WORKERS': 0,
+            'COUNTER_BUFFER_FLUSH_INTERVAL': 0,
+            'COUNTER_BUFFER_JOURNAL_DIR': str(tmp_path / 'counter_journal'),
+            'REFRESH_TOKEN_SYNC_INTERVAL': 0
+        }
+        settings.update(config)
+        app = create_app(config=settings)
+        with app.app_context():
+            # Only the primary: db is shared, and remembers a replica bind from any earlier app
+            db.create_all(bind_key=None)
+        return app
+    return make
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def user(app):
+    with app.app_context():
+        user = User(email=EMAIL, role='user', subscription_status='free')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+@pytest.fixture
+def client(app, user):
+    """A test client logged in as the user fixture."""
+    client = app.test_client()
+    response = client.post('/auth/login', json={'email': EMAIL, 'password': PASSWORD})
+    assert response.status_code == 200
+    return client
+
+def add_campaigns(app, user_id, count, **fields):
+    """Campaigns with targeting and creative, as the list and detail endpoints serialize them."""
+    with app.app_context():
+        campaigns = []
+        for i in range(count):
+            campaign = Campaign(
+                user_id=user_id, name=f'Campaign {i}', objective='traffic', platform='google',
+                budget_type='daily', budget=10.0 + i, start_date=datetime(2024, 1, 1), **fields
+            )
+            campaign.targeting = Targeting(gender='all')
+            campaign.creative = Creative(headline=f'Headline {i}')
+            campaigns.append(campaign)
+        db.session.add_all(campaigns)
+        db.session.commit()
+        return [campaign.id for campaign in campaigns]
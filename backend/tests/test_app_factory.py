@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from app import create_app
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROVIDER_MODULES = ('stripe', 'paypalrestsdk', 'requests', 'email_validator')
+
+# Runs in a fresh interpreter so earlier imports by the test session do not count
+CHILD = """
+import sys, json
+import app
+built_on_import = 'app' in vars(app)
+application = app.create_app({{'SQLALCHEMY_DATABASE_URI': 'sqlite://'}}, role={role!r})
+print(json.dumps({{
+    'built_on_import': built_on_import,
+    'modules': sorted(name for name in sys.modules if name.split('.')[0] in {modules!r} or name.startswith('routes.')),
+    'rules': sorted(rule.rule for rule in application.url_map.iter_rules())
+}}))
+"""
+
+def start(role):
+    code = CHILD.format(role=role, modules=PROVIDER_MODULES + ('flask_migrate', 'flask_jwt_extended'))
+    result = subprocess.run([sys.executable, '-c', code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+@pytest.mark.parametrize('role', ['api', 'worker', 'cli'])
+def test_no_role_imports_the_provider_sdks_at_startup(role):
+    started = start(role)
+
+    assert not started['built_on_import']
+    assert not [name for name in started['modules'] if name.split('.')[0] in PROVIDER_MODULES]
+
+def test_only_the_api_registers_routes_and_only_the_cli_migrations():
+    api, worker, cli = start('api'), start('worker'), start('cli')
+
+    assert '/campaigns/' in api['rules'] and 'routes.campaigns' in api['modules']
+    for started in (worker, cli):
+        assert started['rules'] == ['/static/<path:filename>']
+        assert not [name for name in started['modules'] if name.startswith('routes.')]
+    assert 'flask_migrate' in cli['modules'] and 'flask_migrate' not in api['modules']
+    assert 'flask_jwt_extended' not in worker['modules']
+
+def test_config_overrides_the_environment(tmp_path):
+    app = create_app(config={'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'cli.db'}", 'REPLICA_MAX_LAG': 1.5}, role='cli')
+
+    assert app.config['APP_ROLE'] == 'cli'
+    assert app.config['REPLICA_MAX_LAG'] == 1.5
+
+def test_unknown_role_is_rejected():
+    with pytest.raises(ValueError, match="Unknown role 'web'"):
+        create_app(role='web')
@@ -0,0 +1,48 @@
+import base64
+import json
+
+import pytest
+
+from models import db, Campaign
+from conftest import add_campaigns
+
+def clear(app, campaign_ids, column):
+    """Leave the sort column empty on some campaigns, as rows written before it was populated are."""
+    with app.app_context():
+        db.session.execute(Campaign.__table__.update()
+                           .where(Campaign.__table__.c.id.in_(campaign_ids)).values({column: None}))
+        db.session.commit()
+
+def page_through(client, sort_by, sort_dir, per_page=3):
+    seen, cursor = [], ''
+    while True:
+        response = client.get(f'/campaigns/?sort_by={sort_by}&sort_dir={sort_dir}&per_page={per_page}&cursor={cursor}')
+        assert response.status_code == 200
+        data = response.get_json()
+        seen += [campaign['id'] for campaign in data['campaigns']]
+        if not data['pagination']['has_next']:
+            return seen
+        cursor = data['pagination']['next_cursor']
+
+@pytest.mark.parametrize('sort_dir', ['asc', 'desc'])
+@pytest.mark.parametrize('sort_by', ['status', 'created_at', 'clicks'])
+def test_cursor_pages_include_rows_without_a_sort_value(app, user, client, sort_by, sort_dir):
+    campaign_ids = add_campaigns(app, user, 10)
+    clear(app, campaign_ids[2:7], sort_by)  # Page boundaries fall among the NULLs
+
+    seen = page_through(client, sort_by, sort_dir)
+
+    assert sorted(seen) == campaign_ids
+
+def test_cursor_with_a_null_value_for_a_required_column_is_rejected(client):
+    payload = json.dumps({'s': 'id', 'd': 'desc', 'v': None, 'i': 5}).encode()
+    cursor = base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+    response = client.get(f'/campaigns/?sort_by=id&cursor={cursor}')
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('query', ['per_page=0&cursor=', 'per_page=-1', 'per_page=0'])
+def test_per_page_must_be_positive(client, query):
+    response = client.get(f'/campaigns/?{query}')
+
+    assert response.status_code == 400
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+from models import db, User, CampaignMetric
+from services.metrics_service import MetricsService
+from conftest import add_campaigns
+
+DAY = datetime(2024, 3, 4)
+
+@pytest.fixture
+def campaign_id(app, user):
+    campaign_id = add_campaigns(app, user, 1)[0]
+    with app.app_context():
+        MetricsService.record_metrics([
+            {'campaign_id': campaign_id, 'bucket_start': DAY.replace(hour=hour), 'impressions': 10, 'clicks': 1, 'spend': 0.5}
+            for hour in (9, 10, 23)
+        ] + [
+            {'campaign_id': campaign_id, 'bucket_start': DAY.replace(day=5, hour=1), 'impressions': 4, 'clicks': 0, 'spend': 0.25}
+        ])
+        db.session.commit()
+    return campaign_id
+
+def test_recording_the_same_bucket_adds_to_it(app, campaign_id):
+    with app.app_context():
+        MetricsService.record_metrics([
+            {'campaign_id': campaign_id, 'bucket_start': DAY.replace(hour=9), 'impressions': 5, 'clicks': 2, 'spend': 1.0}
+        ])
+        db.session.commit()
+
+        rows = CampaignMetric.query.filter_by(campaign_id=campaign_id, bucket_start=DAY.replace(hour=9)).all()
+        assert len(rows) == 1
+        assert (rows[0].impressions, rows[0].clicks, rows[0].spend) == (15, 3, 1.5)
+
+def test_hourly_buckets_are_summed_per_day(client, campaign_id):
+    response = client.get(f'/campaigns/{campaign_id}/metrics?from=2024-03-04T00:00:00Z&to=2024-03-06T00:00:00Z&granularity=day')
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['granularity'] == 'day'
+    assert [(m['bucket'], m['impressions'], m['clicks'], m['spend']) for m in body['metrics']] == [
+        ('2024-03-04T00:00:00', 30, 3, 1.5),
+        ('2024-03-05T00:00:00', 4, 0, 0.25)
+    ]
+
+def test_range_end_is_exclusive(client, campaign_id):
+    response = client.get(f'/campaigns/{campaign_id}/metrics?from=2024-03-04T09:00:00&to=2024-03-04T23:00:00&granularity=hour')
+
+    assert [m['bucket'] for m in response.get_json()['metrics']] == ['2024-03-04T09:00:00', '2024-03-04T10:00:00']
+
+@pytest.mark.parametrize('query, error', [
+    ('granularity=minute', 'Invalid granularity'),
+    ('from=yesterday', 'Invalid date format'),
+    ('from=2024-03-05T00:00:00&to=2024-03-04T00:00:00', "'from' must be before 'to'"),
+    ('from=2000-01-01T00:00:00&to=2024-01-01T00:00:00&granularity=hour', 'Range too large')
+])
+def test_bad_ranges_are_rejected(client, campaign_id, query, error):
+    response = client.get(f'/campaigns/{campaign_id}/metrics?{query}')
+
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
+
+def test_metrics_of_another_users_campaign_are_not_found(app, client):
+    with app.app_context():
+        other = User(email='other@optimad.com', role='user', subscription_status='free')
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+    campaign_id = add_campaigns(app, other_id, 1)[0]
+
+    assert client.get(f'/campaigns/{campaign_id}/metrics').status_code == 404
@@ -0,0 +1,97 @@
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from models import db, User, Campaign, Subscription
+from services.campaign_quota import CampaignQuota, CampaignLimitReached
+from conftest import add_campaigns
+
+@pytest.fixture
+def at_limit(app, user):
+    """The user fixture on a two-campaign plan with one slot left."""
+    with app.app_context():
+        plan = Subscription(name='Starter', price=5.0, duration_days=30, features='[]', max_campaigns=2)
+        db.session.add(plan)
+        db.session.flush()
+        db.session.get(User, user).subscription_id = plan.id
+        db.session.commit()
+    add_campaigns(app, user, 1)
+    return user
+
+def new_campaign(user_id, name):
+    return Campaign(user_id=user_id, name=name, objective='traffic', platform='google',
+                    budget_type='daily', budget=10.0, start_date=datetime(2024, 1, 1))
+
+def campaign_count(user_id):
+    db.session.expire_all()
+    return db.session.get(User, user_id).campaign_count
+
+def test_only_one_of_two_racing_inserts_takes_the_last_slot(app, at_limit):
+    with app.app_context():
+        first, second = Session(db.engine), Session(db.engine)
+        first.add(new_campaign(at_limit, 'First'))
+        first.flush()  # Holds the write lock until it commits
+
+        outcome = {}
+        def insert_second():
+            second.add(new_campaign(at_limit, 'Second'))
+            try:
+                second.flush()
+                second.commit()
+                outcome['second'] = 'created'
+            except CampaignLimitReached:
+                second.rollback()
+                outcome['second'] = 'refused'
+
+        thread = threading.Thread(target=insert_second)
+        thread.start()
+        thread.join(0.3)
+        assert thread.is_alive()  # Waiting on the first session's lock, not reading a stale count
+        first.commit()
+        thread.join()
+        first.close()
+        second.close()
+
+        assert outcome['second'] == 'refused'
+        assert Campaign.query.filter_by(user_id=at_limit).count() == 2
+        assert campaign_count(at_limit) == 2
+
+def test_concurrent_creates_over_the_api_stop_at_the_limit(app, client, at_limit):
+    barrier = threading.Barrier(2)
+    statuses = []
+    def create(name):
+        barrier.wait()
+        response = client.post('/campaigns/', json={
+            'name': name, 'objective': 'traffic', 'platform': 'google',
+            'budgetType': 'daily', 'budget': 10, 'startDate': '2024-01-01T00:00:00Z'
+        })
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=create, args=(f'Racing {i}',)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [201, 403]
+    with app.app_context():
+        assert Campaign.query.filter_by(user_id=at_limit).count() == 2
+        assert campaign_count(at_limit) == 2
+
+def test_recount_repairs_drifted_counters(app, user):
+    add_campaigns(app, user, 3)
+    with app.app_context():
+        db.session.execute(update(User.__table__).values(campaign_count=7))
+        db.session.commit()
+
+        assert CampaignQuota.recount(user) == 1
+        db.session.commit()
+        assert campaign_count(user) == 3
+
+        db.session.execute(update(User.__table__).values(campaign_count=0))
+        CampaignQuota.recount()
+        db.session.commit()
+        assert campaign_count(user) == 3
@@ -0,0 +1,69 @@
+import pytest
+
+import services.checkout_service as checkout_service
+from models import db, CheckoutJob, Payment, Subscription, User
+from services.checkout_service import CheckoutService
+
+@pytest.fixture
+def plan(app):
+    with app.app_context():
+        subscription = Subscription(name='Pro', price=10.0, duration_days=30, features='[]')
+        db.session.add(subscription)
+        db.session.commit()
+        return subscription.id
+
+def queue_job(user_id, plan_id, provider='stripe'):
+    job = CheckoutJob(user_id=user_id, subscription_id=plan_id, provider=provider)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+@pytest.mark.parametrize('wait', ['nan', 'inf', '-inf', 'soon'])
+def test_checkout_wait_must_be_a_finite_number(app, user, client, plan, wait):
+    with app.app_context():
+        job_id = queue_job(user, plan)
+    response = client.get(f'/subscriptions/checkout/{job_id}?wait={wait}')
+
+    assert response.status_code == 400
+
+def test_job_reported_timed_out_stays_failed(app, user, plan, monkeypatch):
+    def slow_provider(job, subscription, params):
+        # The client polls while the provider is slow, and is told the job timed out
+        assert CheckoutService.get_job(job.id, job.user_id, job_timeout=-1).status == 'failed'
+        return {'requestId': 'ws_CO_late'}, 'ws_CO_late'
+    monkeypatch.setitem(checkout_service.PROVIDERS, 'mpesa', slow_provider)
+
+    with app.app_context():
+        job_id = queue_job(user, plan, provider='mpesa')
+        CheckoutService.run(job_id)
+        db.session.expire_all()
+
+        job = db.session.get(CheckoutJob, job_id)
+        assert job.status == 'failed'
+        assert job.result is None
+        # The STK push went out, so the payment it started is kept for the callback
+        assert Payment.query.filter_by(external_payment_id='ws_CO_late').one().status == 'pending'
+
+    # The customer approves the push after all
+    callback = {'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_late', 'ResultCode': 0}}}
+    response = app.test_client().post('/subscriptions/webhook/mpesa', json=callback)
+    assert response.status_code == 200
+
+    with app.app_context():
+        assert Payment.query.filter_by(external_payment_id='ws_CO_late').one().status == 'completed'
+        subscriber = db.session.get(User, user)
+        assert subscriber.subscription_status == 'active'
+        assert subscriber.subscription_id == plan
+
+def test_job_finishing_in_time_succeeds(app, user, plan, monkeypatch):
+    monkeypatch.setitem(checkout_service.PROVIDERS, 'stripe',
+                        lambda job, subscription, params: ({'clientSecret': 'secret'}, 'pi_ok'))
+
+    with app.app_context():
+        job_id = queue_job(user, plan)
+        CheckoutService.run(job_id)
+
+        job = CheckoutService.get_job(job_id, user)
+        assert job.status == 'succeeded'
+        assert job.finished_at is not None
+        assert Payment.query.filter_by(external_payment_id='pi_ok').first() is not None
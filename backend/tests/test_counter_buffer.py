@@ -0,0 +1,99 @@
+import glob
+import os
+import shutil
+import importlib.util
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from models import db, Campaign, CounterFlush
+from services.counter_buffer import CounterBuffer
+from conftest import add_campaigns
+
+BUCKET = datetime(2024, 1, 1, 12)
+
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / 'journal')
+
+def make_buffer(app, journal_dir):
+    return CounterBuffer(app, journal_dir, flush_interval=3600)
+
+def events(campaign_id, impressions):
+    totals = {campaign_id: {'impressions': impressions, 'clicks': 0, 'spend': 0.0}}
+    buckets = {(campaign_id, BUCKET): {'impressions': impressions, 'clicks': 0, 'spend': 0.0}}
+    return totals, buckets, impressions
+
+def crash(buffer):
+    """Leave the buffer's files behind as a killed process would: unflushed, lock released."""
+    buffer._journal.close()
+    buffer._owner_lock.close()
+    buffer._pid = None  # Its flush thread and atexit hook no longer act for this process
+
+def impressions(campaign_id):
+    db.session.expire_all()
+    return db.session.get(Campaign, campaign_id).impressions
+
+def test_journal_of_a_crashed_writer_is_replayed_once(app, user, journal_dir):
+    campaign_id = add_campaigns(app, user, 1)[0]
+    with app.app_context():
+        # The writer ran in a process whose pid is alive again (this one): only its lock tells it is gone
+        writer = make_buffer(app, journal_dir)
+        writer.add(*events(campaign_id, 5))
+        writer.flush()  # Rotated into a committed segment
+        writer.add(*events(campaign_id, 7))
+        crash(writer)
+
+        recovering = make_buffer(app, journal_dir)
+        recovering.start()
+        segment = glob.glob(os.path.join(journal_dir, '*.claimed'))[0]
+        kept = shutil.copy(segment, os.path.join(journal_dir, 'kept'))
+        recovering.flush()
+        assert impressions(campaign_id) == 12
+
+        # The recovering process dies after committing but before deleting the file it replayed
+        name = os.path.basename(segment).rsplit('.', 2)[0]
+        os.rename(kept, os.path.join(journal_dir, f'{name}.segment'))
+        assert CounterFlush.query.filter_by(segment=name).count() == 1
+
+        assert make_buffer(app, journal_dir).recover() == 0
+        assert impressions(campaign_id) == 12
+        # Everything the crashed writer left has been cleaned up
+        assert not glob.glob(os.path.join(journal_dir, f'{writer._instance_id}.*'))
+
+def test_files_of_a_running_writer_are_left_alone(app, user, journal_dir):
+    campaign_id = add_campaigns(app, user, 1)[0]
+    with app.app_context():
+        writer = make_buffer(app, journal_dir)
+        writer.add(*events(campaign_id, 5))
+
+        assert make_buffer(app, journal_dir).recover() == 0
+        assert os.path.exists(writer._journal_path())
+
+        writer.close()
+        assert impressions(campaign_id) == 5
+
+def load_gunicorn_conf(app, monkeypatch):
+    # Without preload the config leaves the collector alone
+    monkeypatch.setenv('GUNICORN_PRELOAD', 'False')
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', os.path.join(app.root_path, 'gunicorn.conf.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_worker_exit_flushes_the_buffer(make_app, user, journal_dir, monkeypatch):
+    app = make_app(COUNTER_BUFFER_FLUSH_INTERVAL=3600, COUNTER_BUFFER_JOURNAL_DIR=journal_dir)
+    campaign_id = add_campaigns(app, user, 1)[0]
+    gunicorn_conf = load_gunicorn_conf(app, monkeypatch)
+
+    gunicorn_conf.post_worker_init(SimpleNamespace(wsgi=app))
+    buffer = app.extensions['counter_buffer']
+    buffer.add(*events(campaign_id, 3))
+    assert buffer.stats()['pending_events'] == 3
+
+    # Flushed by the exit hook, within graceful_timeout, not left to atexit
+    gunicorn_conf.worker_exit(SimpleNamespace(app=SimpleNamespace(wsgi=lambda: app)), None)
+
+    with app.app_context():
+        assert impressions(campaign_id) == 3
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from services.credential_cache import CredentialCache
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'credentials.db')
+
+class Provider:
+    """Hands out numbered tokens, slowly, and counts the calls."""
+
+    def __init__(self, expires_in=3600, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        with self._lock:
+            self.calls += 1
+            token = f'token-{self.calls}'
+        time.sleep(self.delay)
+        return token, self.expires_in
+
+def test_concurrent_checkouts_in_several_workers_refresh_once(path):
+    provider = Provider(delay=0.2)
+    workers = [CredentialCache(path) for _ in range(3)]  # Separate memory, shared store: like worker processes
+    barrier = threading.Barrier(12)
+    tokens = []
+
+    def checkout(cache):
+        barrier.wait()
+        tokens.append(cache.get('mpesa', provider.fetch))
+
+    threads = [threading.Thread(target=checkout, args=(workers[i % 3],)) for i in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert provider.calls == 1
+    assert tokens == ['token-1'] * 12
+    assert sum(cache.stats()['refreshes'] for cache in workers) == 1
+
+def test_token_is_reused_until_shortly_before_it_expires(path):
+    cache = CredentialCache(path, refresh_margin=60)
+
+    long_lived = Provider(expires_in=3600)
+    assert cache.get('mpesa', long_lived.fetch) == cache.get('mpesa', long_lived.fetch) == 'token-1'
+    assert long_lived.calls == 1
+    assert cache.stats()['memory_hits'] == 1
+
+    # Inside the margin: every get refreshes
+    short_lived = Provider(expires_in=30)
+    cache.invalidate('mpesa')
+    assert cache.get('mpesa', short_lived.fetch) == 'token-1'
+    assert cache.get('mpesa', short_lived.fetch) == 'token-2'
+
+def test_new_worker_reads_the_token_from_the_store(path):
+    provider = Provider()
+    CredentialCache(path).get('mpesa', provider.fetch)
+
+    fresh = CredentialCache(path)
+    assert fresh.get('mpesa', provider.fetch) == 'token-1'
+    assert provider.calls == 1
+    assert fresh.stats()['store_hits'] == 1
+
+def test_failed_refresh_releases_the_lock_and_is_retried(path):
+    cache, other = CredentialCache(path, busy_timeout=1), CredentialCache(path, busy_timeout=1)
+
+    def unreachable():
+        raise ConnectionError('oauth endpoint down')
+    with pytest.raises(ConnectionError):
+        cache.get('mpesa', unreachable)
+
+    # The write transaction was rolled back, so another worker is not kept waiting
+    provider = Provider()
+    assert other.get('mpesa', provider.fetch) == 'token-1'
+    assert cache.get('mpesa', provider.fetch) == 'token-1'
+    assert provider.calls == 1
+
+def test_rejected_token_is_refreshed_after_invalidate(path):
+    provider = Provider()
+    cache = CredentialCache(path)
+    cache.get('mpesa', provider.fetch)
+
+    cache.invalidate('mpesa')
+
+    assert cache.get('mpesa', provider.fetch) == 'token-2'
+    assert CredentialCache(path).get('mpesa', provider.fetch) == 'token-2'
@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from models import db, User
+from middleware.rbac import invalidate_claims
+from services.database import resolve_profile, get_database
+
+@pytest.mark.parametrize('url, profile', [
+    ('sqlite:///instance/optimad.db', 'sqlite-wal'),
+    ('sqlite://', 'dev'),
+    ('postgresql://optimad@db/optimad', 'postgres-prod'),
+    ('mysql://optimad@db/optimad', 'dev')
+])
+def test_auto_profile_follows_the_database(url, profile):
+    assert resolve_profile('auto', make_url(url)) == profile
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError, match='Unknown DB_ENGINE_PROFILE'):
+        resolve_profile('fast', make_url('sqlite://'))
+
+def test_sqlite_wal_profile_tunes_each_connection(make_app):
+    app = make_app(DB_ENGINE_PROFILE='sqlite-wal', DB_POOL_SIZE='3')
+    with app.app_context():
+        pragma = lambda name: db.session.execute(text(f'PRAGMA {name}')).scalar()
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1  # NORMAL
+        assert pragma('busy_timeout') == 15000
+        assert db.engine.pool.size() == 3  # Config overrides the profile
+        assert get_database().stats()['profile'] == 'sqlite-wal'
+
+def test_pool_checkout_waits_and_timeouts_are_counted(make_app):
+    app = make_app(DB_ENGINE_PROFILE='sqlite-wal', DB_POOL_SIZE=1, DB_POOL_TIMEOUT=0.1)
+    with app.app_context():
+        held = db.engine.connect()
+        with pytest.raises(PoolTimeoutError):
+            db.engine.connect()
+        held.close()
+        with db.engine.connect():
+            pass
+
+        checkout = get_database().stats()['primary']['checkout']
+        assert checkout['timeouts'] == 1
+        assert checkout['checkouts'] >= 2
+        assert checkout['wait_max_ms'] >= 0
+
+def test_database_stats_are_for_admins(app, user, client):
+    assert client.get('/db/stats').status_code == 403
+
+    with app.app_context():
+        db.session.get(User, user).role = 'admin'
+        invalidate_claims(user)
+        db.session.commit()
+    response = client.get('/db/stats')
+    assert response.status_code == 200
+    assert response.get_json()['profile'] == 'dev'
@@ -0,0 +1,74 @@
+import json
+
+from sqlalchemy import event
+
+import routes.campaigns
+from models import db, Campaign, CampaignMetric
+from conftest import add_campaigns
+
+def counters(campaign_id):
+    db.session.expire_all()
+    campaign = db.session.get(Campaign, campaign_id)
+    return campaign.impressions, campaign.clicks, campaign.spend
+
+def test_batch_is_coalesced_into_one_update_per_flush(app, user, client):
+    first, second = add_campaigns(app, user, 2)
+    batch = [
+        {'campaign_id': first, 'type': 'impression', 'count': 100, 'cost': 1.5, 'timestamp': '2024-03-04T09:10:00Z'},
+        {'campaign_id': first, 'type': 'impression', 'timestamp': '2024-03-04T09:50:00Z'},
+        {'campaign_id': first, 'type': 'click', 'cost': 0.25, 'timestamp': '2024-03-04T10:05:00Z'},
+        {'campaign_id': second, 'type': 'click', 'count': 3}
+    ]
+    updates = []
+    with app.app_context():
+        engine = db.engine
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE campaigns'):
+            updates.append(executemany)
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.post('/campaigns/events', json=batch)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200
+    assert response.get_json() == {'accepted': 4, 'rejected': 0, 'errors': []}
+    assert updates == [True]  # Both campaigns in one executemany
+    with app.app_context():
+        assert counters(first) == (101, 1, 1.75)
+        assert counters(second) == (0, 3, 0.0)
+        hours = CampaignMetric.query.filter_by(campaign_id=first).order_by(CampaignMetric.bucket_start).all()
+        assert [(h.bucket_start.hour, h.impressions, h.clicks) for h in hours] == [(9, 101, 0), (10, 0, 1)]
+
+def test_bad_events_are_rejected_and_the_rest_kept(app, user, client):
+    campaign_id = add_campaigns(app, user, 1)[0]
+    lines = [
+        json.dumps({'campaign_id': campaign_id, 'type': 'impression'}),
+        '{not json',
+        json.dumps({'campaign_id': campaign_id + 1000, 'type': 'impression'}),
+        json.dumps({'campaign_id': campaign_id, 'type': 'conversion'}),
+        json.dumps({'campaign_id': campaign_id, 'type': 'click', 'count': 0}),
+        json.dumps({'campaign_id': campaign_id, 'type': 'click', 'cost': -1}),
+        json.dumps({'campaign_id': campaign_id, 'type': 'click'})
+    ]
+
+    response = client.post('/campaigns/events', data='\n'.join(lines) + '\n', content_type='application/x-ndjson')
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body['accepted'], body['rejected']) == (2, 5)
+    assert [error['index'] for error in body['errors']] == [1, 2, 3, 4, 5]
+    assert body['errors'][1]['error'] == 'Unknown campaign'
+    with app.app_context():
+        assert counters(campaign_id) == (1, 1, 0.0)
+
+def test_malformed_and_oversized_batches_are_refused(app, user, client, monkeypatch):
+    campaign_id = add_campaigns(app, user, 1)[0]
+
+    assert client.post('/campaigns/events', json={'campaign_id': campaign_id}).status_code == 400
+
+    monkeypatch.setattr(routes.campaigns, 'MAX_BATCH_SIZE', 2)
+    response = client.post('/campaigns/events', json=[{'campaign_id': campaign_id, 'type': 'click'}] * 3)
+    assert response.status_code == 413
+    with app.app_context():
+        assert counters(campaign_id) == (0, 0, 0.0)
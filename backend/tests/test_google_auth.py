@@ -0,0 +1,164 @@
+import json
+import time
+
+import jwt
+import pytest
+import requests
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+import services.google_auth as google_auth
+from services.google_auth import GoogleTokenVerifier, InvalidGoogleToken
+
+CLIENT_ID = 'test-client.apps.googleusercontent.com'
+JWKS_URL = 'https://google.test/certs'
+TOKENINFO_URL = 'https://google.test/tokeninfo'
+
+def generate_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def jwk(private_key, kid):
+    data = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    data.update({'kid': kid, 'alg': 'RS256', 'use': 'sig'})
+    return data
+
+def sign(private_key, kid, **claims):
+    now = int(time.time())
+    payload = {
+        'iss': 'https://accounts.google.com',
+        'aud': CLIENT_ID,
+        'sub': '1234567890',
+        'email': 'google-user@optimad.com',
+        'iat': now,
+        'exp': now + 3600
+    }
+    payload.update(claims)
+    return jwt.encode(payload, private_key, algorithm='RS256', headers={'kid': kid})
+
+class StubResponse:
+    def __init__(self, data, status_code=200, headers=None):
+        self._data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} error')
+
+class StubGoogle:
+    """Stands in for the pooled 'google' HTTP client: serves a JWKS and tokeninfo."""
+
+    def __init__(self):
+        self.keys = []
+        self.jwks_down = False
+        self.tokeninfo = {}
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append(url)
+        if url == JWKS_URL:
+            if self.jwks_down:
+                raise requests.ConnectionError('JWKS unreachable')
+            return StubResponse({'keys': self.keys}, headers={'Cache-Control': 'public, max-age=3600'})
+        if url == TOKENINFO_URL:
+            data = self.tokeninfo.get(params['id_token'])
+            if data is None:
+                return StubResponse({'error_description': 'Invalid Value'}, status_code=400)
+            return StubResponse(data)
+        raise AssertionError(f'Unexpected request to {url}')
+
+@pytest.fixture
+def key():
+    return generate_key()
+
+@pytest.fixture
+def google(monkeypatch, key):
+    stub = StubGoogle()
+    stub.keys = [jwk(key, 'key-1')]
+    monkeypatch.setattr(google_auth, 'get_http_client', lambda provider: stub)
+    return stub
+
+@pytest.fixture
+def verifier(google):
+    return GoogleTokenVerifier([CLIENT_ID], JWKS_URL, TOKENINFO_URL)
+
+def test_valid_token_is_verified_locally(verifier, google, key):
+    claims = verifier.verify(sign(key, 'key-1'))
+    verifier.verify(sign(key, 'key-1', sub='other'))
+
+    assert claims['sub'] == '1234567890'
+    assert google.requests == [JWKS_URL]  # Keys fetched once, no tokeninfo round trip
+    assert verifier.stats()['local'] == 2
+
+@pytest.mark.parametrize('claims', [
+    {'aud': 'someone-else.apps.googleusercontent.com'},
+    {'iss': 'https://evil.example.com'},
+    {'iat': int(time.time()) - 7200, 'exp': int(time.time()) - 3600}
+], ids=['wrong aud', 'wrong iss', 'expired'])
+def test_bad_claims_are_rejected(verifier, key, claims):
+    with pytest.raises(InvalidGoogleToken):
+        verifier.verify(sign(key, 'key-1', **claims))
+    assert verifier.stats()['rejected'] == 1
+
+def test_forged_signature_is_rejected(verifier):
+    forged = sign(generate_key(), 'key-1')  # Right key id, someone else's key
+
+    with pytest.raises(InvalidGoogleToken):
+        verifier.verify(forged)
+
+def test_unknown_key_id_is_rejected(verifier, key):
+    with pytest.raises(InvalidGoogleToken, match='Unknown signing key'):
+        verifier.verify(sign(key, 'key-unknown'))
+
+def test_rotated_key_is_fetched_on_first_use(verifier, google, key, monkeypatch):
+    monkeypatch.setattr(google_auth, 'UNKNOWN_KID_REFETCH_INTERVAL', 0)
+    verifier.verify(sign(key, 'key-1'))
+
+    # Google publishes a new key and starts signing with it
+    new_key = generate_key()
+    google.keys = [jwk(key, 'key-1'), jwk(new_key, 'key-2')]
+    claims = verifier.verify(sign(new_key, 'key-2'))
+
+    assert claims['aud'] == CLIENT_ID
+    assert verifier.stats()['jwks_fetches'] == 2
+
+def test_tokeninfo_is_used_while_jwks_is_down(verifier, google, key):
+    google.jwks_down = True
+    token = sign(key, 'key-1')
+    google.tokeninfo[token] = {'aud': CLIENT_ID, 'sub': '1234567890', 'email': 'google-user@optimad.com'}
+
+    claims = verifier.verify(token)
+
+    assert claims['sub'] == '1234567890'
+    assert google.requests == [JWKS_URL, TOKENINFO_URL]
+    assert verifier.stats()['tokeninfo'] == 1
+
+def test_tokeninfo_fallback_still_checks_aud(verifier, google, key):
+    google.jwks_down = True
+    token = sign(key, 'key-1')
+    google.tokeninfo[token] = {'aud': 'someone-else.apps.googleusercontent.com', 'sub': '1234567890'}
+
+    with pytest.raises(InvalidGoogleToken):
+        verifier.verify(token)
+
+def test_cached_keys_are_kept_when_a_refresh_fails(verifier, google, key):
+    verifier.verify(sign(key, 'key-1'))
+    verifier._expires_at = 0.0  # Cache expired
+    google.jwks_down = True
+
+    assert verifier.verify(sign(key, 'key-1'))['sub'] == '1234567890'
+    assert verifier.stats()['tokeninfo'] == 0
+
+def test_google_login_creates_the_user(make_app, google, key):
+    app = make_app(GOOGLE_CLIENT_ID=CLIENT_ID, GOOGLE_JWKS_URL=JWKS_URL, GOOGLE_TOKENINFO_URL=TOKENINFO_URL)
+    client = app.test_client()
+
+    response = client.post('/auth/google', json={'token': sign(key, 'key-1', given_name='Ada')})
+    assert response.status_code == 200
+    assert response.get_json()['user']['email'] == 'google-user@optimad.com'
+
+    response = client.post('/auth/google', json={'token': sign(key, 'key-1', aud='someone-else')})
+    assert response.status_code == 401
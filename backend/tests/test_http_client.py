@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import services.payment_service as payment_service
+from services.http_client import HTTPClient, CircuitOpenError, get_http_client
+from services.payment_service import PaymentService
+
+class StubProvider(BaseHTTPRequestHandler):
+    """Answers from the server's routes: path -> (status, body, delay in seconds)."""
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.respond()
+
+    def respond(self):
+        self.server.hits.append((self.command, self.path))
+        status, body, delay = self.server.routes.get(self.path.split('?')[0], (404, {}, 0))
+        time.sleep(delay)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubProvider)
+    server.routes, server.hits = {}, []
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_slow_provider_times_out(stub):
+    stub.routes['/slow'] = (200, {}, 1.0)
+    client = HTTPClient('stub', read_timeout=0.2, retries=0)
+
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.get(f'{stub.url}/slow')
+    assert time.monotonic() - started < 0.9
+
+def test_unavailable_get_is_retried_but_post_is_not(stub):
+    stub.routes['/busy'] = (503, {}, 0)
+    client = HTTPClient('stub', retries=2, backoff=0.01)
+
+    assert client.get(f'{stub.url}/busy').status_code == 503
+    assert client.post(f'{stub.url}/busy').status_code == 503
+    assert stub.hits == [('GET', '/busy')] * 3 + [('POST', '/busy')]
+    assert client.stats()['retries'] == 2
+
+def test_circuit_opens_after_repeated_failures(stub):
+    stub.routes['/down'] = (500, {}, 0)
+    client = HTTPClient('stub', retries=0, failure_threshold=2, reset_timeout=60)
+    client.get(f'{stub.url}/down')
+    client.get(f'{stub.url}/down')
+
+    with pytest.raises(CircuitOpenError):
+        client.get(f'{stub.url}/down')
+    assert len(stub.hits) == 2
+    assert client.stats()['circuit'] == 'open'
+
+@pytest.fixture
+def sdks(monkeypatch, stub):
+    """Fresh provider SDK configuration pointed at the stub."""
+    monkeypatch.setenv('STRIPE_SECRET_KEY', 'sk_test_stub')
+    monkeypatch.setenv('STRIPE_API_BASE', stub.url)
+    monkeypatch.setenv('PAYPAL_CLIENT_ID', 'client')
+    monkeypatch.setenv('PAYPAL_CLIENT_SECRET', 'secret')
+    monkeypatch.setenv('PAYPAL_API_BASE', stub.url)
+    payment_service.stripe_sdk.cache_clear()
+    payment_service.paypal_sdk.cache_clear()
+    yield
+    payment_service.stripe_sdk.cache_clear()
+    payment_service.paypal_sdk.cache_clear()
+
+def test_stripe_calls_go_through_the_pooled_client(make_app, stub, sdks):
+    app = make_app(HTTP_STRIPE_READ_TIMEOUT=0.2, HTTP_STRIPE_RETRIES=0)
+    stub.routes['/v1/payment_intents'] = (200, {'id': 'pi_1', 'object': 'payment_intent', 'client_secret': 'cs_1'}, 0)
+
+    with app.app_context():
+        assert PaymentService.create_stripe_payment_intent(10.0) == {'clientSecret': 'cs_1', 'id': 'pi_1'}
+        assert get_http_client('stripe').stats()['requests'] == 1
+
+        # A provider that stops answering fails within the read timeout
+        stub.routes['/v1/payment_intents'] = (200, {}, 1.0)
+        started = time.monotonic()
+        with pytest.raises(ValueError, match='Payment processing failed'):
+            PaymentService.create_stripe_payment_intent(10.0)
+        assert time.monotonic() - started < 0.9
+        assert get_http_client('stripe').stats()['errors'] == 1
+
+def test_paypal_calls_go_through_the_pooled_client(make_app, stub, sdks):
+    app = make_app(HTTP_PAYPAL_BREAKER_THRESHOLD=1)
+    stub.routes['/v1/oauth2/token'] = (200, {'access_token': 'token', 'token_type': 'Bearer', 'expires_in': 3600}, 0)
+    stub.routes['/v1/payments/payment'] = (201, {
+        'id': 'PAY-1',
+        'links': [{'rel': 'approval_url', 'href': 'https://paypal.test/approve'}]
+    }, 0)
+
+    with app.app_context():
+        assert PaymentService.create_paypal_payment(10.0) == {'id': 'PAY-1', 'approvalUrl': 'https://paypal.test/approve'}
+        assert get_http_client('paypal').stats()['requests'] == 2  # Token, then the payment
+
+        # Once PayPal fails, further payments are refused without calling it
+        stub.routes['/v1/payments/payment'] = (500, {}, 0)
+        with pytest.raises(ValueError):
+            PaymentService.create_paypal_payment(10.0)
+        with pytest.raises(ValueError, match='circuit open'):
+            PaymentService.create_paypal_payment(10.0)
+        assert stub.hits.count(('POST', '/v1/payments/payment')) == 2
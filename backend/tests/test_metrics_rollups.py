@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import (db, Campaign, CampaignMetric, CampaignMetricDaily, CampaignMetricMonthly,
+                    UserPlatformMetricDaily, UserPlatformMetricMonthly)
+from services.metrics_service import MetricsService
+from services.rollup_service import RollupService
+from conftest import add_campaigns
+
+@pytest.fixture
+def metrics(app, user):
+    """Two hours of traffic a day for the last 100 days, rolled up."""
+    campaign_id = add_campaigns(app, user, 1)[0]
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    with app.app_context():
+        MetricsService.record_metrics([
+            {'campaign_id': campaign_id, 'bucket_start': today - timedelta(days=days, hours=-hour),
+             'impressions': 10, 'clicks': 1, 'spend': 0.5}
+            for days in range(1, 101) for hour in (3, 15)
+        ])
+        db.session.commit()
+        RollupService.refresh()
+        db.session.commit()
+    return campaign_id
+
+def hourly_only(campaign_id, start, end, granularity):
+    return MetricsService._query_metrics([('hour', CampaignMetric, [CampaignMetric.campaign_id == campaign_id])],
+                                         start, end, granularity)
+
+@pytest.mark.parametrize('granularity', ['day', 'week', 'month'])
+def test_unaligned_range_reads_the_rollups(app, user, metrics, granularity):
+    with app.app_context():
+        start = datetime.utcnow() - timedelta(days=95, minutes=17)  # Neither day- nor month-aligned
+        end = datetime.utcnow()
+        sources = [
+            ('month', CampaignMetricMonthly, [CampaignMetricMonthly.campaign_id == metrics]),
+            ('day', CampaignMetricDaily, [CampaignMetricDaily.campaign_id == metrics]),
+            ('hour', CampaignMetric, [CampaignMetric.campaign_id == metrics])
+        ]
+        refreshed_at = datetime.utcnow()
+        plan = MetricsService._plan(sources, start, end, granularity, refreshed_at)
+        models = [model for model, _, _, _ in plan]
+
+        assert CampaignMetricDaily in models
+        assert (CampaignMetricMonthly in models) == (granularity == 'month')
+        # The pieces tile the range without gaps or overlaps
+        pieces = sorted((piece_start, piece_stop) for _, _, piece_start, piece_stop in plan)
+        assert pieces[0][0] == start and pieces[-1][1] == end
+        assert all(a[1] == b[0] for a, b in zip(pieces, pieces[1:]))
+
+        expected = hourly_only(metrics, start, end, granularity)
+        assert MetricsService.get_campaign_metrics(metrics, start, end, granularity) == expected
+        assert MetricsService.get_user_metrics(user, start, end, granularity) == expected
+
+def test_range_inside_one_day_uses_the_hourly_table(app, metrics):
+    with app.app_context():
+        start = datetime.utcnow() - timedelta(days=3, hours=20)
+        plan = MetricsService._plan(
+            [('day', CampaignMetricDaily, []), ('hour', CampaignMetric, [])],
+            start, start + timedelta(hours=12), 'day', datetime.utcnow()
+        )
+
+        assert [model for model, _, _, _ in plan] == [CampaignMetric]
+
+def platform_totals(model, user_id):
+    rows = db.session.query(model.platform, db.func.sum(model.impressions)).filter_by(user_id=user_id) \
+        .group_by(model.platform).all()
+    return dict(rows)
+
+def test_platform_change_moves_the_rollup_totals(app, user, metrics):
+    other = add_campaigns(app, user, 1)[0]
+    with app.app_context():
+        MetricsService.record_metrics([{'campaign_id': other, 'bucket_start': datetime.utcnow() - timedelta(days=2),
+                                        'impressions': 1, 'clicks': 0, 'spend': 0.0}])
+        db.session.commit()
+        RollupService.refresh()
+        db.session.commit()
+        assert platform_totals(UserPlatformMetricDaily, user) == {'google': 2001}
+
+        db.session.get(Campaign, metrics).platform = 'facebook'
+        db.session.commit()
+        RollupService.refresh()
+        db.session.commit()
+
+        for model in (UserPlatformMetricDaily, UserPlatformMetricMonthly):
+            assert platform_totals(model, user) == {'google': 1, 'facebook': 2000}
+
+def test_deleted_campaign_leaves_the_rollups(app, user, metrics):
+    with app.app_context():
+        db.session.delete(db.session.get(Campaign, metrics))
+        db.session.commit()
+        RollupService.refresh()
+        db.session.commit()
+
+        for model in (UserPlatformMetricDaily, UserPlatformMetricMonthly):
+            assert platform_totals(model, user) == {}
+        start, end = datetime.utcnow() - timedelta(days=120), datetime.utcnow()
+        assert MetricsService.get_user_metrics(user, start, end, 'month') == []
@@ -0,0 +1,30 @@
+import os
+
+from flask_migrate import upgrade, downgrade
+from sqlalchemy import text
+
+from app import create_app
+from models import db
+
+BEFORE_UNIQUE_PAYMENTS = 'b83e5a0c9d14'
+UNIQUE_PAYMENTS = 'd52f8a1c6e90'
+
+def test_duplicate_payments_are_archived_not_lost(tmp_path):
+    app = create_app(config={'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'migrated.db'}"}, role='cli')
+    directory = os.path.join(app.root_path, 'migrations')
+    with app.app_context():
+        upgrade(directory=directory, revision=BEFORE_UNIQUE_PAYMENTS)
+        db.session.execute(text("INSERT INTO users (id, email, role, subscription_status) VALUES (1, 'a@optimad.com', 'user', 'free')"))
+        db.session.execute(text("INSERT INTO subscriptions (id, name, price, duration_days, features, max_campaigns) "
+                                "VALUES (1, 'Pro', 10, 30, '[]', 5)"))
+        for payment_id, reference in enumerate(['pi_1', 'pi_1', 'pi_2', 'pi_1', None, None], 1):
+            db.session.execute(text("INSERT INTO payments (id, user_id, subscription_id, amount, status, external_payment_id) "
+                                    "VALUES (:id, 1, 1, 10, 'completed', :reference)"), {'id': payment_id, 'reference': reference})
+        db.session.commit()
+
+        upgrade(directory=directory, revision=UNIQUE_PAYMENTS)
+        assert db.session.execute(text("SELECT id FROM payments ORDER BY id")).scalars().all() == [1, 3, 5, 6]
+        assert db.session.execute(text("SELECT id FROM payments_duplicates ORDER BY id")).scalars().all() == [2, 4]
+
+        downgrade(directory=directory, revision=BEFORE_UNIQUE_PAYMENTS)
+        assert db.session.execute(text("SELECT id FROM payments ORDER BY id")).scalars().all() == [1, 2, 3, 4, 5, 6]
@@ -0,0 +1,48 @@
+import os
+import signal
+
+import pytest
+
+from services.password_hasher import PasswordHasher
+from conftest import EMAIL, PASSWORD
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(rounds=1000, workers=1, queue_depth=0, timeout=30)
+    yield hasher
+    if hasher._executor is not None:
+        hasher._executor.shutdown()
+
+def test_login_is_refused_while_hashing_is_saturated(make_app, user):
+    app = make_app(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_DEPTH=0)
+    hasher = app.extensions['password_hasher']
+
+    hasher._slots.acquire()  # Another login holds the only slot
+    try:
+        response = app.test_client().post('/auth/login', json={'email': EMAIL, 'password': PASSWORD})
+    finally:
+        hasher._slots.release()
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert hasher.stats()['rejected'] == 1
+
+def test_login_uses_the_pool(make_app, user):
+    app = make_app(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_DEPTH=0)
+    try:
+        response = app.test_client().post('/auth/login', json={'email': EMAIL, 'password': PASSWORD})
+        assert response.status_code == 200
+    finally:
+        app.extensions['password_hasher']._executor.shutdown()
+
+def test_pool_is_replaced_after_a_worker_process_dies(hasher):
+    password_hash = hasher.hash('secret')
+
+    # The pool's only process is OOM-killed
+    for process in list(hasher._executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+    assert hasher.verify('secret', password_hash)
+    assert hasher.verify('wrong', password_hash) is False
+    assert hasher.stats()['restarts'] == 1
@@ -0,0 +1,60 @@
+import pytest
+
+from models import db, Subscription
+
+@pytest.fixture
+def plans(app):
+    with app.app_context():
+        plans = [Subscription(name='Basic', price=5.0, duration_days=30, features='[]'),
+                 Subscription(name='Pro', price=10.0, duration_days=30, features='[]')]
+        db.session.add_all(plans)
+        db.session.commit()
+        return [plan.id for plan in plans]
+
+def test_catalog_is_cacheable(app, plans):
+    response = app.test_client().get('/subscriptions/')
+
+    assert response.status_code == 200
+    assert [plan['name'] for plan in response.get_json()] == ['Basic', 'Pro']
+    assert response.headers['ETag']
+    assert 'public' in response.headers['Cache-Control']
+    assert f"max-age={app.config['PLAN_CATALOG_MAX_AGE']}" in response.headers['Cache-Control']
+
+def test_unchanged_catalog_is_revalidated_with_304(app, plans):
+    client = app.test_client()
+    etag = client.get('/subscriptions/').headers['ETag']
+
+    response = client.get('/subscriptions/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    response = client.get('/subscriptions/', headers={'If-None-Match': '"stale"'})
+    assert response.status_code == 200
+
+def test_plan_write_invalidates_the_catalog_on_commit(app, plans):
+    client = app.test_client()
+    etag = client.get('/subscriptions/').headers['ETag']
+
+    with app.app_context():
+        db.session.get(Subscription, plans[1]).price = 12.0
+        db.session.flush()
+        # Not committed yet: readers keep the cached copy
+        assert client.get('/subscriptions/', headers={'If-None-Match': etag}).status_code == 304
+        db.session.commit()
+
+    response = client.get('/subscriptions/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()[1]['price'] == 12.0
+
+def test_rolled_back_plan_write_keeps_the_catalog(app, plans):
+    client = app.test_client()
+    etag = client.get('/subscriptions/').headers['ETag']
+
+    with app.app_context():
+        db.session.get(Subscription, plans[1]).price = 12.0
+        db.session.flush()
+        db.session.rollback()
+
+    assert client.get('/subscriptions/', headers={'If-None-Match': etag}).status_code == 304
@@ -0,0 +1,57 @@
+import pytest
+
+from middleware.query_counter import QueryBudgetExceeded, query_budget
+from models import User
+from conftest import add_campaigns
+
+def test_campaign_list_query_count_does_not_grow_with_page_size(app, user, client):
+    add_campaigns(app, user, 2)
+    client.get('/campaigns/?per_page=2')  # Warms the per-worker caches (role claims, quotas)
+    small = client.get('/campaigns/?per_page=2')
+    add_campaigns(app, user, 48)
+    large = client.get('/campaigns/?per_page=50')
+
+    assert small.status_code == large.status_code == 200
+    assert len(large.get_json()['campaigns']) == 50
+    assert int(large.headers['X-Query-Count']) == int(small.headers['X-Query-Count']) <= 5
+
+def test_campaign_detail_stays_within_budget(app, user, client):
+    campaign_id = add_campaigns(app, user, 1)[0]
+    response = client.get(f'/campaigns/{campaign_id}')
+
+    assert response.status_code == 200
+    assert int(response.headers['X-Query-Count']) <= 3
+
+def test_statements_are_counted_once_with_several_apps(make_app, app, user, client):
+    add_campaigns(app, user, 3)
+    before = int(client.get('/campaigns/').headers['X-Query-Count'])
+    make_app()
+    make_app()
+    after = client.get('/campaigns/')
+
+    assert after.status_code == 200
+    assert int(after.headers['X-Query-Count']) == before
+
+def test_query_budget_raises_when_exceeded(app, user):
+    @app.route('/over-budget')
+    @query_budget(1)
+    def over_budget():
+        User.query.count()
+        User.query.count()
+        return 'ok'
+
+    with pytest.raises(QueryBudgetExceeded, match='2 queries'):
+        app.test_client().get('/over-budget')
+
+def test_query_budget_only_warns_when_not_strict(app, user):
+    app.config['QUERY_BUDGET_STRICT'] = False
+
+    @app.route('/over-budget')
+    @query_budget(0)
+    def over_budget():
+        User.query.count()
+        return 'ok'
+
+    response = app.test_client().get('/over-budget')
+    assert response.status_code == 200
+    assert response.headers['X-Query-Count'] == '1'
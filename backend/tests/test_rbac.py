@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+
+import pytest
+from flask_jwt_extended import jwt_required
+from sqlalchemy import event, update
+
+from models import db, User
+from middleware import rbac
+from middleware.rbac import invalidate_claims, load_current_user
+
+@pytest.fixture(autouse=True)
+def fresh_claims_versions():
+    rbac._claims_versions.clear()
+    yield
+    rbac._claims_versions.clear()
+
+@contextmanager
+def user_reads(app):
+    """Collect the SELECTs on users run inside the block."""
+    seen = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT') and 'FROM users' in statement:
+            seen.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield seen
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+def stats(client):
+    return client.get('/campaigns/events/stats')
+
+def test_permissions_are_checked_from_token_claims(app, client):
+    assert stats(client).status_code == 403  # Needs admin
+    with user_reads(app) as seen:
+        assert client.get('/campaigns/').status_code == 200
+    assert seen == []  # Claims version still cached from the first request
+
+def test_role_change_applies_to_tokens_minted_before_it(app, user, client):
+    with app.app_context():
+        db.session.get(User, user).role = 'admin'
+        invalidate_claims(user)
+        db.session.commit()
+
+    # The token still says 'user', but its version is stale: the row decides
+    assert stats(client).status_code == 200
+
+def test_role_change_in_another_process_applies_after_the_ttl(app, user, client):
+    assert stats(client).status_code == 403
+    with app.app_context():
+        # Another worker demotes the user: this process's cached version is untouched
+        db.session.execute(update(User.__table__).values(role='guest', claims_version=User.claims_version + 1))
+        db.session.commit()
+
+    assert client.post('/campaigns/events', json=[]).status_code == 200  # Still trusts the 'user' claim
+    app.config['CLAIMS_VERSION_TTL'] = 0
+    assert client.post('/campaigns/events', json=[]).status_code == 403  # Guests cannot edit
+
+def test_current_user_is_loaded_once_per_request(make_app, user, client):
+    other = make_app()  # Same database, not yet serving requests
+
+    @other.route('/whoami-twice')
+    @jwt_required()
+    def whoami_twice():
+        return {'same': load_current_user() is load_current_user(), 'id': load_current_user().id}
+
+    other_client = other.test_client()
+    other_client.set_cookie('access_token_cookie', client.get_cookie('access_token_cookie').value)
+    with user_reads(other) as seen:
+        response = other_client.get('/whoami-twice')
+
+    assert response.get_json() == {'same': True, 'id': user}
+    assert len(seen) == 1
+
+def test_requests_without_a_token_are_unauthorized(app):
+    assert stats(app.test_client()).status_code == 401
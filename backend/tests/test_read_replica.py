@@ -0,0 +1,78 @@
+import sqlite3
+import time
+
+import pytest
+
+from models import db, Campaign
+from middleware.read_replica import PIN_COOKIE
+from scripts.sqlite_replica import replicate
+from conftest import add_campaigns
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'primary.db'), str(tmp_path / 'replica.db')
+
+@pytest.fixture
+def app(make_app, paths):
+    """Read-only requests may use a replica file, copied from the primary by scripts/sqlite_replica.py."""
+    primary, replica = paths
+    return make_app(
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{primary}',
+        DATABASE_REPLICA_URL=f'sqlite:///{replica}',
+        REPLICA_MAX_LAG=5,
+        REPLICA_LAG_CHECK_INTERVAL=0
+    )
+
+@pytest.fixture
+def campaign_id(app, user, paths):
+    campaign_id = add_campaigns(app, user, 1)[0]
+    replicate(*paths, once=True)
+    # Written after the copy: only the primary has it
+    with app.app_context():
+        db.session.get(Campaign, campaign_id).name = 'Renamed'
+        db.session.commit()
+    return campaign_id
+
+def campaign_name(client, campaign_id):
+    response = client.get(f'/campaigns/{campaign_id}')
+    assert response.status_code == 200
+    return response.get_json()['name']
+
+def unpin(client):
+    client.delete_cookie(PIN_COOKIE)
+
+def test_read_only_requests_read_from_the_replica(app, client, campaign_id):
+    unpin(client)
+
+    assert campaign_name(client, campaign_id) == 'Campaign 0'
+    stats = app.extensions['read_replica'].stats()
+    assert stats['replica'] == 1 and stats['healthy']
+
+def test_client_is_pinned_to_the_primary_after_a_write(app, client, campaign_id):
+    # Logging in wrote (the refresh token), so the login response already pinned the client
+    assert client.get_cookie(PIN_COOKIE) is not None
+    assert campaign_name(client, campaign_id) == 'Renamed'
+
+    unpin(client)
+    response = client.put(f'/campaigns/{campaign_id}', json={'name': 'Edited'})
+    assert response.status_code == 200
+    assert float(client.get_cookie(PIN_COOKIE).value) > time.time()
+    assert campaign_name(client, campaign_id) == 'Edited'
+    assert app.extensions['read_replica'].stats()['pinned'] == 2
+
+def test_lagging_replica_falls_back_to_the_primary(app, client, campaign_id, paths):
+    unpin(client)
+    replica = sqlite3.connect(paths[1])
+    replica.execute("UPDATE replica_heartbeat SET copied_at = strftime('%s', 'now') - 60")
+    replica.commit()
+    replica.close()
+
+    assert campaign_name(client, campaign_id) == 'Renamed'
+    stats = app.extensions['read_replica'].stats()
+    assert stats['lagging'] == 1
+    assert not stats['healthy'] and stats['lag_seconds'] >= 60
+
+    # Once a fresh copy arrives, reads go back to the replica
+    replicate(*paths, once=True)
+    assert campaign_name(client, campaign_id) == 'Renamed'
+    assert app.extensions['read_replica'].stats()['replica'] == 1
@@ -0,0 +1,80 @@
+import time
+from datetime import datetime, timedelta
+
+from models import db, RefreshToken
+from services.refresh_token_index import RefreshTokenIndex, sweep_expired_tokens
+
+def issue(user_id, jti, expires_in=timedelta(days=1)):
+    db.session.add(RefreshToken(user_id=user_id, token=jti, expires_at=datetime.utcnow() + expires_in))
+    db.session.commit()
+
+def worker_index(app):
+    """An index as another gunicorn worker would hold it, synced now and not again during the test."""
+    index = RefreshTokenIndex(app, sync_interval=3600)
+    index.start()
+    index.sync()
+    return index
+
+def before_sync():
+    """issued_at of a token the last sync has seen."""
+    return time.time() - 60
+
+def test_token_seen_by_the_last_sync_is_answered_from_memory(app, user):
+    with app.app_context():
+        issue(user, 'jti-1')
+        index = worker_index(app)
+
+        assert index.is_valid('jti-1', before_sync())
+        assert index.stats()['db_lookups'] == 0
+        assert index.stats()['hits'] == 1
+
+def test_revocation_by_another_worker_applies_after_the_next_sync(app, user):
+    with app.app_context():
+        issue(user, 'jti-1')
+        index = worker_index(app)
+
+        # Another worker revokes it (logout): honoured here within one sync interval
+        RefreshToken.query.filter_by(token='jti-1').update({RefreshToken.revoked_at: datetime.utcnow()})
+        db.session.commit()
+        assert index.is_valid('jti-1', before_sync())
+
+        index.sync()
+        assert not index.is_valid('jti-1', before_sync())
+
+def test_revocation_by_this_worker_applies_at_once(app, user):
+    with app.app_context():
+        issue(user, 'jti-1')
+        index = worker_index(app)
+
+        index.revoke('jti-1', datetime.utcnow() + timedelta(days=1))
+
+        assert not index.is_valid('jti-1', before_sync())
+
+def test_token_issued_since_the_last_sync_is_looked_up(app, user):
+    with app.app_context():
+        index = worker_index(app)
+        issue(user, 'jti-new')  # By another worker
+
+        assert index.is_valid('jti-new', time.time())
+        assert not index.is_valid('jti-unknown', time.time())
+        assert index.stats()['db_lookups'] == 2
+        # Found rows go into the filter
+        assert index.is_valid('jti-new', before_sync())
+        assert index.stats()['db_lookups'] == 2
+
+def test_filter_miss_for_an_old_token_skips_the_database(app, user):
+    with app.app_context():
+        index = worker_index(app)
+
+        assert not index.is_valid('jti-never-issued', before_sync())
+        assert index.stats()['db_lookups'] == 0
+        assert index.stats()['negative_hits'] == 1
+
+def test_sweep_deletes_expired_tokens_in_batches(app, user):
+    with app.app_context():
+        for i in range(5):
+            issue(user, f'jti-expired-{i}', expires_in=timedelta(seconds=-1))
+        issue(user, 'jti-live')
+
+        assert sweep_expired_tokens(batch_size=2) == 5
+        assert [row.token for row in RefreshToken.query.all()] == ['jti-live']
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+import pytest
+
+import serializers
+from models import db, Campaign, Targeting
+from serializers import compile_serializer, json_dumps_bytes, JSON_LIST, NESTED
+from middleware.json_encoder import FastJSONProvider, StdlibJSONProvider
+from conftest import add_campaigns
+
+serialize_targeting = compile_serializer('targeting_test', (
+    ('campaignId', 'campaign_id'),
+    ('locations', 'locations', JSON_LIST),
+    ('gender', 'gender')
+))
+
+def test_serializer_reads_loaded_and_unloaded_attributes(app, user):
+    campaign_id = add_campaigns(app, user, 1)[0]
+    with app.app_context():
+        targeting = db.session.get(Campaign, campaign_id).targeting
+        targeting.locations = '["KE", "UG"]'
+        db.session.commit()  # Expires every attribute: the serializer has to load them
+        assert 'gender' not in targeting.__dict__
+
+        expected = {'campaignId': campaign_id, 'locations': ['KE', 'UG'], 'gender': 'all'}
+        assert serialize_targeting(targeting) == expected
+        assert serialize_targeting(targeting) == expected  # Now straight from __dict__
+
+def test_empty_json_list_and_missing_nested_object():
+    serialize = compile_serializer('nested_test', (('name', 'name'), ('targeting', 'targeting', NESTED)))
+
+    assert serialize_targeting(Targeting(gender='all'))['locations'] == []
+    assert serialize(Campaign(name='Draft')) == {'name': 'Draft', 'targeting': None}
+
+@pytest.mark.parametrize('codec', ['orjson', 'stdlib'])
+def test_datetimes_are_encoded_as_iso_8601(monkeypatch, codec):
+    if codec == 'stdlib':
+        monkeypatch.setattr(serializers, 'orjson', None)  # As when orjson is not installed
+    payload = {'at': datetime(2024, 1, 2, 3, 4, 5), 'n': 1}
+    assert json_dumps_bytes(payload) == b'{"at":"2024-01-02T03:04:05","n":1}'
+
+def test_both_encoders_send_the_same_campaigns(make_app, app, user, client):
+    add_campaigns(app, user, 3, end_date=datetime(2024, 2, 1))
+    assert isinstance(app.json, FastJSONProvider)
+    fast = client.get('/campaigns/')
+
+    stdlib_app = make_app(JSON_ENCODER='stdlib')
+    assert isinstance(stdlib_app.json, StdlibJSONProvider)
+    stdlib_client = stdlib_app.test_client()
+    stdlib_client.set_cookie('access_token_cookie', client.get_cookie('access_token_cookie').value)
+    stdlib = stdlib_client.get('/campaigns/')
+
+    assert fast.status_code == stdlib.status_code == 200
+    assert fast.get_json() == stdlib.get_json()
+    assert fast.get_json()['campaigns'][0]['end_date'] == '2024-02-01T00:00:00'
+
+def test_unknown_encoder_is_rejected(make_app):
+    with pytest.raises(ValueError, match='JSON_ENCODER'):
+        make_app(JSON_ENCODER='ujson')
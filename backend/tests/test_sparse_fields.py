@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db
+from conftest import add_campaigns
+
+@contextmanager
+def statements(app):
+    """Collect the SQL the app runs inside the block."""
+    seen = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield seen
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+def test_list_returns_only_the_requested_columns(app, user, client):
+    add_campaigns(app, user, 3)
+    client.get('/campaigns/')  # Warms the per-worker caches
+
+    with statements(app) as seen:
+        response = client.get('/campaigns/?fields=name,status,budget')
+
+    assert response.status_code == 200
+    campaigns = response.get_json()['campaigns']
+    assert len(campaigns) == 3
+    assert all(set(campaign) == {'id', 'name', 'status', 'budget'} for campaign in campaigns)
+    # Neither relationship is loaded, and unrequested columns are not selected
+    assert not any('FROM targeting' in statement or 'FROM creative' in statement for statement in seen)
+    assert not any('campaigns.objective' in statement for statement in seen)
+
+def test_detail_loads_only_the_requested_relationship(app, user, client):
+    campaign_id = add_campaigns(app, user, 1)[0]
+
+    response = client.get(f'/campaigns/{campaign_id}?fields=name,targeting')
+
+    assert response.status_code == 200
+    campaign = response.get_json()
+    assert set(campaign) == {'id', 'name', 'targeting'}
+    assert campaign['targeting']['gender'] == 'all'
+
+def test_full_object_without_fields(app, user, client):
+    campaign_id = add_campaigns(app, user, 1)[0]
+
+    campaign = client.get(f'/campaigns/{campaign_id}').get_json()
+
+    assert {'name', 'objective', 'targeting', 'creative'} <= set(campaign)
+
+def test_unknown_field_is_rejected(app, user, client):
+    add_campaigns(app, user, 1)
+
+    response = client.get('/campaigns/?fields=name,password')
+
+    assert response.status_code == 400
+    assert 'password' in response.get_json()['error']
@@ -0,0 +1,49 @@
+import uuid
+from datetime import datetime, timedelta
+
+from models import db, User
+from services.subscription_service import SubscriptionService
+
+NOW = datetime(2026, 6, 1, 12)
+
+def add_users(statuses_and_end_dates):
+    users = [User(email=f'{uuid.uuid4().hex}@optimad.com', role='user', subscription_status=status, subscription_end_date=end_date)
+             for status, end_date in statuses_and_end_dates]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+def statuses():
+    db.session.expire_all()
+    return {user.id: user.subscription_status for user in User.query.all()}
+
+def test_due_subscriptions_expire_in_batches(app):
+    with app.app_context():
+        due = add_users([('active', NOW - timedelta(days=1))] * 3 + [('canceled', NOW - timedelta(minutes=1))] * 2)
+        kept = add_users([
+            ('active', NOW + timedelta(days=30)),    # Renewed
+            ('canceled', NOW + timedelta(days=2)),   # Canceled, paid until later
+            ('free', None),
+            ('expired', NOW - timedelta(days=90))
+        ])
+        before = statuses()
+
+        result = SubscriptionService.expire_due(now=NOW, batch_size=2)
+
+        assert result['expired'] == 5
+        assert result['batches'] == 3  # 2 + 2 + 1
+        assert result['seconds'] >= 0 and result['rows_per_second'] >= 0
+        after = statuses()
+        assert all(after[user_id] == 'expired' for user_id in due)
+        assert all(after[user_id] == before[user_id] for user_id in kept)
+
+def test_max_batches_leaves_the_rest_for_the_next_run(app):
+    with app.app_context():
+        add_users([('active', NOW - timedelta(days=1))] * 5)
+
+        first = SubscriptionService.expire_due(now=NOW, batch_size=2, max_batches=1)
+        second = SubscriptionService.expire_due(now=NOW, batch_size=2)
+
+        assert (first['expired'], first['batches']) == (2, 1)
+        assert (second['expired'], second['batches']) == (3, 2)
+        assert SubscriptionService.expire_due(now=NOW, batch_size=2)['expired'] == 0
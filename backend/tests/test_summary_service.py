@@ -0,0 +1,72 @@
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Campaign, CampaignSummary
+from services.summary_service import SummaryService
+from conftest import add_campaigns
+
+def expected(user_id):
+    rows = Campaign.query.filter_by(user_id=user_id).all()
+    return (len(rows), sum(row.status == 'active' for row in rows), sum(row.budget for row in rows))
+
+def actual(summary):
+    return (summary.campaign_count, summary.active_campaign_count, summary.total_budget)
+
+def test_rebuild_matches_the_campaigns(app, user):
+    add_campaigns(app, user, 3)
+    add_campaigns(app, user, 2, status='active')
+    with app.app_context():
+        summary = SummaryService.get_summary(user)
+
+        assert summary.updated_at is not None
+        assert actual(summary) == expected(user)
+
+def test_campaign_committed_during_rebuild_is_counted(app, user):
+    add_campaigns(app, user, 2)
+    with app.app_context():
+        fired = []
+
+        def write_concurrently(session):
+            # Another request creates a campaign as soon as the rebuild has committed its empty row
+            if fired:
+                return
+            fired.append(True)
+            with Session(db.engine) as other:
+                other.add(Campaign(user_id=user, name='Concurrent', objective='traffic', platform='google',
+                                   budget_type='daily', budget=99.0, start_date=datetime(2024, 1, 1), status='active'))
+                other.commit()
+        event.listen(db.session, 'after_commit', write_concurrently)
+        try:
+            summary = SummaryService.get_summary(user)
+        finally:
+            event.remove(db.session, 'after_commit', write_concurrently)
+
+        assert fired
+        assert actual(summary) == expected(user) == (3, 1, 10.0 + 11.0 + 99.0)
+
+def test_row_left_mid_rebuild_is_rebuilt_on_read(app, user):
+    add_campaigns(app, user, 2)
+    with app.app_context():
+        # The empty row as rebuild() first commits it, then adjusted by a campaign write
+        db.session.execute(CampaignSummary.__table__.insert().values(user_id=user, updated_at=None))
+        db.session.commit()
+        db.session.expire_all()
+        add_campaigns(app, user, 1)
+
+        row = db.session.get(CampaignSummary, user, populate_existing=True)
+        assert row.updated_at is None and row.campaign_count == 1
+
+        assert actual(SummaryService.get_summary(user)) == expected(user)
+
+def test_deltas_keep_a_materialized_row_current(app, user):
+    add_campaigns(app, user, 2)
+    with app.app_context():
+        SummaryService.get_summary(user)
+        campaign = Campaign.query.filter_by(user_id=user).first()
+        campaign.status = 'active'
+        db.session.delete(Campaign.query.filter_by(user_id=user).all()[1])
+        db.session.commit()
+
+        assert actual(db.session.get(CampaignSummary, user, populate_existing=True)) == expected(user)
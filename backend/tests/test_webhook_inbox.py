@@ -0,0 +1,73 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import services.webhook_service as webhook_service
+from models import db, WebhookEvent
+from services.webhook_service import WebhookService
+
+def add_event(event_id='evt_1', provider='stripe'):
+    event = WebhookEvent(provider=provider, event_id=event_id, event_type='payment_intent.succeeded',
+                         payload=json.dumps({'type': 'payment_intent.succeeded'}), status='pending',
+                         attempts=0, next_attempt_at=datetime.utcnow() - timedelta(seconds=1))
+    db.session.add(event)
+    db.session.commit()
+    return event.id
+
+def make_due(event_id, column):
+    db.session.execute(db.update(WebhookEvent).where(WebhookEvent.id == event_id)
+                       .values({column: datetime.utcnow() - timedelta(seconds=1)}))
+    db.session.commit()
+
+@pytest.fixture
+def failing_handler(monkeypatch):
+    def fail(event):
+        raise ConnectionError('provider unreachable')
+    monkeypatch.setitem(webhook_service.HANDLERS, 'stripe', fail)
+
+def test_redelivered_event_is_stored_once(app):
+    body = json.dumps({'Body': {'stkCallback': {}}})
+    with app.app_context():
+        assert WebhookService.receive('mpesa', 'ws_1', None, body) is True
+        assert WebhookService.receive('mpesa', 'ws_1', None, body) is False
+
+        events = WebhookEvent.query.all()
+        assert len(events) == 1
+        assert events[0].status == 'ignored'  # Processed inline: no checkout request to settle
+
+def test_leased_event_is_claimed_by_one_worker_until_the_lease_runs_out(app):
+    with app.app_context():
+        event_id = add_event()
+
+        event = WebhookService.claim_next(lease=300)
+        assert (event.id, event.status, event.attempts) == (event_id, 'processing', 1)
+        assert WebhookService.claim_next(lease=300) is None
+
+        # Its worker died mid-event
+        make_due(event_id, 'locked_until')
+        event = WebhookService.claim_next(lease=300)
+        assert (event.id, event.attempts) == (event_id, 2)
+
+def test_failing_event_backs_off_then_goes_dead(app, failing_handler):
+    with app.app_context():
+        event_id = add_event()
+
+        before = datetime.utcnow()
+        assert WebhookService.process(WebhookService.claim_next(lease=300), max_attempts=2, backoff=30) is False
+        event = db.session.get(WebhookEvent, event_id)
+        assert event.status == 'failed'
+        assert event.last_error == 'ConnectionError: provider unreachable'
+        assert before + timedelta(seconds=24) <= event.next_attempt_at <= datetime.utcnow() + timedelta(seconds=36)
+        assert WebhookService.claim_next(lease=300) is None  # Not due until the backoff has passed
+
+        make_due(event_id, 'next_attempt_at')
+        WebhookService.process(WebhookService.claim_next(lease=300), max_attempts=2, backoff=30)
+        db.session.expire_all()
+        assert db.session.get(WebhookEvent, event_id).status == 'dead'
+        make_due(event_id, 'next_attempt_at')
+        assert WebhookService.claim_next(lease=300) is None
+
+        # Requeued by hand, it gets a fresh set of attempts
+        assert WebhookService.requeue() == 1
+        assert WebhookService.claim_next(lease=300).attempts == 1
@@ -17,6 +17,26 @@ export interface UserSubscription {
   plan: Subscription | null;
 }
 
+export interface CheckoutJob {
+  jobId: string;
+  provider: string;
+  status: 'queued' | 'running' | 'succeeded' | 'failed';
+  result: any;
+  error: string | null;
+}
+
+// Checkouts run in the background; wait for the provider's response, long-polling the job
+const waitForCheckout = async (job: CheckoutJob): Promise<any> => {
+  while (job.status !== 'succeeded') {
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Payment processing failed');
+    }
+    const response = await api.get(`/subscriptions/checkout/${job.jobId}`, { params: { wait: 20 } });
+    job = response.data;
+  }
+  return job.result;
+};
+
 export interface PaymentConfig {
   stripe: {
     publishableKey: string;
@@ -69,10 +89,10 @@ const subscriptionService = {
         subscriptionId,
         paymentMethodId
       });
-      return response.data;
+      return await waitForCheckout(response.data);
     } catch (error: any) {
       console.error('Error creating Stripe subscription:', error);
-      throw new Error(error.response?.data?.error || 'Failed to create subscription with Stripe');
+      throw new Error(error.response?.data?.error || error.message || 'Failed to create subscription with Stripe');
     }
   },
 
@@ -82,10 +102,10 @@ const subscriptionService = {
       const response = await api.post('/subscriptions/subscribe/paypal', {
         subscriptionId
       });
-      return response.data;
+      return await waitForCheckout(response.data);
     } catch (error: any) {
       console.error('Error creating PayPal subscription:', error);
-      throw new Error(error.response?.data?.error || 'Failed to create subscription with PayPal');
+      throw new Error(error.response?.data?.error || error.message || 'Failed to create subscription with PayPal');
     }
   },
 
@@ -96,10 +116,10 @@ const subscriptionService = {
         subscriptionId,
         phoneNumber
       });
-      return response.data;
+      return await waitForCheckout(response.data);
     } catch (error: any) {
       console.error('Error creating MPESA subscription:', error);
-      throw new Error(error.response?.data?.error || 'Failed to create subscription with MPESA');
+      throw new Error(error.response?.data?.error || error.message || 'Failed to create subscription with MPESA');
     }
   },
 